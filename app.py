@@ -1,152 +1,314 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import psycopg2
+from psycopg2.extras import Json, execute_values
 import os
 import json
-from datetime import datetime
+import atexit
+import base64
+import hashlib
+import time
+from datetime import datetime, date, timedelta
+
+import chat_partitions
+import compression
+import db
+import document_buffer
+import group_commit
+import metrics
+import migrations
+import realtime
+import task_stats
+from cache import TTLCache
+import text_ops
+from db import connection
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Database connection function
-def get_db_connection():
-    conn = psycopg2.connect(
-        host=os.environ.get('DB_HOST', 'localhost'),
-        database=os.environ.get('DB_NAME', 'ProjectSection'),
-        user=os.environ.get('DB_USER', 'postgres'),
-        password=os.environ.get('DB_PASSWORD', 'kavin'),
-        port=os.environ.get('DB_PORT', '5432')
-    )
-    conn.autocommit = True
-    return conn
-
-# Create tables if they don't exist
-def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Projects table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            id SERIAL PRIMARY KEY,
-            title VARCHAR(255) NOT NULL,
-            description TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Members table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS members (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            email VARCHAR(255) UNIQUE NOT NULL,
-            role VARCHAR(50) NOT NULL,
-            avatar TEXT
-        )
-    ''')
-    
-    # Tasks table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id SERIAL PRIMARY KEY,
-            title VARCHAR(255) NOT NULL,
-            description TEXT,
-            status VARCHAR(50) NOT NULL,
-            assignee_id INTEGER REFERENCES members(id),
-            due_date DATE,
-            priority VARCHAR(50) NOT NULL,
-            project_id INTEGER REFERENCES projects(id)
-        )
-    ''')
-    
-    # Documents table for collaborative editor content
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id SERIAL PRIMARY KEY,
-            project_id INTEGER REFERENCES projects(id),
-            text TEXT,
-            code TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Add chat_messages table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            id SERIAL PRIMARY KEY,
-            document_id INTEGER REFERENCES documents(id),
-            member_id INTEGER REFERENCES members(id),
-            message TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Search-Truncated'])  # Enable CORS for all routes
+
+@app.errorhandler(db.PoolTimeout)
+def pool_timeout(error):
+    return jsonify({'error': 'Database busy, try again'}), 503
+
+class BadRequest(Exception):
+    pass
+
+@app.errorhandler(BadRequest)
+def bad_request(error):
+    return jsonify({'error': str(error)}), 400
+
+# Schema (see migrations.py). Importing the app never touches the database;
+# `flask --app app migrate` applies migrations before a deploy, and each
+# worker checks the recorded version once, on its first request.
+# DB_AUTO_MIGRATE=1 lets that worker migrate instead (local development).
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '0').lower() not in ('0', 'false', 'no')
+schema_checked = False
+
+def run_migrations(log=print):
+    conn = db.connect()
+    try:
+        return migrations.migrate(conn, log)
+    finally:
+        conn.close()
+
+@app.before_request
+def require_schema():
+    global schema_checked
+    if schema_checked:
+        return None
+    if DB_AUTO_MIGRATE:
+        version = run_migrations(app.logger.info)
+    else:
+        with connection() as conn, conn.cursor() as cur:
+            version = migrations.current_version(cur)
+    # A newer schema is fine: migrations only add, and a rolling deploy
+    # migrates before the old workers are gone
+    if version < migrations.LATEST:
+        app.logger.error('database schema is at version %d, this code needs %d', version, migrations.LATEST)
+        return jsonify({
+            'error': f'Database schema is at version {version}, expected {migrations.LATEST}; '
+                     'run `flask --app app migrate`'
+        }), 503
+    chat_maintainer.start()
+    schema_checked = True
+    return None
+
+@app.cli.command('migrate')
+def migrate_schema():
+    """Apply pending schema migrations."""
+    version = run_migrations()
+    print(f'Schema is at version {version}')
+
+# Request metrics (see metrics.py), served at /metrics. METRICS_ENABLED=0
+# removes the hooks and the cursor wrapper entirely.
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            metrics.record_serialize(time.perf_counter() - start)
+
+def log_slow_request(stats, duration):
+    app.logger.warning('slow request %s', json.dumps({
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': stats.status,
+        'ms': round(duration * 1000, 2),
+        'dbMs': round(stats.db_seconds * 1000, 2),
+        'poolWaitMs': round(stats.pool_wait_seconds * 1000, 2),
+        'serializeMs': round(stats.serialize_seconds * 1000, 2),
+        'statements': stats.statements,
+        'queries': [{'sql': sql, 'ms': round(seconds * 1000, 2)} for sql, seconds in stats.queries]
+    }))
+
+if metrics.ENABLED:
+    app.json = TimedJSONProvider(app)
+    
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_token = metrics.start_request()
     
-    cur.close()
-    conn.close()
+    @app.after_request
+    def record_response_status(response):
+        stats = metrics.current()
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+    
+    @app.teardown_request
+    def finish_request_metrics(error):
+        token = g.pop('metrics_token', None)
+        if token is None:
+            return
+        # Streamed bodies are produced after this point and aren't included
+        stats, duration = metrics.finish_request(token, request.method, request.endpoint or 'unmatched')
+        if metrics.SLOW_REQUEST_MS and duration * 1000 >= metrics.SLOW_REQUEST_MS:
+            log_slow_request(stats, duration)
+
+# Response compression (see compression.py). Small bodies aren't worth the
+# CPU, and SSE is left alone so events aren't held back in a compressor.
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_MIMETYPES = {'application/json', 'text/plain'}
+COMPRESS_CHUNK_BYTES = 64 * 1024
+
+@app.after_request
+def compress_response(response):
+    if (response.mimetype not in COMPRESS_MIMETYPES or request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = compression.negotiate(request.accept_encodings)
+    if coding is None:
+        return response
+    if response.is_streamed:
+        chunks = response.iter_encoded()
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        chunks = (body[i:i + COMPRESS_CHUNK_BYTES] for i in range(0, len(body), COMPRESS_CHUNK_BYTES))
+    response.response = compression.compress_stream(chunks, coding)
+    response.headers['Content-Encoding'] = coding
+    response.headers.pop('Content-Length', None)
+    # The compressed bytes differ, so the ETag can only promise equivalence
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
-# Initialize database
-init_db()
+# Request bodies may be compressed too; this bounds what they expand to
+REQUEST_MAX_BYTES = int(os.environ.get('REQUEST_MAX_BYTES', 64 * 1024 * 1024))
+
+def request_json():
+    # request.json, honouring Content-Encoding: gzip, deflate or br
+    coding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if coding == 'identity':
+        return request.json
+    try:
+        body = compression.decompress(request.get_data(cache=False), coding, REQUEST_MAX_BYTES)
+        return json.loads(body)
+    except ValueError as e:
+        raise BadRequest(str(e) if not isinstance(e, json.JSONDecodeError) else 'Body is not valid JSON')
+
+def int_arg(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer')
+
+def flag_arg(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+def stream_json_array(rows, to_json, chunk_rows=500):
+    # Serialize rows from db.stream() as a JSON array, a chunk at a time.
+    # The first row is pulled eagerly so query errors still turn into
+    # normal error responses instead of a truncated 200.
+    first = next(rows, None)
+    
+    def encode(row):
+        return app.json.dumps(to_json(row), separators=(',', ':'))
+    
+    def generate():
+        if first is None:
+            yield '[]'
+            return
+        yield '[' + encode(first)
+        batch = []
+        for row in rows:
+            batch.append(encode(row))
+            if len(batch) >= chunk_rows:
+                yield ',' + ','.join(batch)
+                batch = []
+        yield (',' + ','.join(batch) if batch else '') + ']'
+    
+    response = Response(generate(), mimetype='application/json')
+    # Releases the connection even if the client goes away mid-stream
+    response.call_on_close(rows.close)
+    return response
+
+# Serialized bodies of hot, rarely written resources, keyed like
+# ('project', id). Writes invalidate their keys in this process; other
+# workers may serve the old body until the TTL runs out.
+response_cache = TTLCache(
+    maxsize=int(os.environ.get('RESPONSE_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 5))
+)
+not_modified_count = 0
+
+def not_modified(etag):
+    global not_modified_count
+    not_modified_count += 1
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def conditional_response(key, current_etag, load):
+    # current_etag(cur) -> ETag from a cheap version lookup, or None if missing
+    # load(cur) -> (etag, payload), or None if missing
+    # Returns None when the resource does not exist.
+    cached = response_cache.get(key)
+    if cached is None:
+        generation = response_cache.generation(key)
+        with connection() as conn, conn.cursor() as cur:
+            if request.if_none_match:
+                etag = current_etag(cur)
+                if etag is not None and request.if_none_match.contains_weak(etag):
+                    return not_modified(etag)
+            loaded = load(cur)
+        if loaded is None:
+            return None
+        etag, payload = loaded
+        cached = (etag, jsonify(payload).get_data())
+        response_cache.set(key, cached, generation)
+    
+    etag, body = cached
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 # API Routes for Projects
-@app.route('/api/projects', methods=['GET'])
-def get_projects():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, title, description, created_at, updated_at FROM projects')
-    projects = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return jsonify([{
+def project_to_json(project):
+    return {
         'id': project[0],
         'title': project[1],
         'description': project[2],
         'createdAt': project[3].isoformat() if project[3] else None,
         'updatedAt': project[4].isoformat() if project[4] else None
-    } for project in projects])
+    }
+
+@app.route('/api/projects', methods=['GET'])
+def get_projects():
+    if flag_arg('stream'):
+        return stream_json_array(db.stream(db.STATEMENTS['list_projects']), project_to_json)
+    
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'list_projects')
+        projects = cur.fetchall()
+    
+    return jsonify([project_to_json(project) for project in projects])
+
+def project_etag(project_id, updated_at):
+    return f"project-{project_id}-{updated_at.isoformat() if updated_at else ''}"
 
 @app.route('/api/projects/<int:project_id>', methods=['GET'])
 def get_project(project_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, title, description, created_at, updated_at FROM projects WHERE id = %s', (project_id,))
-    project = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if not project:
-        return jsonify({'error': 'Project not found'}), 404
+    def current_etag(cur):
+        db.execute(cur, 'project_updated_at', (project_id,))
+        row = cur.fetchone()
+        return project_etag(project_id, row[0]) if row else None
     
-    return jsonify({
-        'id': project[0],
-        'title': project[1],
-        'description': project[2],
-        'createdAt': project[3].isoformat() if project[3] else None,
-        'updatedAt': project[4].isoformat() if project[4] else None
-    })
+    def load(cur):
+        db.execute(cur, 'get_project', (project_id,))
+        project = cur.fetchone()
+        return (project_etag(project_id, project[4]), project_to_json(project)) if project else None
+    
+    response = conditional_response(('project', project_id), current_etag, load)
+    if response is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return response
 
 @app.route('/api/projects', methods=['POST'])
 def create_project():
     data = request.json
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute(
-        'INSERT INTO projects (title, description) VALUES (%s, %s) RETURNING id, created_at, updated_at',
-        (data['title'], data.get('description', ''))
-    )
-    project_id, created_at, updated_at = cur.fetchone()
-    
-    # Create initial empty document for the project
-    cur.execute(
-        'INSERT INTO documents (project_id, text, code) VALUES (%s, %s, %s)',
-        (project_id, '# Project Notes\n\nThis is a collaborative space for the team to share notes and ideas.', '// Example code')
-    )
-    
-    cur.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'insert_project', (data['title'], data.get('description', '')))
+        project_id, created_at, updated_at = cur.fetchone()
+        
+        # Create initial empty document for the project
+        db.execute(cur, 'insert_document', (
+            project_id,
+            '# Project Notes\n\nThis is a collaborative space for the team to share notes and ideas.',
+            '// Example code'
+        ))
     
     return jsonify({
         'id': project_id,
@@ -159,23 +321,14 @@ def create_project():
 @app.route('/api/projects/<int:project_id>', methods=['PUT'])
 def update_project(project_id):
     data = request.json
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute(
-        'UPDATE projects SET title = %s, description = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING updated_at',
-        (data['title'], data.get('description', ''), project_id)
-    )
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'update_project', (data['title'], data.get('description', ''), project_id))
+        updated_at = cur.fetchone()
+    response_cache.invalidate(('project', project_id))
     
-    updated_at = cur.fetchone()
     if not updated_at:
-        cur.close()
-        conn.close()
         return jsonify({'error': 'Project not found'}), 404
     
-    cur.close()
-    conn.close()
-    
     return jsonify({
         'id': project_id,
         'title': data['title'],
@@ -184,59 +337,84 @@ def update_project(project_id):
     })
 
 # API Routes for Members
-@app.route('/api/members', methods=['GET'])
-def get_members():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, name, email, role, avatar FROM members')
-    members = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return jsonify([{
+def member_to_json(member):
+    return {
         'id': member[0],
         'name': member[1],
         'email': member[2],
         'role': member[3],
         'avatar': member[4]
-    } for member in members])
+    }
+
+# Sender name/avatar for chat messages, so history reads skip the join.
+# The TTL bounds staleness when another worker deletes a member.
+member_cache = TTLCache(
+    maxsize=int(os.environ.get('MEMBER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('MEMBER_CACHE_TTL', 300))
+)
+
+def lookup_members(cur, member_ids):
+    # Returns {member_id: (name, avatar)}; unknown ids are left out
+    found, missing = {}, []
+    for member_id in set(member_ids):
+        member = member_cache.get(member_id)
+        if member is None:
+            missing.append(member_id)
+        else:
+            found[member_id] = member
+    if missing:
+        db.execute(cur, 'get_members_by_id', (missing,))
+        for member_id, name, avatar in cur.fetchall():
+            found[member_id] = (name, avatar)
+            member_cache.set(member_id, (name, avatar))
+    return found
+
+@app.route('/api/members', methods=['GET'])
+def get_members():
+    if flag_arg('stream'):
+        return stream_json_array(db.stream(db.STATEMENTS['list_members']), member_to_json)
+    
+    def current_etag(cur):
+        db.execute(cur, 'members_version')
+        row = cur.fetchone()
+        return f'members-{row[0] if row else 0}'
+    
+    def load(cur):
+        # Version first: if a write sneaks in between, the ETag is older than
+        # the body and the next conditional request just gets a 200
+        etag = current_etag(cur)
+        db.execute(cur, 'list_members')
+        return etag, [member_to_json(member) for member in cur.fetchall()]
+    
+    return conditional_response(('members',), current_etag, load)
 
 @app.route('/api/members', methods=['POST'])
 def create_member():
     data = request.json
-    conn = get_db_connection()
-    cur = conn.cursor()
     
     try:
-        cur.execute(
-            'INSERT INTO members (name, email, role, avatar) VALUES (%s, %s, %s, %s) RETURNING id',
-            (data['name'], data['email'], data['role'], data.get('avatar'))
-        )
-        member_id = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        
-        return jsonify({
-            'id': member_id,
-            'name': data['name'],
-            'email': data['email'],
-            'role': data['role'],
-            'avatar': data.get('avatar')
-        }), 201
+        with connection() as conn, conn.cursor() as cur:
+            db.execute(cur, 'insert_member', (data['name'], data['email'], data['role'], data.get('avatar')))
+            member_id = cur.fetchone()[0]
     except psycopg2.errors.UniqueViolation:
-        cur.close()
-        conn.close()
         return jsonify({'error': 'Email already exists'}), 400
+    response_cache.invalidate(('members',))
+    
+    return jsonify({
+        'id': member_id,
+        'name': data['name'],
+        'email': data['email'],
+        'role': data['role'],
+        'avatar': data.get('avatar')
+    }), 201
 
 @app.route('/api/members/<int:member_id>', methods=['DELETE'])
 def delete_member(member_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('DELETE FROM members WHERE id = %s RETURNING id', (member_id,))
-    deleted = cur.fetchone()
-    cur.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'delete_member', (member_id,))
+        deleted = cur.fetchone()
+    member_cache.delete(member_id)
+    response_cache.invalidate(('members',))
     
     if not deleted:
         return jsonify({'error': 'Member not found'}), 404
@@ -244,20 +422,26 @@ def delete_member(member_id):
     return jsonify({'message': 'Member deleted successfully'})
 
 # API Routes for Tasks
-@app.route('/api/tasks', methods=['GET'])
-def get_tasks():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT id, title, description, status, assignee_id, 
-               due_date, priority, project_id
-        FROM tasks
-    ''')
-    tasks = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return jsonify([{
+TASKS_PAGE_SIZE = 100
+TASKS_MAX_PAGE_SIZE = 500
+
+# High first. Must match tasks_project_priority_rank_idx (migration 4)
+# character for character, or the index can't serve the sort.
+PRIORITY_RANK = "(CASE priority WHEN 'High' THEN 1 WHEN 'Medium' THEN 2 WHEN 'Low' THEN 3 ELSE 4 END)"
+
+# Sort expressions accepted by GET /api/tasks, all ascending. Every ordering
+# ends with id so the keyset cursor is unambiguous, and one direction
+# throughout lets the cursor be a row comparison, which Postgres turns into
+# an index range.
+TASK_SORTS = {
+    'id': None,
+    'dueDate': 'due_date',
+    'priority': PRIORITY_RANK,
+    'title': 'title',
+}
+
+def task_to_json(task):
+    return {
         'id': task[0],
         'title': task[1],
         'description': task[2],
@@ -266,18 +450,113 @@ def get_tasks():
         'dueDate': task[5].isoformat() if task[5] else None,
         'priority': task[6],
         'projectId': task[7]
-    } for task in tasks])
+    }
 
-# Replace the current create_task function with this fixed version
+def encode_cursor(sort, key, task_id):
+    raw = json.dumps([sort, key, task_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
 
-@app.route('/api/tasks', methods=['POST'])
-def create_task():
-    data = request.json
-    conn = get_db_connection()
-    cur = conn.cursor()
+def decode_cursor(token, sort):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort, key, task_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise BadRequest('Invalid cursor')
+    if cursor_sort != sort or not isinstance(task_id, int):
+        raise BadRequest('Cursor does not match sort order')
+    return key, task_id
+
+def build_task_query(args):
+    # Returns (sql, params, sort, limit); limit is None for ?all=true
+    sort = args.get('sort', 'id')
+    if sort not in TASK_SORTS:
+        raise BadRequest(f"sort must be one of {', '.join(TASK_SORTS)}")
+    expression = TASK_SORTS[sort]
+    
+    where, params = [], []
+    project_id = int_arg('project_id')
+    if project_id is not None:
+        where.append('project_id = %s')
+        params.append(project_id)
+    statuses = args.getlist('status')
+    if statuses:
+        where.append('status = ANY(%s)')
+        params.append(statuses)
+    priorities = args.getlist('priority')
+    if priorities:
+        where.append('priority = ANY(%s)')
+        params.append(priorities)
+    assignee = args.get('assignee')
+    if assignee == 'unassigned':
+        where.append('assignee_id IS NULL')
+    elif assignee:
+        where.append('assignee_id = %s')
+        params.append(int_arg('assignee'))
+    
+    unbounded = flag_arg('all')
+    after = args.get('after')
+    # NULL due dates sort last. An OR with IS NULL can't be an index range,
+    # so past a dated cursor the NULL tail is read by a second branch.
+    null_tail = False
+    if after and not unbounded:
+        key, last_id = decode_cursor(after, sort)
+        if expression is None:
+            where.append('id > %s')
+            params.append(last_id)
+        elif sort == 'dueDate' and key is None:
+            where.append('due_date IS NULL AND id > %s')
+            params.append(last_id)
+        else:
+            where.append(f'({expression}, id) > (%s, %s)')
+            params.extend([key, last_id])
+            null_tail = sort == 'dueDate'
+    
+    order = 'id' if expression is None else f'{expression}, id'
+    columns = f'id, title, description, status, assignee_id, due_date, priority, project_id, {expression or "id"} AS sort_key'
+    sql = f'SELECT {columns} FROM tasks'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {order}'
+    
+    limit = None
+    if not unbounded:
+        limit = int_arg('limit') or TASKS_PAGE_SIZE
+        limit = max(1, min(limit, TASKS_MAX_PAGE_SIZE))
+        # Fetch one extra row to know whether another page exists
+        sql += ' LIMIT %s'
+        params.append(limit + 1)
+    if null_tail:
+        tail = f"SELECT {columns} FROM tasks WHERE {' AND '.join(where[:-1] + ['due_date IS NULL'])} ORDER BY id LIMIT %s"
+        sql = f'({sql}) UNION ALL ({tail}) ORDER BY sort_key, id LIMIT %s'
+        params = params + params[:-3] + [limit + 1, limit + 1]
+    return sql, params, sort, limit
+
+@app.route('/api/tasks', methods=['GET'])
+def get_tasks():
+    sql, params, sort, limit = build_task_query(request.args)
+    # Only the unbounded listing is worth streaming; pages are capped
+    if limit is None and flag_arg('stream'):
+        return stream_json_array(db.stream(sql, params), task_to_json)
     
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        tasks = cur.fetchall()
+    
+    next_cursor = None
+    if limit is not None and len(tasks) > limit:
+        tasks = tasks[:limit]
+        key = tasks[-1][8]
+        next_cursor = encode_cursor(sort, key.isoformat() if hasattr(key, 'isoformat') else key, tasks[-1][0])
+    
+    response = jsonify([task_to_json(task) for task in tasks])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# Replace the current create_task function with this fixed version
+
+def normalize_assignee(assignee_id):
     # Fix the assignee_id handling
-    assignee_id = data.get('assignee')
     if assignee_id:
         # Check if it's already an integer
         if isinstance(assignee_id, int):
@@ -292,28 +571,26 @@ def create_task():
             assignee_id = None
     else:
         assignee_id = None
-    
+    return assignee_id
+
+def normalize_due_date(due_date):
     # Fix due_date handling
-    due_date = data.get('dueDate')
     if due_date and isinstance(due_date, str) and due_date.strip():
-        due_date = due_date
-    else:
-        due_date = None
-    
-    # Debug information
-    print(f"Creating task with assignee_id: {assignee_id}, type: {type(assignee_id)}")
-    
-    cur.execute(
-        '''INSERT INTO tasks (title, description, status, assignee_id, 
-                             due_date, priority, project_id) 
-           VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id''',
-        (data['title'], data.get('description', ''), data['status'], 
-         assignee_id, due_date, data['priority'], 1)  # Default project_id = 1
-    )
+        return due_date
+    return None
+
+@app.route('/api/tasks', methods=['POST'])
+def create_task():
+    data = request.json
+    assignee_id = normalize_assignee(data.get('assignee'))
+    due_date = normalize_due_date(data.get('dueDate'))
     
-    task_id = cur.fetchone()[0]
-    cur.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'insert_task', (
+            data['title'], data.get('description', ''), data['status'],
+            assignee_id, due_date, data['priority'], 1  # Default project_id = 1
+        ))
+        task_id = cur.fetchone()[0]
     
     return jsonify({
         'id': task_id,
@@ -328,96 +605,889 @@ def create_task():
 @app.route('/api/tasks/<int:task_id>', methods=['PUT'])
 def update_task(task_id):
     data = request.json
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute(
-        'UPDATE tasks SET status = %s WHERE id = %s RETURNING id',
-        (data['status'], task_id)
-    )
-    
-    updated = cur.fetchone()
-    cur.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'update_task_status', (data['status'], task_id))
+        updated = cur.fetchone()
     
     if not updated:
         return jsonify({'error': 'Task not found'}), 404
     
     return jsonify({'id': task_id, 'status': data['status']})
 
+# Bulk endpoints: each validates the whole batch, writes the valid rows in
+# one transaction with a single multi-row statement, and reports per row.
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 10000))
+
+def bulk_rows():
+    rows = request.json
+    if not isinstance(rows, list) or not rows:
+        raise BadRequest('Expected a non-empty JSON array')
+    if len(rows) > BULK_MAX_ROWS:
+        raise BadRequest(f'At most {BULK_MAX_ROWS} rows per request')
+    return rows
+
+def bulk_response(results):
+    failed = sum(1 for result in results if not result['ok'])
+    return jsonify({
+        'created' if request.method == 'POST' else 'updated': len(results) - failed,
+        'failed': failed,
+        'results': results
+    }), (207 if failed else 201 if request.method == 'POST' else 200)
+
+# The whole batch is one statement, so a value the column would reject
+# (too long for its VARCHAR, or holding NUL) must be caught per row here
+def required_text(row, *fields, max_length=None):
+    for field in fields:
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise BadRequest(f'{field} is required')
+        check_text(field, value, max_length)
+
+def optional_text(row, field):
+    value = row.get(field)
+    if value is not None:
+        if not isinstance(value, str):
+            raise BadRequest(f'{field} must be a string')
+        check_text(field, value)
+
+def check_text(field, value, max_length=None):
+    if max_length is not None and len(value) > max_length:
+        raise BadRequest(f'{field} is longer than {max_length} characters')
+    if '\x00' in value:
+        raise BadRequest(f'{field} must not contain NUL characters')
+
+def existing_ids(cur, table, ids):
+    ids = list({i for i in ids if i is not None})
+    if not ids:
+        return set()
+    cur.execute(f'SELECT id FROM {table} WHERE id = ANY(%s)', (ids,))
+    return {row[0] for row in cur.fetchall()}
+
+@app.route('/api/tasks/bulk', methods=['POST'])
+def create_tasks_bulk():
+    rows = bulk_rows()
+    results = [None] * len(rows)
+    valid = []  # (index, values)
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise BadRequest('Each row must be an object')
+            required_text(row, 'title', max_length=255)
+            required_text(row, 'status', 'priority', max_length=50)
+            optional_text(row, 'description')
+            due_date = normalize_due_date(row.get('dueDate'))
+            if due_date is not None:
+                try:
+                    date.fromisoformat(due_date)
+                except ValueError:
+                    raise BadRequest('dueDate must be YYYY-MM-DD')
+            project_id = row.get('projectId', 1)  # Same default as create_task
+            if not isinstance(project_id, int):
+                raise BadRequest('projectId must be an integer')
+            valid.append((index, (
+                row['title'], row.get('description', ''), row['status'],
+                normalize_assignee(row.get('assignee')), due_date, row['priority'], project_id
+            )))
+        except BadRequest as e:
+            results[index] = {'index': index, 'ok': False, 'error': str(e)}
+    
+    with db.transaction() as conn, conn.cursor() as cur:
+        # Foreign keys are checked up front so one bad row can't sink the batch
+        members = existing_ids(cur, 'members', [values[3] for _, values in valid])
+        projects = existing_ids(cur, 'projects', [values[6] for _, values in valid])
+        insert = []
+        for index, values in valid:
+            if values[3] is not None and values[3] not in members:
+                results[index] = {'index': index, 'ok': False, 'error': 'Assignee not found'}
+            elif values[6] not in projects:
+                results[index] = {'index': index, 'ok': False, 'error': 'Project not found'}
+            else:
+                insert.append((index, values))
+        if insert:
+            ids = execute_values(cur, '''
+                INSERT INTO tasks (title, description, status, assignee_id, due_date, priority, project_id)
+                VALUES %s RETURNING id
+            ''', [values for _, values in insert], page_size=1000, fetch=True)
+            for (index, _), (task_id,) in zip(insert, ids):
+                results[index] = {'index': index, 'ok': True, 'id': task_id}
+    
+    return bulk_response(results)
+
+@app.route('/api/tasks/bulk', methods=['PATCH'])
+def update_tasks_bulk():
+    # Batch status changes: [{"id": 1, "status": "Completed"}, ...]
+    rows = bulk_rows()
+    results = [None] * len(rows)
+    valid, ids = [], set()
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict) or not isinstance(row.get('id'), int):
+                raise BadRequest('id must be an integer')
+            required_text(row, 'status', max_length=50)
+            # UPDATE ... FROM would apply just one of them, arbitrarily
+            if row['id'] in ids:
+                raise BadRequest('id appears earlier in this batch')
+            ids.add(row['id'])
+            valid.append((index, row['id'], row['status']))
+        except BadRequest as e:
+            results[index] = {'index': index, 'ok': False, 'error': str(e)}
+    
+    with db.transaction() as conn, conn.cursor() as cur:
+        updated = set()
+        if valid:
+            # Lock the rows in id order first; concurrent batches touching
+            # overlapping tasks would otherwise deadlock
+            cur.execute('SELECT id FROM tasks WHERE id = ANY(%s) ORDER BY id FOR UPDATE',
+                        (sorted({task_id for _, task_id, _ in valid}),))
+            updated = {row[0] for row in execute_values(cur, '''
+                UPDATE tasks SET status = v.status
+                FROM (VALUES %s) AS v (id, status)
+                WHERE tasks.id = v.id
+                RETURNING tasks.id
+            ''', [(task_id, status) for _, task_id, status in valid], page_size=1000, fetch=True)}
+    for index, task_id, status in valid:
+        if task_id in updated:
+            results[index] = {'index': index, 'ok': True, 'id': task_id, 'status': status}
+        else:
+            results[index] = {'index': index, 'ok': False, 'error': 'Task not found'}
+    
+    return bulk_response(results)
+
+@app.route('/api/members/bulk', methods=['POST'])
+def create_members_bulk():
+    rows = bulk_rows()
+    results = [None] * len(rows)
+    valid, emails = [], set()
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise BadRequest('Each row must be an object')
+            required_text(row, 'name', 'email', max_length=255)
+            required_text(row, 'role', max_length=50)
+            optional_text(row, 'avatar')
+            if row['email'] in emails:
+                raise BadRequest('Email already exists')
+            emails.add(row['email'])
+            valid.append((index, (row['name'], row['email'], row['role'], row.get('avatar'))))
+        except BadRequest as e:
+            results[index] = {'index': index, 'ok': False, 'error': str(e)}
+    
+    with db.transaction() as conn, conn.cursor() as cur:
+        created = {}
+        if valid:
+            created = dict(execute_values(cur, '''
+                INSERT INTO members (name, email, role, avatar) VALUES %s
+                ON CONFLICT (email) DO NOTHING
+                RETURNING email, id
+            ''', [values for _, values in valid], page_size=1000, fetch=True))
+    for index, values in valid:
+        if values[1] in created:
+            results[index] = {'index': index, 'ok': True, 'id': created[values[1]]}
+        else:
+            results[index] = {'index': index, 'ok': False, 'error': 'Email already exists'}
+    if created:
+        response_cache.invalidate(('members',))
+    
+    return bulk_response(results)
+
+# Counts maintained by triggers on tasks (see task_stats.py)
+@app.route('/api/projects/<int:project_id>/task-stats', methods=['GET'])
+def get_task_stats(project_id):
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'task_stats', (project_id,))
+        rows = cur.fetchall()
+    
+    if not rows:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify(task_stats.to_json(project_id, rows))
+
+@app.cli.command('rebuild-task-counters')
+def rebuild_task_counters():
+    """Recompute task_counters from the tasks table."""
+    with db.transaction() as conn, conn.cursor() as cur:
+        count = task_stats.rebuild(cur)
+    print(f'Rebuilt {count} task counter(s)')
+
+@app.cli.command('check-task-counters')
+def check_task_counters():
+    """Compare task_counters with a recount; exits 1 on any mismatch."""
+    with connection() as conn, conn.cursor() as cur:
+        rows = task_stats.mismatches(cur)
+    for project_id, dimension, key, stored, recomputed in rows:
+        print(f'project {project_id} {dimension} {key!r}: stored {stored}, recomputed {recomputed}')
+    if rows:
+        print(f'{len(rows)} mismatched counter(s); run rebuild-task-counters')
+        raise SystemExit(1)
+    print('Task counters match')
+
 # API Routes for Documents
+# Fold the op log into the documents snapshot once this many versions pile up
+DOCUMENT_COMPACT_EVERY = int(os.environ.get('DOCUMENT_COMPACT_EVERY', 50))
+# Ops kept behind the snapshot so slightly stale clients can still rebase
+DOCUMENT_OPS_RETENTION = int(os.environ.get('DOCUMENT_OPS_RETENTION', 500))
+
+# Write-behind for full saves (see document_buffer.py). Off by default: a
+# worker that dies loses the saves it still holds.
+DOCUMENT_WRITE_BEHIND = os.environ.get('DOCUMENT_WRITE_BEHIND', '0').lower() not in ('0', 'false', 'no')
+DOCUMENT_FLUSH_DELAY = float(os.environ.get('DOCUMENT_FLUSH_DELAY_MS', 2000)) / 1000
+DOCUMENT_FLUSH_MAX_DELAY = float(os.environ.get('DOCUMENT_FLUSH_MAX_DELAY_MS', 10000)) / 1000
+DOCUMENT_BUFFER_MAX_BYTES = int(os.environ.get('DOCUMENT_BUFFER_MAX_BYTES', 64 * 1024 * 1024))
+# Readers that find a newer save held by another worker ask it to write the
+# save and wait up to DOCUMENT_FLUSH_WAIT_MS, instead of serving the older copy
+DOCUMENT_FLUSH_ON_READ = os.environ.get('DOCUMENT_FLUSH_ON_READ', '0').lower() not in ('0', 'false', 'no')
+DOCUMENT_FLUSH_WAIT = float(os.environ.get('DOCUMENT_FLUSH_WAIT_MS', 1000)) / 1000
+# A save held by a worker on another machine counts as lost once it is this
+# old, so a killed worker can't block its documents for good. Keep it well
+# above DOCUMENT_FLUSH_MAX_DELAY_MS.
+DOCUMENT_HOLD_TIMEOUT = timedelta(milliseconds=float(os.environ.get('DOCUMENT_HOLD_TIMEOUT_MS', 60000)))
+
+def content_hash(value):
+    # Matches the md5() behind documents.text_hash and code_hash
+    return None if value is None else hashlib.md5(value.encode()).hexdigest()
+
+def changed_fields(values, hashes):
+    # values: {'text': ..., 'code': ...}; hashes: the stored (text_hash, code_hash)
+    return {
+        name: values[name] for name, stored in zip(text_ops.FIELDS, hashes)
+        if content_hash(values[name]) != stored
+    }
+
+def write_document_fields(cur, document_id, version, fields, updated_at=None):
+    # fields: only the columns that changed. Leaving the others out of the
+    # SET list spares rewriting their TOAST data and recomputing the hash
+    # and search columns generated from them.
+    assignments = [f'{name} = %s' for name in fields] + [
+        'version = %s', 'updated_at = COALESCE(%s, CURRENT_TIMESTAMP)'
+    ]
+    cur.execute(
+        f"UPDATE documents SET {', '.join(assignments)} WHERE id = %s RETURNING updated_at",
+        [*fields.values(), version, updated_at, document_id]
+    )
+    return cur.fetchone()[0]
+
+def write_buffered_documents(entries):
+    with db.transaction() as conn, conn.cursor() as cur:
+        # Every worker locks in id order, so concurrent flushes can't deadlock
+        cur.execute(
+            'SELECT id, version, text_hash, code_hash FROM documents WHERE id = ANY(%s) ORDER BY id FOR UPDATE',
+            ([entry.document_id for entry in entries],)
+        )
+        stored = {row[0]: row[1:] for row in cur.fetchall()}
+        for entry in entries:
+            if entry.document_id not in stored:
+                continue
+            version, text_hash, code_hash = stored[entry.document_id]
+            # A newer snapshot (a PATCH compaction, a later save) is left alone
+            if version >= entry.version:
+                continue
+            changed = changed_fields({'text': entry.text, 'code': entry.code}, (text_hash, code_hash))
+            write_document_fields(cur, entry.document_id, entry.version, changed, entry.updated_at)
+        execute_values(cur, '''
+            DELETE FROM document_ops o USING (VALUES %s) AS v (id, version)
+            WHERE o.document_id = v.id AND o.version <= v.version
+        ''', [
+            (entry.document_id, entry.version - DOCUMENT_OPS_RETENTION) for entry in entries
+        ], page_size=len(entries))
+
+document_writes = None
+if DOCUMENT_WRITE_BEHIND:
+    document_writes = document_buffer.DocumentBuffer(
+        write_buffered_documents, DOCUMENT_FLUSH_DELAY, DOCUMENT_FLUSH_MAX_DELAY,
+        DOCUMENT_BUFFER_MAX_BYTES, name='document-writer'
+    )
+    if DOCUMENT_FLUSH_ON_READ:
+        document_writes.listen()
+    # gunicorn workers exit through sys.exit on graceful shutdown
+    atexit.register(document_writes.flush)
+
+def buffered_document(project_id):
+    # This worker's unwritten save of the project's document, as a state dict
+    if document_writes is None:
+        return None
+    held = document_writes.get(project_id)
+    return held[1] if held else None
+
+def load_document(cur, project_id, lock=False, since=None):
+    # Returns (document_id, snapshot_version, state, history) or None, where
+    # state is the snapshot with every newer op replayed and history holds
+    # the op log rows after min(since, snapshot_version).
+    for attempt in range(2):
+        db.execute(cur, 'lock_document' if lock else 'get_document', (project_id,))
+        document = cur.fetchone()
+        if not document:
+            return None
+        document_id, text, code, updated_at, snapshot_version = document
+        start = snapshot_version if since is None else min(since, snapshot_version)
+        db.execute(cur, 'document_ops_since', (document_id, start))
+        history = cur.fetchall()
+        buffered = buffered_document(project_id)
+        state = replay_document(text, code, updated_at, snapshot_version, history, buffered)
+        if state['heldVersion'] is not None and reservation_abandoned(cur, history):
+            state = replay_document(text, code, updated_at, snapshot_version, history, buffered, abandoned=True)
+        # Holding the row lock would block the very write we'd wait for
+        if (state['heldVersion'] is None or lock or not DOCUMENT_FLUSH_ON_READ or attempt
+                or not document_buffer.request_flush(cur, document_id, state['heldVersion'], DOCUMENT_FLUSH_WAIT)):
+            break
+    return document_id, snapshot_version, state, history
+
+def reservation_abandoned(cur, history):
+    # history ends past a save held in another worker's buffer. Whether that
+    # save will never be written: its worker has died, or it has been held
+    # longer than DOCUMENT_HOLD_TIMEOUT. The timeout applies even to a worker
+    # that looks alive, so a misjudged owner can't hold a document for good.
+    _, ops, created_at = next(row for row in reversed(history) if any(op['op'] == 'replace' for op in row[1]))
+    if document_buffer.owner_alive(ops[0].get('owner')) is False:
+        return True
+    cur.execute('SELECT localtimestamp')
+    return cur.fetchone()[0] - created_at > DOCUMENT_HOLD_TIMEOUT
+
+def replay_document(text, code, updated_at, snapshot_version, history, buffered=None, abandoned=False):
+    # history: (version, ops, created_at) rows in version order; buffered:
+    # this worker's unwritten save, if any. A replace newer than the snapshot
+    # is a save still in a write-behind buffer. When it isn't ours the
+    # content is unknown here, so replay stops short of it and heldVersion
+    # names the newest version that couldn't be replayed. With `abandoned`
+    # that save is taken as lost, with the edits made on top of it: the
+    # state is the replayed content at the newest version, and `abandoned`
+    # is set so a writer can record that (see discard_abandoned).
+    base = {'text': text, 'code': code, 'version': snapshot_version, 'updatedAt': updated_at}
+    replaces = [
+        version for version, ops, _ in history
+        if version > snapshot_version and any(op['op'] == 'replace' for op in ops)
+    ]
+    held = None
+    if replaces and buffered is not None and buffered['version'] >= replaces[-1]:
+        base = buffered
+    elif replaces:
+        newest = history[-1]
+        held = newest[0]
+        history = [row for row in history if row[0] < replaces[0]]
+    newer = [row for row in history if row[0] > base['version']]
+    state = text_ops.apply({'text': base['text'], 'code': base['code']}, [op for _, ops, _ in newer for op in ops])
+    state['version'] = newer[-1][0] if newer else base['version']
+    state['updatedAt'] = newer[-1][2] if newer else base['updatedAt']
+    state['abandoned'] = abandoned and held is not None
+    if state['abandoned']:
+        state['version'], state['updatedAt'] = held, newest[2]
+        held = None
+    state['heldVersion'] = held
+    return state
+
+def document_to_json(document_id, state, fields=text_ops.FIELDS):
+    result = {'id': document_id}
+    for name in fields:
+        result[name] = state[name]
+    result['version'] = state['version']
+    result['updatedAt'] = state['updatedAt'].isoformat() if state['updatedAt'] else None
+    return result
+
+def document_fields():
+    # ?fields=text returns just that field; ?fields= returns neither
+    value = request.args.get('fields')
+    if value is None:
+        return text_ops.FIELDS
+    names = [name for name in value.split(',') if name]
+    if any(name not in text_ops.FIELDS for name in names):
+        raise BadRequest(f"fields must be a comma-separated subset of {', '.join(text_ops.FIELDS)}")
+    return tuple(name for name in text_ops.FIELDS if name in names)
+
+def document_cache_key(project_id, fields):
+    if fields == text_ops.FIELDS:
+        return ('document', project_id)
+    return ('document', project_id, fields)
+
+def invalidate_document(project_id):
+    # Every ?fields= variant of the GET body
+    for fields in [(), ('text',), ('code',), text_ops.FIELDS]:
+        response_cache.invalidate(document_cache_key(project_id, fields))
+
+def compact_document(cur, document_id, state):
+    db.execute(cur, 'write_document_snapshot', (state['text'], state['code'], state['version'], document_id))
+    db.execute(cur, 'prune_document_ops', (document_id, state['version'] - DOCUMENT_OPS_RETENTION))
+
+def discard_abandoned(cur, document_id, state):
+    # Writing the snapshot at the abandoned save's version ends the wait for
+    # it; a late write of that save is then skipped as older
+    app.logger.warning('discarding document %d saves up to version %d held by a lost worker',
+                       document_id, state['version'])
+    compact_document(cur, document_id, state)
+
 @app.route('/api/documents/<int:project_id>', methods=['GET'])
 def get_document(project_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, text, code, updated_at FROM documents WHERE project_id = %s', (project_id,))
-    document = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if not document:
-        return jsonify({'error': 'Document not found'}), 404
+    fields = document_fields()
+    variant = '' if fields == text_ops.FIELDS else '-' + ('+'.join(fields) or 'none')
     
-    return jsonify({
-        'id': document[0],
-        'text': document[1],
-        'code': document[2],
-        'updatedAt': document[3].isoformat() if document[3] else None
-    })
+    def current_etag(cur):
+        db.execute(cur, 'document_version', (project_id,))
+        row = cur.fetchone()
+        return f'document-{row[0]}-{row[1]}{variant}' if row else None
+    
+    def load(cur):
+        # A save held by this worker needs no snapshot read, unless
+        # something newer has been logged since
+        buffered = document_writes.get(project_id) if document_writes is not None else None
+        if buffered is not None:
+            document_id, state = buffered
+            etag = f"document-{document_id}-{state['version']}{variant}"
+            if current_etag(cur) == etag:
+                return etag, document_to_json(document_id, state, fields)
+        document = load_document(cur, project_id)
+        if not document:
+            return None
+        document_id, _, state, _ = document
+        return f"document-{document_id}-{state['version']}{variant}", document_to_json(document_id, state, fields)
+    
+    response = conditional_response(document_cache_key(project_id, fields), current_etag, load)
+    if response is None:
+        return jsonify({'error': 'Document not found'}), 404
+    return response
 
 @app.route('/api/documents/<int:project_id>', methods=['PUT'])
 def update_document(project_id):
-    data = request.json
-    conn = get_db_connection()
-    cur = conn.cursor()
+    data = request_json()
+    fields = document_fields()
+    values = {'text': data['text'], 'code': data['code']}
+    with db.transaction() as conn, conn.cursor() as cur:
+        db.execute(cur, 'lock_document_head', (project_id,))
+        head = cur.fetchone()
+        if not head:
+            return jsonify({'error': 'Document not found'}), 404
+        document_id, version, snapshot_version, text_hash, code_hash, updated_at = head
+        
+        # Fields matching the snapshot are left out of the write
+        changed = changed_fields(values, (text_hash, code_hash))
+        # Saving exactly what readers already see creates no version and writes nothing
+        buffered = buffered_document(project_id)
+        if buffered is not None and buffered['version'] == version:
+            unchanged = all(buffered[name] == value for name, value in values.items())
+            updated_at = buffered['updatedAt']
+        else:
+            # The snapshot is only what readers see when no op follows it
+            unchanged = version == snapshot_version and not changed
+        
+        if not unchanged:
+            # A full replace is logged too, so clients rebasing across it get a 409
+            version += 1
+            # Under write-behind it also names the worker holding the content
+            replace = {'op': 'replace'}
+            if document_writes is not None:
+                replace['owner'] = document_buffer.owner()
+            db.execute(cur, 'insert_document_op', (document_id, version, Json([replace]), None))
+            updated_at = cur.fetchone()[0]
+            if document_writes is None:
+                updated_at = write_document_fields(cur, document_id, version, changed)
+                # The snapshot is now current, so nothing else would prune
+                # the replaces piling up behind it
+                db.execute(cur, 'prune_document_ops', (document_id, version - DOCUMENT_OPS_RETENTION))
+            else:
+                # Only the version is reserved here; the content is as durable
+                # as the buffer holding it either way
+                cur.execute('SET LOCAL synchronous_commit = off')
+    if not unchanged:
+        if document_writes is not None:
+            document_writes.put(project_id, document_id, values['text'], values['code'], version, updated_at)
+        invalidate_document(project_id)
     
-    cur.execute(
-        'UPDATE documents SET text = %s, code = %s, updated_at = CURRENT_TIMESTAMP WHERE project_id = %s RETURNING updated_at',
-        (data['text'], data['code'], project_id)
-    )
+    result = {name: values[name] for name in fields}
+    result['version'] = version
+    result['updatedAt'] = updated_at.isoformat() if updated_at else None
+    return jsonify(result)
+
+@app.route('/api/documents/<int:project_id>', methods=['PATCH'])
+def patch_document(project_id):
+    data = request_json() or {}
+    base = data.get('baseVersion')
+    if not isinstance(base, int) or isinstance(base, bool) or base < 0:
+        raise BadRequest('baseVersion must be a non-negative integer')
+    try:
+        ops = text_ops.validate(data.get('ops'))
+    except text_ops.InvalidOps as e:
+        raise BadRequest(str(e))
     
-    updated = cur.fetchone()
-    if not updated:
-        cur.close()
-        conn.close()
-        return jsonify({'error': 'Document not found'}), 404
+    with db.transaction() as conn, conn.cursor() as cur:
+        # The row lock serializes concurrent patches to the same document
+        document = load_document(cur, project_id, lock=True, since=base)
+        if not document:
+            return jsonify({'error': 'Document not found'}), 404
+        document_id, snapshot_version, state, history = document
+        if state['abandoned']:
+            discard_abandoned(cur, document_id, state)
+            snapshot_version = state['version']
+        if state['heldVersion'] is not None:
+            # Saved through another worker's write-behind buffer, not written yet
+            return jsonify({
+                'error': 'Document changed in a way that cannot be merged; reload it',
+                'version': state['heldVersion']
+            }), 409
+        head = state['version']
+        if base > head:
+            raise BadRequest(f'baseVersion {base} is newer than the document (version {head})')
+        
+        # Rebase over everything committed since the client's base version
+        versions = [version for version, _, _ in history if version > base]
+        concurrent = [op for version, log, _ in history if version > base for op in log]
+        if versions != list(range(base + 1, head + 1)) or any(op['op'] == 'replace' for op in concurrent):
+            return jsonify({
+                'error': 'Document changed in a way that cannot be merged; reload it',
+                'version': head
+            }), 409
+        ops = text_ops.transform(ops, concurrent)
+        try:
+            state = dict(text_ops.apply(state, ops), version=head + 1)
+        except text_ops.InvalidOps as e:
+            raise BadRequest(str(e))
+        
+        db.execute(cur, 'insert_document_op', (document_id, state['version'], Json(ops), data.get('clientId')))
+        updated_at = cur.fetchone()[0]
+        if state['version'] - snapshot_version >= DOCUMENT_COMPACT_EVERY:
+            compact_document(cur, document_id, state)
+    invalidate_document(project_id)
+    
+    result = {
+        'id': document_id,
+        'version': state['version'],
+        'ops': ops,
+        'updatedAt': updated_at.isoformat() if updated_at else None
+    }
+    if concurrent:
+        # The client can't rebuild edits it hasn't seen; send the result
+        result.update({name: state[name] for name in text_ops.FIELDS})
+    return jsonify(result)
+
+# Full-text search over tasks, documents and chat messages
+SEARCH_TYPES = {'tasks': 'task', 'documents': 'document', 'messages': 'message'}
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Newest matches ranked per kind; bounds the work for very common terms
+SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', 1000))
+SEARCH_HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxWords=25, MinWords=8, MaxFragments=2'
+
+def build_search_query(args):
+    # Returns (sql, params, limit)
+    q = (args.get('q') or '').strip()
+    if not q:
+        raise BadRequest('q is required')
+    types = [t for t in (args.get('types') or ','.join(SEARCH_TYPES)).split(',') if t]
+    unknown = [t for t in types if t not in SEARCH_TYPES]
+    if unknown or not types:
+        raise BadRequest(f"types must be a comma-separated subset of {', '.join(SEARCH_TYPES)}")
+    project_id = int_arg('project_id')
+    limit = int_arg('limit') or SEARCH_PAGE_SIZE
+    if limit < 1:
+        raise BadRequest('limit must be positive')
+    limit = min(limit, SEARCH_MAX_PAGE_SIZE)
     
-    cur.close()
-    conn.close()
+    cursor = None
+    if args.get('after'):
+        key, hit_id = decode_cursor(args['after'], 'search')
+        if not isinstance(key, list) or len(key) != 2:
+            raise BadRequest('Invalid cursor')
+        cursor = (key[0], key[1], hit_id)
     
-    return jsonify({
-        'text': data['text'],
-        'code': data['code'],
-        'updatedAt': updated[0].isoformat() if updated[0] else None
-    })
+    # Ranking costs a ts_rank per match, so each kind ranks only its newest
+    # SEARCH_CANDIDATES matches. One more candidate is read to tell whether
+    # some were left out; the response names those kinds in
+    # X-Search-Truncated. Each branch keeps its best page past the cursor,
+    # so the union holds the best page overall; snippets are built
+    # afterwards for the returned page alone. The tsquery is spelled out in
+    # every candidate query rather than read from the q CTE so the planner
+    # sees a constant and can estimate how common the terms are: frequent
+    # terms walk the primary key backwards, rare ones use the GIN index.
+    match = "websearch_to_tsquery('english', %s)"
+    scopes = {
+        'tasks': ('tasks', 'project_id = %s'),
+        'documents': ('documents', 'project_id = %s'),
+        'messages': ('chat_messages', 'document_id IN (SELECT id FROM documents WHERE project_id = %s)'),
+    }
+    candidates, candidate_params = [], []
+    branches, branch_params = [], []
+    for name in types:
+        kind = SEARCH_TYPES[name]
+        table, in_project = scopes[name]
+        candidate = f'{kind}_candidates AS (SELECT id, search FROM {table} WHERE search @@ {match}'
+        candidate_params.append(q)
+        if project_id is not None:
+            candidate += ' AND ' + in_project
+            candidate_params.append(project_id)
+        candidates.append(candidate + ' ORDER BY id DESC LIMIT %s)')
+        candidate_params.append(SEARCH_CANDIDATES + 1)
+        
+        branch = f"""(SELECT '{kind}' AS kind, id, rank FROM (
+                SELECT c.id, ts_rank(c.search, q.query) AS rank
+                FROM (SELECT id, search FROM {kind}_candidates ORDER BY id DESC LIMIT %s) c CROSS JOIN q) x"""
+        branch_params.append(SEARCH_CANDIDATES)
+        if cursor is not None:
+            branch += f" WHERE (rank, '{kind}', id) < (%s::real, %s, %s)"
+            branch_params += list(cursor)
+        branches.append(branch + ' ORDER BY rank DESC, id DESC LIMIT %s)')
+        branch_params.append(limit + 1)
+    counts = ', '.join(f"('{name}', (SELECT count(*) FROM {SEARCH_TYPES[name]}_candidates))" for name in types)
+    
+    params = [q] + candidate_params + branch_params + [limit + 1, SEARCH_HEADLINE_OPTIONS, SEARCH_CANDIDATES]
+    sql = f'''
+        WITH q AS (SELECT websearch_to_tsquery('english', %s) AS query),
+        {', '.join(candidates)},
+        page AS (
+            SELECT kind, id, rank FROM ({' UNION ALL '.join(branches)}) hits
+            ORDER BY rank DESC, kind DESC, id DESC
+            LIMIT %s
+        )
+        SELECT p.kind, p.id, p.rank, COALESCE(t.project_id, d.project_id, md.project_id),
+               m.document_id, t.title, m.member_id, m.created_at,
+               ts_headline('english', CASE p.kind
+                   WHEN 'task' THEN concat_ws(' ', t.title, t.description)
+                   WHEN 'document' THEN concat_ws(' ', d.text, d.code)
+                   ELSE m.message END, q.query, %s),
+               ARRAY(SELECT name FROM (VALUES {counts}) v (name, n) WHERE n > %s)
+        FROM page p
+        CROSS JOIN q
+        LEFT JOIN tasks t ON p.kind = 'task' AND t.id = p.id
+        LEFT JOIN documents d ON p.kind = 'document' AND d.id = p.id
+        LEFT JOIN chat_messages m ON p.kind = 'message' AND m.id = p.id
+        LEFT JOIN documents md ON md.id = m.document_id
+        ORDER BY p.rank DESC, p.kind DESC, p.id DESC
+    '''
+    return sql, params, limit
+
+def search_hit_to_json(hit):
+    kind, hit_id, rank, project_id, document_id, title, member_id, created_at, snippet, _ = hit
+    result = {'type': kind, 'id': hit_id, 'projectId': project_id, 'rank': rank, 'snippet': snippet}
+    if kind == 'task':
+        result['title'] = title
+    elif kind == 'message':
+        result['documentId'] = document_id
+        result['memberId'] = member_id
+        result['createdAt'] = created_at.isoformat() if created_at else None
+    return result
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    sql, params, limit = build_search_query(request.args)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        hits = cur.fetchall()
+    
+    response = jsonify([search_hit_to_json(hit) for hit in hits[:limit]])
+    if hits and hits[0][9]:
+        response.headers['X-Search-Truncated'] = ','.join(hits[0][9])
+    if len(hits) > limit:
+        last = hits[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor('search', [last[2], last[0]], last[1])
+    return response
+
+# Everything the project page needs in one round trip
+DASHBOARD_SECTIONS = ('project', 'members', 'tasks', 'document')
+
+def dashboard_document(cur, project_id, columns):
+    document_id, text, code, updated_at, snapshot_version, pending = columns
+    if document_id is None:
+        return None
+    # Timestamps inside json_agg come back as strings; only the
+    # newest one matters for updatedAt
+    history = [
+        (version, ops, datetime.fromisoformat(created_at))
+        for version, ops, created_at in (pending or [])
+    ]
+    buffered = buffered_document(project_id)
+    state = replay_document(text, code, updated_at, snapshot_version, history, buffered)
+    if state['heldVersion'] is not None and reservation_abandoned(cur, history):
+        state = replay_document(
+            text, code, updated_at, snapshot_version, history, buffered, abandoned=True
+        )
+    return document_to_json(document_id, state)
+
+@app.route('/api/projects/<int:project_id>/dashboard', methods=['GET'])
+def get_dashboard(project_id):
+    # ?include=members,tasks skips sections the client already has cached
+    include = request.args.get('include')
+    sections = set(include.split(',')) if include else set(DASHBOARD_SECTIONS)
+    unknown = sections - set(DASHBOARD_SECTIONS)
+    if unknown:
+        raise BadRequest(f"include accepts {', '.join(DASHBOARD_SECTIONS)}")
+    limit = max(1, min(int_arg('limit') or TASKS_PAGE_SIZE, TASKS_MAX_PAGE_SIZE))
+    
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'dashboard', (
+            'members' in sections, 'tasks' in sections, project_id, limit + 1,
+            'document' in sections, project_id
+        ))
+        row = cur.fetchone()
+        # Replayed while the connection is still held: a held save may
+        # need a look at document_ops to tell whether it was abandoned
+        document = None
+        if row and 'document' in sections:
+            document = dashboard_document(cur, project_id, row[7:13])
+    
+    if not row:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    result = {}
+    if 'project' in sections:
+        result['project'] = project_to_json(row[0:5])
+    if 'members' in sections:
+        result['members'] = row[5] or []
+    if 'tasks' in sections:
+        tasks = row[6] or []
+        result['tasksNextCursor'] = None
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            result['tasksNextCursor'] = encode_cursor('id', tasks[-1]['id'], tasks[-1]['id'])
+        result['tasks'] = tasks
+    if 'document' in sections:
+        result['document'] = document
+    
+    return jsonify(result)
+
+@app.cli.command('compact-documents')
+def compact_documents():
+    """Fold pending document ops into the documents snapshots."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute('''
+            SELECT d.project_id FROM documents d
+            WHERE EXISTS (SELECT 1 FROM document_ops o WHERE o.document_id = d.id AND o.version > d.version)
+        ''')
+        project_ids = [row[0] for row in cur.fetchall()]
+    
+    held = abandoned = 0
+    for project_id in project_ids:
+        with db.transaction() as conn, conn.cursor() as cur:
+            document_id, _, state, _ = load_document(cur, project_id, lock=True)
+            if state['heldVersion'] is not None:
+                # The latest save is still in a worker's write-behind buffer
+                held += 1
+                continue
+            if state['abandoned']:
+                abandoned += 1
+                discard_abandoned(cur, document_id, state)
+            else:
+                compact_document(cur, document_id, state)
+    print(f'Compacted {len(project_ids) - held} document(s)')
+    if abandoned:
+        print(f'Discarded the lost saves of {abandoned} document(s) whose worker has gone')
+    if held:
+        print(f'Skipped {held} document(s) with saves not yet written from a write-behind buffer')
 
 # Add these routes for chat messages
-@app.route('/api/documents/<int:document_id>/messages', methods=['GET'])
-def get_chat_messages(document_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Join with members table to get sender details
-    cur.execute('''
-        SELECT cm.id, cm.member_id, m.name, m.avatar, cm.message, cm.created_at
-        FROM chat_messages cm
-        JOIN members m ON cm.member_id = m.id
-        WHERE cm.document_id = %s
-        ORDER BY cm.created_at ASC
-    ''', (document_id,))
-    
-    messages = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return jsonify([{
+def message_to_json(msg):
+    return {
         'id': msg[0],
         'member_id': msg[1],
         'sender_name': msg[2],
         'sender_avatar': msg[3],
         'message': msg[4],
         'created_at': msg[5].isoformat() if msg[5] else None
-    } for msg in messages])
+    }
+
+CHAT_PAGE_SIZE = 100
+CHAT_MAX_PAGE_SIZE = 1000
+
+# chat_messages is partitioned by month (see chat_partitions.py). A
+# background thread per worker keeps CHAT_PARTITIONS_AHEAD months of
+# partitions ready and archives months that ended more than
+# CHAT_RETENTION_MONTHS ago (0, the default, keeps everything live), every
+# CHAT_MAINTENANCE_INTERVAL seconds (0 leaves it to `maintain-chat`).
+CHAT_PARTITIONS_AHEAD = int(os.environ.get('CHAT_PARTITIONS_AHEAD', chat_partitions.MONTHS_AHEAD))
+CHAT_RETENTION_MONTHS = int(os.environ.get('CHAT_RETENTION_MONTHS', 0))
+CHAT_MAINTENANCE_INTERVAL = float(os.environ.get('CHAT_MAINTENANCE_INTERVAL', 3600))
+
+chat_partition_map = chat_partitions.PartitionMap(ttl=float(os.environ.get('CHAT_PARTITION_MAP_TTL', 60)))
+chat_maintainer = chat_partitions.Maintainer(
+    CHAT_MAINTENANCE_INTERVAL, CHAT_PARTITIONS_AHEAD, CHAT_RETENTION_MONTHS,
+    on_change=chat_partition_map.invalidate
+)
+
+@app.cli.command('maintain-chat')
+def maintain_chat():
+    """Create upcoming chat partitions and archive expired ones."""
+    conn = db.connect()
+    try:
+        created, archived = chat_partitions.maintain(conn, CHAT_PARTITIONS_AHEAD, CHAT_RETENTION_MONTHS, print)
+    finally:
+        conn.close()
+    print(f'Created {len(created)} partition(s), archived {len(archived)}')
+
+@app.route('/api/documents/<int:document_id>/messages', methods=['GET'])
+def get_chat_messages(document_id):
+    # since_id: messages newer than that id, oldest first (polling for new ones)
+    # before_id: the `limit` messages older than that id (scrolling back)
+    # limit alone: the latest `limit` messages; no parameters: everything
+    # archived=true: include messages moved to chat_messages_archive
+    since_id = int_arg('since_id')
+    before_id = int_arg('before_id')
+    limit = int_arg('limit')
+    archived = flag_arg('archived')
+    if since_id is not None and before_id is not None:
+        raise BadRequest('Use either since_id or before_id, not both')
+    
+    if flag_arg('stream') and since_id is None and before_id is None and limit is None and not archived:
+        return stream_json_array(db.stream(db.STATEMENTS['list_chat_messages'], (document_id,)), message_to_json)
+    
+    if limit is not None or since_id is not None or before_id is not None:
+        limit = max(1, min(limit or CHAT_PAGE_SIZE, CHAT_MAX_PAGE_SIZE))
+    
+    with connection() as conn, conn.cursor() as cur:
+        if since_id is not None:
+            messages = chat_partitions.read_since(cur, chat_partition_map, document_id, since_id, limit, archived)
+        elif limit is not None:
+            messages = chat_partitions.read_before(cur, chat_partition_map, document_id, before_id, limit, archived)
+            # Newest-first pages come back reversed
+            messages.reverse()
+        else:
+            messages = chat_partitions.read_all(cur, document_id, archived)
+        senders = lookup_members(cur, [msg[1] for msg in messages])
+    
+    # Messages whose sender no longer exists are skipped, as the old join did
+    return jsonify([
+        message_to_json((msg_id, member_id) + senders[member_id] + (message, created_at))
+        for msg_id, member_id, message, created_at in messages
+        if member_id in senders
+    ])
+
+# Chat ingestion: concurrent posts in a worker are written by one multi-row
+# INSERT per batch (see group_commit.py)
+CHAT_BATCH_WINDOW = float(os.environ.get('CHAT_BATCH_WINDOW_MS', 5)) / 1000
+CHAT_BATCH_MAX_ROWS = int(os.environ.get('CHAT_BATCH_MAX_ROWS', 500))
+
+# Documents are never deleted, so only the TTL bounds how long a hit lives
+known_documents = TTLCache(maxsize=10000, ttl=300)
+
+def insert_chat_messages(rows, create_partition=True):
+    # rows: [(document_id, member_id, message)]
+    # Returns [(id, created_at) or RowError], one per row
+    try:
+        with db.transaction() as conn, conn.cursor() as cur:
+            inserted = execute_values(cur, '''
+                INSERT INTO chat_messages (document_id, member_id, message)
+                SELECT document_id, member_id, message
+                FROM (VALUES %s) AS v (ord, document_id, member_id, message)
+                ORDER BY ord
+                RETURNING id, created_at
+            ''', [(index,) + row for index, row in enumerate(rows)], page_size=len(rows), fetch=True)
+    except psycopg2.errors.ForeignKeyViolation as error:
+        if len(rows) > 1:
+            # A cached document or member is gone; the writer retries one
+            # row at a time so only the affected senders fail
+            raise
+        document_id, member_id, _ = rows[0]
+        if 'member' in (error.diag.constraint_name or ''):
+            member_cache.delete(member_id)
+            return [group_commit.RowError('Member not found')]
+        known_documents.delete(document_id)
+        return [group_commit.RowError('Document not found')]
+    except psycopg2.errors.CheckViolation as error:
+        # This month has no partition yet: maintenance hasn't run lately
+        if not create_partition or not chat_partitions.is_missing_partition(error):
+            raise
+        with db.transaction() as conn, conn.cursor() as cur:
+            chat_partitions.create_upcoming(cur, CHAT_PARTITIONS_AHEAD)
+        chat_partition_map.invalidate()
+        return insert_chat_messages(rows, create_partition=False)
+    # Ids are drawn in ORDER BY ord order, so sorting them lines up with rows
+    return sorted(inserted)
+
+chat_writer = group_commit.GroupCommitWriter(
+    insert_chat_messages, CHAT_BATCH_WINDOW, CHAT_BATCH_MAX_ROWS, name='chat-writer'
+)
 
 @app.route('/api/documents/<int:document_id>/messages', methods=['POST'])
 def create_chat_message(document_id):
@@ -425,45 +1495,182 @@ def create_chat_message(document_id):
     
     if not data.get('member_id') or not data.get('message'):
         return jsonify({'error': 'Member ID and message are required'}), 400
+    try:
+        member_id = int(data['member_id'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'member_id must be an integer'}), 400
+    # The message shares a multi-row INSERT with other senders' messages,
+    # where a value Postgres can't take as text would fail them all
+    message = data['message']
+    if not isinstance(message, str) or '\x00' in message:
+        return jsonify({'error': 'message must be a string without NUL characters'}), 400
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # First check if document exists
-    cur.execute('SELECT id FROM documents WHERE id = %s', (document_id,))
-    if not cur.fetchone():
-        cur.close()
-        conn.close()
-        return jsonify({'error': 'Document not found'}), 404
-    
-    # Insert the message
-    cur.execute(
-        'INSERT INTO chat_messages (document_id, member_id, message) VALUES (%s, %s, %s) RETURNING id, created_at',
-        (document_id, data['member_id'], data['message'])
-    )
-    
-    message_id, created_at = cur.fetchone()
-    
-    # Get member info
-    cur.execute('SELECT name, avatar FROM members WHERE id = %s', (data['member_id'],))
-    member = cur.fetchone()
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    # The database is only asked on a cache miss
+    sender = member_cache.get(member_id)
+    if sender is None or not known_documents.get(document_id):
+        with connection() as conn, conn.cursor() as cur:
+            if not known_documents.get(document_id):
+                db.execute(cur, 'document_exists', (document_id,))
+                if not cur.fetchone():
+                    return jsonify({'error': 'Document not found'}), 404
+                known_documents.set(document_id, True)
+            sender = lookup_members(cur, [member_id]).get(member_id)
     
-    if not member:
+    if sender is None:
         return jsonify({'error': 'Member not found'}), 404
     
+    # Blocks until the batch holding this message has committed
+    try:
+        message_id, created_at = chat_writer.submit((document_id, member_id, message))
+    except group_commit.RowError as error:
+        return jsonify({'error': str(error)}), 404
+    
     return jsonify({
         'id': message_id,
-        'member_id': data['member_id'],
-        'sender_name': member[0],
-        'sender_avatar': member[1],
-        'message': data['message'],
+        'member_id': member_id,
+        'sender_name': sender[0],
+        'sender_avatar': sender[1],
+        'message': message,
         'created_at': created_at.isoformat() if created_at else None
     }), 201
 
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        'responses': dict(response_cache.stats(), notModified=not_modified_count),
+        'members': member_cache.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    gauges = [
+        ('response_cache_hits_total', 'Response cache hits.', 'counter', response_cache.hits),
+        ('response_cache_misses_total', 'Response cache misses.', 'counter', response_cache.misses),
+        ('response_cache_entries', 'Bodies held in the response cache.', 'gauge', len(response_cache)),
+        ('response_not_modified_total', '304 responses sent.', 'counter', not_modified_count),
+        ('member_cache_hits_total', 'Member cache hits.', 'counter', member_cache.hits),
+        ('member_cache_misses_total', 'Member cache misses.', 'counter', member_cache.misses),
+        ('member_cache_entries', 'Members held in the member cache.', 'gauge', len(member_cache)),
+        ('chat_batches_total', 'Group commits of chat messages.', 'counter', chat_writer.batches),
+        ('chat_batched_messages_total', 'Chat messages written by group commit.', 'counter', chat_writer.rows),
+        ('chat_maintenance_runs_total', 'Chat partition maintenance runs.', 'counter', chat_maintainer.runs),
+        ('chat_maintenance_failures_total', 'Failed chat partition maintenance runs.', 'counter',
+         chat_maintainer.failures),
+        ('sse_subscribers', 'Open /api/stream connections.', 'gauge',
+         realtime.get_broker(load_chat_message).subscriber_count()),
+    ]
+    if document_writes is not None:
+        buffered = document_writes.stats()
+        gauges += [
+            ('document_buffer_documents', 'Documents with unwritten saves.', 'gauge', buffered['documents']),
+            ('document_buffer_bytes', 'Characters of unwritten document content.', 'gauge', buffered['bytes']),
+            ('document_buffer_flushes_total', 'Write-behind flushes.', 'counter', buffered['flushes']),
+            ('document_buffer_written_total', 'Documents written by write-behind flushes.', 'counter',
+             buffered['written']),
+            ('document_buffer_failures_total', 'Failed write-behind flushes.', 'counter', buffered['failures']),
+        ]
+    if db.POOL_MAX > 0:
+        pool = db.get_pool().stats()
+        gauges += [
+            ('db_pool_connections', 'Open pooled connections.', 'gauge', pool['size']),
+            ('db_pool_idle_connections', 'Pooled connections not checked out.', 'gauge', pool['idle']),
+            ('db_pool_max_connections', 'Pool size limit.', 'gauge', pool['max']),
+        ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# Server-Sent Events: chat messages and document versions for one document
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+SSE_REPLAY_LIMIT = 1000
+
+def load_chat_message(message_id):
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'get_chat_message', (message_id,))
+        msg = cur.fetchone()
+    return message_to_json(msg) if msg else None
+
+def stream_position(document_id):
+    # (document version, last chat message id) as currently stored
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'document_stream_position', (document_id,))
+        return cur.fetchone()
+
+def missed_events(document_id, version, message_id):
+    # Everything committed after the given stream position, oldest first
+    events = []
+    with connection() as conn, conn.cursor() as cur:
+        db.execute(cur, 'document_stream_position', (document_id,))
+        current_version, _ = cur.fetchone()
+        while True:
+            db.execute(cur, 'chat_messages_after', (document_id, message_id, SSE_REPLAY_LIMIT))
+            messages = cur.fetchall()
+            events.extend({'type': 'message', 'data': message_to_json(msg)} for msg in messages)
+            if len(messages) < SSE_REPLAY_LIMIT:
+                break
+            message_id = messages[-1][0]
+    if current_version > version:
+        events.append({'type': 'document', 'data': {'id': document_id, 'version': current_version}})
+    return events
+
+def parse_event_id(value):
+    # Event ids are "<document version>:<last chat message id>"
+    try:
+        version, message_id = value.split(':')
+        return int(version), int(message_id)
+    except (AttributeError, ValueError):
+        return None
+
+@app.route('/api/stream/<int:document_id>', methods=['GET'])
+def stream_document_events(document_id):
+    position = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('lastEventId'))
+    current = stream_position(document_id)
+    if not current:
+        return jsonify({'error': 'Document not found'}), 404
+    
+    # Subscribe before reading the backlog so nothing falls in between;
+    # duplicates are dropped below by comparing against the position.
+    subscription = realtime.get_broker(load_chat_message).subscribe(document_id)
+    try:
+        backlog = missed_events(document_id, *position) if position else []
+    except Exception:
+        subscription.close()
+        raise
+    version, message_id = position or current
+    
+    def generate():
+        nonlocal version, message_id
+        try:
+            yield 'retry: 3000\n\n'
+            pending = backlog
+            while True:
+                for event in pending:
+                    data = event['data']
+                    if event['type'] == 'message':
+                        if data['id'] <= message_id:
+                            continue
+                        message_id = data['id']
+                    else:
+                        if data['version'] <= version:
+                            continue
+                        version = data['version']
+                    yield f"id: {version}:{message_id}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+                
+                event = subscription.get(timeout=SSE_HEARTBEAT)
+                if event is None:
+                    pending = []
+                    yield ': keepalive\n\n'
+                elif event is realtime.RESYNC:
+                    pending = missed_events(document_id, version, message_id)
+                else:
+                    pending = [event]
+        finally:
+            subscription.close()
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(subscription.close)
+    return response
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,111 @@
+"""Autosave storm: PUT /api/documents with and without write-behind.
+
+    python benchmarks/bench_autosave.py --saves 2000 --size 50000 --clients 8
+
+--clients threads each replace one project's document --saves times in
+total, through the Flask test client, with text of --size characters.
+Reports saves/sec, save latency, the WAL generated and how many row
+versions of documents were written. Each mode runs in its own process
+since the write-behind settings are read at import. Uses the database
+configured through DB_HOST/DB_NAME/...
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = [
+    ('write-through', {'DOCUMENT_WRITE_BEHIND': '0'}),
+    ('write-behind', {'DOCUMENT_WRITE_BEHIND': '1'}),
+]
+
+
+def counters(cur):
+    cur.execute('''
+        SELECT pg_current_wal_lsn(), n_tup_upd + n_tup_hot_upd
+        FROM pg_stat_user_tables WHERE relname = 'documents'
+    ''')
+    return cur.fetchone()
+
+
+def child(saves, size, clients):
+    sys.path.insert(0, ROOT)
+    import app
+    import db
+
+    client = app.app.test_client()
+    project_id = client.post('/api/projects', json={'title': 'bench_autosave'}).get_json()['id']
+    filler = ('lorem ipsum dolor sit amet ' * (size // 27 + 1))[:size]
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute('SELECT pg_stat_force_next_flush()')
+        start_lsn, start_updates = counters(cur)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def save(count, offset):
+        thread_client = app.app.test_client()
+        for i in range(count):
+            began = time.perf_counter()
+            response = thread_client.put(f'/api/documents/{project_id}', json={
+                'text': f'{offset + i} {filler}', 'code': 'print("hello")'
+            })
+            assert response.status_code == 200, response.status_code
+            with lock:
+                latencies.append(time.perf_counter() - began)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=save, args=(saves // clients, n * saves)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if app.document_writes is not None:
+        app.document_writes.flush()
+
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute('SELECT pg_stat_force_next_flush()')
+        end_lsn, end_updates = counters(cur)
+        cur.execute('SELECT pg_wal_lsn_diff(%s, %s)', (end_lsn, start_lsn))
+        wal = int(cur.fetchone()[0])
+    latencies.sort()
+    print(json.dumps({
+        'rate': len(latencies) / elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000,
+        'wal': wal,
+        'updates': end_updates - start_updates,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--saves', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=50000, help='characters of text per save')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.saves, args.size, args.clients)
+        return
+
+    for label, mode_env in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', '--saves', str(args.saves), '--size', str(args.size),
+             '--clients', str(args.clients)],
+            env=dict(os.environ, **mode_env), check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print('%-14s %7.0f saves/s  p50 %6.1f ms  p99 %6.1f ms  WAL %8.1f MB  row versions %d' % (
+            label, result['rate'], result['p50'], result['p99'], result['wal'] / 1e6, result['updates']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Task import throughput: one POST /api/tasks per task vs. POST /api/tasks/bulk.
+
+    python benchmarks/bench_bulk.py --tasks 5000
+
+Imported tasks go into a throwaway project that is removed afterwards.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=1000, help='rows per bulk request')
+    args = parser.parse_args()
+
+    import app
+    import db
+
+    client = app.app.test_client()
+    project_id = client.post('/api/projects', json={'title': 'bench_bulk'}).get_json()['id']
+    rows = [{
+        'title': f'Imported task {i}', 'description': 'From the benchmark', 'status': 'Todo',
+        'priority': ('Low', 'Medium', 'High')[i % 3], 'dueDate': '2025-06-01', 'projectId': project_id
+    } for i in range(args.tasks)]
+
+    single_ids = []
+    try:
+        # create_task always files tasks under project 1 and prints per call
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for row in rows:
+                single_ids.append(client.post('/api/tasks', json=row).get_json()['id'])
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(0, len(rows), args.batch):
+            response = client.post('/api/tasks/bulk', json=rows[i:i + args.batch])
+            assert response.status_code == 201, response.get_json()
+        bulk = time.perf_counter() - start
+
+        print('single-row  %8.0f tasks/s' % (args.tasks / single))
+        print('bulk (%d)  %8.0f tasks/s  (%.1fx)' % (args.batch, args.tasks / bulk, single / bulk))
+    finally:
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute('DELETE FROM tasks WHERE id = ANY(%s) OR project_id = %s', (single_ids, project_id))
+            cur.execute('DELETE FROM documents WHERE project_id = %s', (project_id,))
+            cur.execute('DELETE FROM projects WHERE id = %s', (project_id,))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Chat ingestion throughput: one commit per message vs. group commit.
+
+Posts chat messages from --senders concurrent keep-alive connections for
+--duration seconds and reports messages/sec and latency, once per sender
+count and mode:
+
+    python benchmarks/bench_chat.py --senders 1 50 500
+
+Runs against the database configured through DB_HOST/DB_NAME/... . Each
+mode gets its own gthread gunicorn (--workers processes), since the
+batching settings are read at import. CHAT_BATCH_MAX_ROWS=1 writes every
+message in its own transaction on the request thread.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post_json(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def start_server(env, workers, threads):
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '-k', 'gthread', '-w', str(workers), '--threads', str(threads),
+        # gthread keeps at most worker_connections - threads idle keep-alive sockets
+        '--worker-connections', str(threads * 2 + 64), '--backlog', str(threads + 64),
+        '--graceful-timeout', '1', '--log-level', 'warning', '-b', f'127.0.0.1:{port}', 'app:app'
+    ], cwd=ROOT, env=env)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + '/api/cache/stats').close()
+            return server, url
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+async def sender(host, port, path, member_id, stop_at, latencies, failures):
+    reader = writer = None
+    body = json.dumps({'member_id': member_id, 'message': 'bench message'}).encode()
+    request = (b'POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n'
+               b'Content-Length: %d\r\n\r\n%s' % (path.encode(), host.encode(), len(body), body))
+    try:
+        while time.perf_counter() < stop_at:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            began = time.perf_counter()
+            try:
+                writer.write(request)
+                status_line = await reader.readline()
+            except ConnectionError:
+                status_line = b''
+            if not status_line:
+                # Server closed the keep-alive connection; reconnect and resend
+                writer.close()
+                writer = None
+                continue
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            if status_line.split()[1] == b'201':
+                latencies.append(time.perf_counter() - began)
+            else:
+                failures.append(status_line)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run(url, document_id, member_id, senders, duration):
+    host, port = url[len('http://'):].split(':')
+    latencies, failures = [], []
+    stop_at = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        sender(host, int(port), f'/api/documents/{document_id}/messages', member_id, stop_at, latencies, failures)
+        for _ in range(senders)
+    ])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(latencies) / elapsed, latencies, len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--senders', type=int, nargs='+', default=[1, 50, 500])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    modes = [
+        ('commit per message', {'CHAT_BATCH_MAX_ROWS': '1'}),
+        ('group commit', {}),
+    ]
+    threads = max(args.senders) + 16
+    for label, mode_env in modes:
+        server, url = start_server(dict(os.environ, **mode_env), args.workers, threads)
+        try:
+            project = post_json(url + '/api/projects', {'title': 'bench_chat'})
+            member = post_json(url + '/api/members', {
+                'name': 'Bench', 'email': f'bench-chat-{time.time()}@example.com', 'role': 'dev'
+            })
+            with urllib.request.urlopen(f"{url}/api/documents/{project['id']}") as response:
+                document_id = json.loads(response.read())['id']
+            for senders in args.senders:
+                rate, latencies, failures = asyncio.run(run(url, document_id, member['id'], senders, args.duration))
+                print('%-20s %4d senders: %8.0f msg/s  p50 %6.1f ms  p99 %6.1f ms  %d failed' % (
+                    label, senders, rate, latencies[len(latencies) // 2] * 1000,
+                    latencies[int(len(latencies) * 0.99)] * 1000, failures))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
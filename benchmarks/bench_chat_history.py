@@ -0,0 +1,218 @@
+"""Chat history at scale: one chat_messages heap vs. monthly partitions.
+
+    python benchmarks/bench_chat_history.py --messages 50000000 --months 24 --retention 12
+
+Starts a throwaway Postgres (see pgfixture.py) and migrates it to version 2,
+so chat_messages is still a single table. It loads --messages messages
+spread evenly over the last --months months, across --documents documents
+with a skew towards the first ones. Then it reports, for that layout and
+again after migration 3 has partitioned the table:
+
+- insert: one INSERT ... RETURNING per message, in its own transaction,
+  as a lone chat post issues it,
+- latest page: the newest 100 messages of a random document,
+- previous page: the 100 before those (before_id),
+- poll: messages since the second-to-last one (since_id).
+
+Reads go through the same statements the app uses for each layout; for
+the partitioned table that is chat_partitions.read_before/read_since. It
+also times migration 3 itself and an archival run with a --retention
+month window. It then compares table sizes, and times a page that has to
+come from the archive (archived=true).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from pgfixture import TempPostgres
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The paged reads before partitioning
+UNPARTITIONED_STATEMENTS = {
+    'bench_latest': 'SELECT id, member_id, message, created_at FROM chat_messages WHERE document_id = %s ORDER BY id DESC LIMIT %s',
+    'bench_before': 'SELECT id, member_id, message, created_at FROM chat_messages WHERE document_id = %s AND id < %s ORDER BY id DESC LIMIT %s',
+    'bench_since': 'SELECT id, member_id, message, created_at FROM chat_messages WHERE document_id = %s AND id > %s ORDER BY id LIMIT %s',
+}
+
+WORDS = ['meeting', 'review', 'deploy', 'bug', 'login', 'cache', 'release', 'design', 'sprint', 'latency']
+
+PAGE = 100
+
+
+def load(conn, messages, months, documents, members, chunk=1000000):
+    conn.autocommit = False
+    with conn, conn.cursor() as cur:
+        cur.execute('''
+            INSERT INTO projects (title) SELECT 'Project ' || g FROM generate_series(1, %s) g
+        ''', (documents,))
+        cur.execute("INSERT INTO documents (project_id, text, code) SELECT id, '', '' FROM projects ORDER BY id")
+        cur.execute('''
+            INSERT INTO members (name, email, role)
+            SELECT 'Member ' || g, 'member' || g || '@bench.local', 'editor' FROM generate_series(1, %s) g
+        ''', (members,))
+    started = time.perf_counter()
+    for first in range(1, messages + 1, chunk):
+        last = min(first + chunk - 1, messages)
+        with conn, conn.cursor() as cur:
+            # No NOTIFY per row and no per-row foreign key checks, as in seed.py
+            cur.execute('SET LOCAL session_replication_role = replica')
+            cur.execute('SELECT setseed(%s)', (first / (messages + 1),))
+            # Oldest first so ids follow time
+            cur.execute('''
+                INSERT INTO chat_messages (document_id, member_id, message, created_at)
+                SELECT 1 + floor(power(random(), 3) * %s)::int, 1 + floor(random() * %s)::int,
+                       (%s)[1 + g %% 10] || ' ' || (%s)[1 + (g / 10) %% 10] || ' update ' || g,
+                       localtimestamp - interval '1 month' * %s * (1 - g::float / %s)
+                FROM generate_series(%s, %s) g
+            ''', (documents, members, WORDS, WORDS, months, messages, first, last))
+        print('  loaded %d/%d messages (%.0fs)' % (last, messages, time.perf_counter() - started), flush=True)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE')
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def report(label, timings):
+    p50, p99 = percentiles(timings)
+    print('  %-16s p50 %7.2f ms  p99 %7.2f ms' % (label, p50, p99), flush=True)
+
+
+def measure(conn, documents, members, samples, partitioned, partition_map=None):
+    import chat_partitions
+    import db
+
+    rng = random.Random(7)
+    # Skewed like the data: mostly busy documents, some quiet ones
+    targets = [1 + int(rng.random() ** 3 * documents) for _ in range(samples)]
+    inserts, latest, previous, polls = [], [], [], []
+    with conn.cursor() as cur:
+        if partitioned:
+            partition_map.get(cur)
+        for document_id in targets:
+            started = time.perf_counter()
+            cur.execute('''
+                INSERT INTO chat_messages (document_id, member_id, message) VALUES (%s, %s, %s)
+                RETURNING id, created_at
+            ''', (document_id, rng.randint(1, members), 'bench message'))
+            cur.fetchone()
+            inserts.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            if partitioned:
+                rows = chat_partitions.read_before(cur, partition_map, document_id, None, PAGE)
+            else:
+                db.execute(cur, 'bench_latest', (document_id, PAGE))
+                rows = cur.fetchall()
+            latest.append(time.perf_counter() - started)
+            if len(rows) < 2:
+                continue
+
+            started = time.perf_counter()
+            if partitioned:
+                chat_partitions.read_before(cur, partition_map, document_id, rows[-1][0], PAGE)
+            else:
+                db.execute(cur, 'bench_before', (document_id, rows[-1][0], PAGE))
+                cur.fetchall()
+            previous.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            if partitioned:
+                chat_partitions.read_since(cur, partition_map, document_id, rows[1][0], PAGE)
+            else:
+                db.execute(cur, 'bench_since', (document_id, rows[1][0], PAGE))
+                cur.fetchall()
+            polls.append(time.perf_counter() - started)
+    report('insert', inserts)
+    report('latest page', latest)
+    report('previous page', previous)
+    report('poll', polls)
+
+
+def relation_sizes(cur):
+    cur.execute('''
+        SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0)::bigint
+        FROM pg_class c LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE c.relname = 'chat_messages' OR i.inhparent = 'chat_messages'::regclass
+    ''')
+    live = cur.fetchone()[0]
+    cur.execute("SELECT to_regclass('chat_messages_archive')")
+    archive = 0
+    if cur.fetchone()[0] is not None:
+        cur.execute("SELECT pg_total_relation_size('chat_messages_archive')")
+        archive = cur.fetchone()[0]
+    return live, archive
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50000000)
+    parser.add_argument('--months', type=int, default=24, help='history spread over this many months')
+    parser.add_argument('--retention', type=int, default=12, help='months kept live by the archival run')
+    parser.add_argument('--documents', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=500)
+    args = parser.parse_args()
+
+    with TempPostgres() as pg:
+        os.environ.update(pg.env())
+        sys.path.insert(0, ROOT)
+        import chat_partitions
+        import db
+        import migrations
+
+        db.STATEMENTS.update(UNPARTITIONED_STATEMENTS)
+        conn = db.connect()
+        migrations.migrate(conn, log=lambda message: None, target=2)
+        print('Loading %d messages over %d months' % (args.messages, args.months), flush=True)
+        load(conn, args.messages, args.months, args.documents, args.members)
+        with conn.cursor() as cur:
+            live, _ = relation_sizes(cur)
+        print('unpartitioned (%.0f MB with indexes)' % (live / 1e6))
+        measure(conn, args.documents, args.members, args.samples, partitioned=False)
+
+        started = time.perf_counter()
+        migrations.migrate(conn, log=lambda message: None, target=3)
+        print('migration 3 took %.0fs' % (time.perf_counter() - started))
+        with conn.cursor() as cur:
+            cur.execute('VACUUM ANALYZE')
+            live, _ = relation_sizes(cur)
+        partition_map = chat_partitions.PartitionMap(ttl=3600)
+        print('partitioned, %d months live (%.0f MB)' % (args.months + 1, live / 1e6))
+        measure(conn, args.documents, args.members, args.samples, partitioned=True, partition_map=partition_map)
+
+        started = time.perf_counter()
+        _, archived = chat_partitions.maintain(conn, retention=args.retention, log=lambda message: None)
+        elapsed = time.perf_counter() - started
+        with conn.cursor() as cur:
+            cur.execute('VACUUM ANALYZE')
+            live, archive = relation_sizes(cur)
+        print('archived %d months in %.0fs: live %.0f MB, archive %.0f MB' % (
+            len(archived), elapsed, live / 1e6, archive / 1e6))
+        partition_map.invalidate()
+        print('partitioned, %d months live' % (args.retention + 1))
+        measure(conn, args.documents, args.members, args.samples, partitioned=True, partition_map=partition_map)
+
+        # Pages that reach past the live partitions into the archive
+        timings = []
+        rng = random.Random(11)
+        with conn.cursor() as cur:
+            for _ in range(min(args.samples, 100)):
+                document_id = 1 + int(rng.random() ** 3 * args.documents)
+                cur.execute('SELECT MIN(id) FROM chat_messages WHERE document_id = %s', (document_id,))
+                oldest_live = cur.fetchone()[0]
+                started = time.perf_counter()
+                chat_partitions.read_before(cur, partition_map, document_id, oldest_live, PAGE, archived=True)
+                timings.append(time.perf_counter() - started)
+        report('archived page', timings)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
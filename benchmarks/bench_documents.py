@@ -0,0 +1,100 @@
+"""Bytes on the wire and in the database for multi-megabyte documents.
+
+    python benchmarks/bench_documents.py --text-mb 4 --code-mb 1 --saves 20
+
+Fills one project's document with --text-mb of prose and --code-mb of code
+drawn from the seed vocabulary, then reports:
+
+- response sizes of GET /api/documents for each Accept-Encoding, for the
+  whole document and with ?fields=code,
+- request sizes of the PUT body in each Content-Encoding,
+- WAL and table growth (documents plus its TOAST table) for --saves saves
+  that change only the code, and for --saves saves of identical content.
+
+Goes through the Flask test client against the database configured through
+DB_HOST/DB_NAME/...; the bodies are measured as the app sends them.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_content(text_mb, code_mb, seed=42):
+    from seed import VOCABULARY
+
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    words = rng.choices(VOCABULARY, weights, k=int(text_mb * 1e6 / 7))
+    text = ''
+    for start in range(0, len(words), 12):
+        text += ' '.join(words[start:start + 12]).capitalize() + '.\n'
+    lines = []
+    while sum(map(len, lines)) < code_mb * 1e6:
+        name = rng.choice(VOCABULARY[:80])
+        lines.append(f'def {name}_{len(lines)}(value):\n    return {name}(value) + {rng.randint(0, 999)}\n')
+    return text[:int(text_mb * 1e6)], ''.join(lines)
+
+
+def table_size(cur):
+    cur.execute("SELECT pg_current_wal_lsn(), pg_total_relation_size('documents')")
+    return cur.fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--text-mb', type=float, default=4)
+    parser.add_argument('--code-mb', type=float, default=1)
+    parser.add_argument('--saves', type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import app
+    import db
+
+    client = app.app.test_client()
+    project_id = client.post('/api/projects', json={'title': 'bench_documents'}).get_json()['id']
+    text, code = make_content(args.text_mb, args.code_mb)
+    body = json.dumps({'text': text, 'code': code}).encode()
+    headers = {'Content-Type': 'application/json'}
+    assert client.put(f'/api/documents/{project_id}', data=body, headers=headers).status_code == 200
+
+    print(f'text {len(text) / 1e6:.1f} MB, code {len(code) / 1e6:.1f} MB')
+    codings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    for path in ['', '?fields=code']:
+        for coding in codings:
+            response = client.get(f'/api/documents/{project_id}{path}', headers={'Accept-Encoding': coding})
+            print('GET  %-14s %-9s %10d bytes  (Content-Encoding: %s)' % (
+                path or '(all fields)', coding, len(response.get_data()),
+                response.headers.get('Content-Encoding', 'identity')))
+    encoded = {'identity': body, 'gzip': gzip.compress(body)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=5)
+    for coding, payload in encoded.items():
+        print('PUT  body           %-9s %10d bytes' % (coding, len(payload)))
+
+    with db.connection() as conn, conn.cursor() as cur:
+        for label, vary_code in [('code-only saves', True), ('identical saves', False)]:
+            start_lsn, start_size = table_size(cur)
+            for i in range(args.saves):
+                save = {'text': text, 'code': code + (f'# save {i}\n' if vary_code else '')}
+                response = client.put(f'/api/documents/{project_id}', json=save)
+                assert response.status_code == 200, response.status_code
+            end_lsn, end_size = table_size(cur)
+            cur.execute('SELECT pg_wal_lsn_diff(%s, %s)', (end_lsn, start_lsn))
+            wal = int(cur.fetchone()[0])
+            print('%-16s x%d: WAL %8.1f MB, documents grew %8.1f MB (now %.1f MB)' % (
+                label, args.saves, wal / 1e6, (end_size - start_size) / 1e6, end_size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
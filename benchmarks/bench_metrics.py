@@ -0,0 +1,90 @@
+"""Cost of the request metrics: requests/sec with METRICS_ENABLED=0 vs 1.
+
+Runs against the database configured through DB_HOST/DB_NAME/... :
+
+    python benchmarks/bench_metrics.py --requests 5000 --threads 8 --rounds 3
+
+Each mode runs in its own process because metrics.py and db.py read their
+settings at import. Rounds alternate between the modes so drift in the
+machine's load hits both equally; the best round of each is reported.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_child(requests, threads):
+    sys.path.insert(0, ROOT)
+    import app
+
+    client = app.app.test_client()
+    project = client.post('/api/projects', json={'title': 'bench'}).get_json()
+    paths = [
+        '/api/projects/%d' % project['id'],
+        '/api/members',
+        '/api/tasks?limit=20',
+        '/api/projects/%d/task-stats' % project['id'],
+    ]
+    # Warm up prepared statements and caches on every pooled connection
+    for path in paths * threads:
+        client.get(path)
+    per_thread = requests // threads
+
+    def worker():
+        local = app.app.test_client()
+        for i in range(per_thread):
+            response = local.get(paths[i % len(paths)])
+            assert response.status_code == 200, response.status_code
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'requests': per_thread * threads, 'seconds': elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.requests, args.threads)
+        return
+
+    modes = [
+        ('metrics off', {'METRICS_ENABLED': '0'}),
+        ('metrics on', {'METRICS_ENABLED': '1'}),
+    ]
+    best = {}
+    for _ in range(args.rounds):
+        for label, env in modes:
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', '--requests', str(args.requests), '--threads', str(args.threads)],
+                env=dict(os.environ, DB_POOL_MAX=str(args.threads), **env),
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            rate = result['requests'] / result['seconds']
+            best[label] = max(best.get(label, 0), rate)
+
+    for label, _ in modes:
+        print('%-12s %8.1f req/s  %7.1f us/req' % (label, best[label], 1e6 / best[label]))
+    off, on = best['metrics off'], best['metrics on']
+    print('overhead     %7.1f%%  %7.1f us/req' % ((off - on) / off * 100, 1e6 / on - 1e6 / off))
+
+
+if __name__ == '__main__':
+    main()
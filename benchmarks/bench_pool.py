@@ -0,0 +1,71 @@
+"""Requests/sec with per-request connections vs. the pooled, prepared path.
+
+Runs against the database configured through DB_HOST/DB_NAME/... :
+
+    python benchmarks/bench_pool.py --requests 2000 --threads 8
+
+Each mode runs in its own process because db.py reads DB_POOL_MAX at import.
+The response cache is turned off in both, or they would mostly time cache hits.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_child(requests, threads):
+    sys.path.insert(0, ROOT)
+    import app
+
+    client = app.app.test_client()
+    project = client.post('/api/projects', json={'title': 'bench'}).get_json()
+    paths = ['/api/projects/%d' % project['id'], '/api/documents/%d' % project['id'], '/api/members']
+    per_thread = requests // threads
+
+    def worker():
+        local = app.app.test_client()
+        for i in range(per_thread):
+            response = local.get(paths[i % len(paths)])
+            assert response.status_code == 200, response.status_code
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'requests': per_thread * threads, 'seconds': elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.requests, args.threads)
+        return
+
+    modes = [
+        ('connect per request', {'DB_POOL_MAX': '0'}),
+        ('pooled + prepared', {'DB_POOL_MAX': str(max(args.threads, 1))}),
+    ]
+    for label, env in modes:
+        out = subprocess.run(
+            [sys.executable, __file__, '--child', '--requests', str(args.requests), '--threads', str(args.threads)],
+            env=dict(os.environ, RESPONSE_CACHE_SIZE='0', **env), capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print('%-20s %8.1f req/s' % (label, result['requests'] / result['seconds']))
+
+
+if __name__ == '__main__':
+    main()
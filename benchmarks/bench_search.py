@@ -0,0 +1,92 @@
+"""Latency of GET /api/search on a seeded corpus.
+
+    python benchmarks/bench_search.py --messages 1000000
+
+Starts a throwaway Postgres (see pgfixture.py), seeds it (see seed.py) and
+times each query through the Flask test client, so the numbers cover SQL,
+ranking, snippets and JSON encoding but not the network. --existing skips
+the fixture and uses the database configured through DB_HOST/DB_NAME/...
+as it is.
+"""
+import argparse
+import os
+import sys
+import time
+
+from pgfixture import TempPostgres
+from seed import DEFAULTS, create_schema, seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# From the most common seed vocabulary words down to the rarest
+QUERIES = [
+    ('very common word', 'q=meeting'),
+    ('common word', 'q=cache'),
+    ('mid-frequency term', 'q=topic50'),
+    ('rare term', 'q=topic4990'),
+    ('two words', 'q=deploy%20rollback'),
+    ('phrase', 'q=%22login%20page%22'),
+    ('no match', 'q=nonexistentterm'),
+    ('messages only', 'q=cache&types=messages'),
+    ('one project', 'q=cache&project_id=3'),
+    ('rare, one project', 'q=topic4990&project_id=3'),
+]
+
+
+def run(iterations):
+    sys.path.insert(0, ROOT)
+    import app
+
+    client = app.app.test_client()
+    print('%-20s %8s %8s %8s %6s' % ('query', 'p50 ms', 'p95 ms', 'max ms', 'hits'))
+    for label, query in QUERIES:
+        path = '/api/search?' + query
+        second_page = None
+        for _ in range(3):
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+            second_page = response.headers.get('X-Next-Cursor')
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = client.get(path)
+            response.get_data()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print('%-20s %8.2f %8.2f %8.2f %6d' % (
+            label, timings[len(timings) // 2], timings[int(len(timings) * 0.95)], timings[-1],
+            len(response.get_json())))
+        if second_page and label == 'common word':
+            started = time.perf_counter()
+            client.get(path + '&after=' + second_page).get_data()
+            print('%-20s %8.2f' % ('  next page', (time.perf_counter() - started) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name, type=int, default=1000000 if name == 'messages' else default)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--existing', action='store_true', help='use the configured database as is')
+    args = parser.parse_args()
+
+    if args.existing:
+        run(args.iterations)
+        return
+
+    with TempPostgres() as pg:
+        os.environ.update(pg.env())
+        create_schema()
+        sys.path.insert(0, ROOT)
+        import db
+
+        conn = db.connect()
+        started = time.perf_counter()
+        seed(conn, **{name: getattr(args, name) for name in DEFAULTS})
+        conn.close()
+        print('Seeded %d messages in %.0fs' % (args.messages, time.perf_counter() - started))
+        run(args.iterations)
+
+
+if __name__ == '__main__':
+    main()
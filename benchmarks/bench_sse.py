@@ -0,0 +1,145 @@
+"""Idle-subscriber load test for GET /api/stream/<document_id>.
+
+Opens --subscribers SSE connections to one document, posts --messages chat
+messages and reports how long each took to reach every subscriber, plus
+how many database connections the server held meanwhile:
+
+    python benchmarks/bench_sse.py --subscribers 2000
+
+Without --url a single gthread gunicorn worker is started for the run.
+Needs `ulimit -n` comfortably above the subscriber count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post_json(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def backend_connections():
+    sys.path.insert(0, ROOT)
+    import db
+
+    conn = db.connect()
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()")
+        count = cur.fetchone()[0]
+    conn.close()
+    return count
+
+
+async def subscriber(host, port, path, ready, received):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    await writer.drain()
+    ready.release()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'data: '):
+                data = json.loads(line[6:])
+                if 'message' in data:
+                    received.append((data['message'], time.perf_counter()))
+    finally:
+        writer.close()
+
+
+async def run(base_url, subscribers, messages):
+    parsed = urlparse(base_url)
+    project = post_json(base_url + '/api/projects', {'title': 'bench_sse'})
+    member = post_json(base_url + '/api/members', {
+        'name': 'Bench', 'email': f'bench-sse-{time.time()}@example.com', 'role': 'dev'
+    })
+    with urllib.request.urlopen(f"{base_url}/api/documents/{project['id']}") as response:
+        document_id = json.loads(response.read())['id']
+
+    ready = asyncio.Semaphore(0)
+    received = []
+    tasks = [
+        asyncio.create_task(subscriber(parsed.hostname, parsed.port, f'/api/stream/{document_id}', ready, received))
+        for _ in range(subscribers)
+    ]
+    for _ in range(subscribers):
+        await ready.acquire()
+    # Give the server time to register every subscription
+    await asyncio.sleep(2)
+    print(f'{subscribers} subscribers connected, {backend_connections()} database connections in use')
+
+    for i in range(messages):
+        received.clear()
+        sent = time.perf_counter()
+        await asyncio.to_thread(post_json, f'{base_url}/api/documents/{document_id}/messages', {
+            'member_id': member['id'], 'message': f'bench {i}'
+        })
+        deadline = sent + 30
+        while sum(1 for text, _ in received if text == f'bench {i}') < subscribers and time.perf_counter() < deadline:
+            await asyncio.sleep(0.005)
+        times = sorted(at - sent for text, at in received if text == f'bench {i}')
+        if not times:
+            print(f'message {i}: not delivered')
+            continue
+        print('message %d: delivered to %d/%d, first %.1f ms, p50 %.1f ms, last %.1f ms' % (
+            i, len(times), subscribers, times[0] * 1000, times[len(times) // 2] * 1000, times[-1] * 1000))
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--url', help='base URL of a running server, e.g. http://127.0.0.1:5000')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen([
+            sys.executable, '-m', 'gunicorn', '-k', 'gthread', '-w', '1',
+            '--threads', str(args.subscribers + 32), '--worker-connections', str(args.subscribers + 64),
+            '--backlog', str(args.subscribers + 64), '--graceful-timeout', '1',
+            '-b', f'127.0.0.1:{port}', 'app:app'
+        ], cwd=ROOT)
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(url + '/api/projects').close()
+                break
+            except OSError:
+                time.sleep(0.1)
+    try:
+        asyncio.run(run(url.rstrip('/'), args.subscribers, args.messages))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
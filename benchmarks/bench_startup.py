@@ -0,0 +1,87 @@
+"""Worker startup cost.
+
+    python benchmarks/bench_startup.py --runs 10 --workers 4
+
+Reports, against the database configured through DB_HOST/DB_NAME/...:
+
+- how long `import app` takes in a fresh interpreter (median of --runs),
+- whether `import app` succeeds while the database is unreachable,
+- how long a gunicorn with --workers workers takes from launch to its
+  first successful database-backed response (median of --runs), and how
+  many launches never got there because gunicorn gave up on its workers.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TIMER = '''
+import time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_import(env):
+    result = subprocess.run([sys.executable, '-c', IMPORT_TIMER], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def time_gunicorn(workers):
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '-w', str(workers), '--log-level', 'warning',
+        '-b', f'127.0.0.1:{port}', 'app:app'
+    ], cwd=ROOT, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < 60:
+            if server.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/api/projects') as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError('gunicorn did not answer within 60s')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    imports = [time_import(os.environ) for _ in range(args.runs)]
+    print('import app:              median %7.1f ms' % (statistics.median(imports) * 1000))
+    unreachable = time_import(dict(os.environ, DB_HOST='127.0.0.1', DB_PORT=str(free_port())))
+    print('import app, DB down:     %s' % ('ok' if unreachable is not None else 'fails'))
+    boots = [time_gunicorn(args.workers) for _ in range(args.runs)]
+    booted = [boot for boot in boots if boot is not None]
+    print('gunicorn -w %d to first response: median %7.1f ms, %d/%d launches failed' % (
+        args.workers, statistics.median(booted) * 1000 if booted else float('nan'),
+        len(boots) - len(booted), len(boots)))
+
+
+if __name__ == '__main__':
+    main()
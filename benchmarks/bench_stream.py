@@ -0,0 +1,87 @@
+"""Peak RSS of GET /api/tasks?all=true, buffered vs. streamed.
+
+Seeds --rows synthetic tasks into a throwaway project, then fetches them
+once per mode in a fresh process and reports the process's peak RSS:
+
+    python benchmarks/bench_stream.py --rows 1000000
+
+The seeded project is removed afterwards.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(project_id, stream):
+    import app
+
+    client = app.app.test_client()
+    baseline = peak_rss_mb()
+    url = '/api/tasks?all=true&project_id=%d%s' % (project_id, '&stream=true' if stream else '')
+    start = time.perf_counter()
+    response = client.get(url, buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    print(json.dumps({
+        'seconds': time.perf_counter() - start,
+        'bytes': size,
+        'rss_growth_mb': peak_rss_mb() - baseline,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--stream', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.stream)
+        return
+
+    import db
+
+    conn = db.connect()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO projects (title) VALUES ('bench_stream') RETURNING id")
+    project_id = cur.fetchone()[0]
+    try:
+        cur.execute('''
+            INSERT INTO tasks (title, description, status, due_date, priority, project_id)
+            SELECT 'Task ' || n, 'Synthetic task number ' || n,
+                   (ARRAY['Todo', 'In Progress', 'Completed'])[n %% 3 + 1],
+                   DATE '2025-01-01' + (n %% 365),
+                   (ARRAY['Low', 'Medium', 'High'])[n %% 3 + 1], %s
+            FROM generate_series(1, %s) AS n
+        ''', (project_id, args.rows))
+
+        for label, extra in (('buffered', []), ('streamed', ['--stream'])):
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', str(project_id)] + extra,
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print('%-9s %7.1f MB peak RSS growth  %6.2fs  %d bytes' % (
+                label, result['rss_growth_mb'], result['seconds'], result['bytes']))
+    finally:
+        cur.execute('DELETE FROM tasks WHERE project_id = %s', (project_id,))
+        cur.execute('DELETE FROM projects WHERE id = %s', (project_id,))
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
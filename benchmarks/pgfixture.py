@@ -0,0 +1,92 @@
+"""Throwaway Postgres cluster for the benchmarks.
+
+    with TempPostgres() as pg:
+        env = dict(os.environ, **pg.env())
+
+The cluster lives in a temporary directory, listens only on a unix socket
+inside it and is deleted on exit. Server binaries come from PG_BIN,
+`pg_config --bindir` or PATH. Postgres refuses to run as root, so as root
+(or with no binaries around) the `pgserver` package is used instead: it
+bundles the binaries and runs the server as its own user.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+import psycopg2
+
+PORT = 5432
+
+
+def find_bindir():
+    if os.environ.get('PG_BIN'):
+        return os.environ['PG_BIN']
+    try:
+        return subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    initdb = shutil.which('initdb')
+    return os.path.dirname(initdb) if initdb else None
+
+
+class TempPostgres:
+    def __init__(self, dbname='ProjectSection'):
+        self.dbname = dbname
+        self.dir = None
+        self.host = None
+        self._bindir = None
+        self._server = None
+
+    def start(self):
+        self.dir = tempfile.mkdtemp(prefix='bench-pg-')
+        data = os.path.join(self.dir, 'data')
+        bindir = find_bindir()
+        if bindir and os.geteuid() != 0:
+            self._bindir = bindir
+            subprocess.run([os.path.join(bindir, 'initdb'), '-D', data, '-U', 'postgres', '-A', 'trust',
+                            '-E', 'UTF8', '--no-sync'], check=True, capture_output=True)
+            subprocess.run([
+                os.path.join(bindir, 'pg_ctl'), '-D', data, '-l', os.path.join(self.dir, 'server.log'), '-w',
+                '-o', "-k %s -c listen_addresses='' -p %d -c max_connections=300" % (self.dir, PORT), 'start'
+            ], check=True, capture_output=True)
+            self.host = self.dir
+        else:
+            try:
+                import pgserver
+            except ImportError:
+                raise RuntimeError('no usable Postgres binaries: set PG_BIN, run as a non-root user, '
+                                   'or pip install pgserver')
+            self._server = pgserver.get_server(data, cleanup_mode='delete')
+            # pgserver puts the socket in the data directory
+            self.host = data
+
+        conn = psycopg2.connect(host=self.host, port=PORT, user='postgres', dbname='postgres')
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('CREATE DATABASE "%s"' % self.dbname)
+        conn.close()
+        return self
+
+    def env(self):
+        # For db.connection_params()
+        return {'DB_HOST': self.host, 'DB_PORT': str(PORT), 'DB_USER': 'postgres',
+                'DB_PASSWORD': '', 'DB_NAME': self.dbname}
+
+    def stop(self):
+        if self._server is not None:
+            self._server.cleanup()
+            self._server = None
+        elif self._bindir is not None:
+            subprocess.run([os.path.join(self._bindir, 'pg_ctl'), '-D', os.path.join(self.dir, 'data'),
+                            '-m', 'immediate', 'stop'], capture_output=True)
+            self._bindir = None
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,119 @@
+"""Fill a database with synthetic projects, members, tasks, documents and chat.
+
+    python benchmarks/seed.py --projects 20 --members 200 --tasks 100000 --messages 200000
+
+Uses the database configured through DB_HOST/DB_NAME/... and creates the
+schema first. Rows are generated inside Postgres with generate_series and a
+fixed setseed(), so the same arguments give the same data. Text is drawn
+from VOCABULARY with a steep skew towards its start, so searches range from
+terms in a third of all rows to terms in a handful. Meant for an empty
+database: every project gets one document.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULTS = {'projects': 20, 'members': 200, 'tasks': 100000, 'messages': 200000}
+
+# Most frequent first; the numbered topics make up the long tail
+VOCABULARY = (
+    'meeting review release deploy bug fix login page api database migration design sprint planning '
+    'customer feedback dashboard report invoice payment search index cache latency timeout error crash '
+    'backend frontend mobile android ios build pipeline test coverage refactor cleanup docs onboarding '
+    'security audit password token session upload download export import schedule deadline budget '
+    'estimate priority blocker question answer update status demo launch rollback hotfix config server '
+    'client network storage backup restore alert monitoring metrics performance memory query'
+).split() + ['topic%d' % i for i in range(5000)]
+
+PHRASE_SQL = '''
+CREATE FUNCTION pg_temp.seed_phrase(words text[], length int) RETURNS text AS $$
+    SELECT string_agg(words[1 + floor(power(random(), 3) * cardinality(words))::int], ' ')
+    FROM generate_series(1, length)
+$$ LANGUAGE sql VOLATILE
+'''
+
+
+def create_schema(env=None):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=ROOT, env=env, check=True)
+
+
+def seed(conn, projects, members, tasks, messages, random_seed=0.42):
+    sys.path.insert(0, ROOT)
+    import chat_partitions
+    import task_stats
+
+    conn.autocommit = False
+    with conn, conn.cursor() as cur:
+        # Skips every trigger for the bulk load: no NOTIFY per chat message,
+        # no per-statement counter upkeep. Counters are rebuilt below.
+        cur.execute('SET LOCAL session_replication_role = replica')
+        cur.execute(PHRASE_SQL)
+        cur.execute('SELECT setseed(%s)', (random_seed,))
+        cur.execute('''
+            INSERT INTO projects (title, description)
+            SELECT 'Project ' || g, 'Seeded project ' || g FROM generate_series(1, %s) g
+        ''', (projects,))
+        cur.execute('''
+            INSERT INTO documents (project_id, text, code)
+            SELECT id, pg_temp.seed_phrase(%s, 400), repeat(E'print("hello")\\n', 40)
+            FROM projects ORDER BY id
+        ''', (VOCABULARY,))
+        cur.execute('''
+            INSERT INTO members (name, email, role, avatar)
+            SELECT 'Member ' || g, 'member' || g || '@bench.local',
+                   (ARRAY['admin', 'editor', 'viewer'])[1 + g %% 3], NULL
+            FROM generate_series(1, %s) g
+        ''', (members,))
+        cur.execute('''
+            INSERT INTO tasks (title, description, status, assignee_id, due_date, priority, project_id)
+            SELECT pg_temp.seed_phrase(%s, 3 + g %% 4), pg_temp.seed_phrase(%s, 8 + g %% 13),
+                   (ARRAY['Todo', 'In Progress', 'Completed'])[1 + floor(random() * 3)::int],
+                   CASE WHEN random() < 0.2 THEN NULL ELSE m.lo + floor(random() * m.n)::int END,
+                   CURRENT_DATE + floor(random() * 180)::int - 90,
+                   (ARRAY['Low', 'Medium', 'High'])[1 + floor(random() * 3)::int],
+                   p.lo + g %% p.n
+            FROM generate_series(1, %s) g,
+                 (SELECT min(id) AS lo, count(*) AS n FROM projects) p,
+                 (SELECT min(id) AS lo, count(*) AS n FROM members) m
+        ''', (VOCABULARY, VOCABULARY, tasks))
+        # Spread over the last 90 days, oldest first so ids follow time
+        cur.execute("SELECT localtimestamp - interval '90 days', localtimestamp")
+        chat_partitions.create_partitions(cur, *cur.fetchone())
+        cur.execute('''
+            INSERT INTO chat_messages (document_id, member_id, message, created_at)
+            SELECT d.lo + g %% d.n, m.lo + floor(random() * m.n)::int, pg_temp.seed_phrase(%s, 4 + g %% 9),
+                   now() - interval '90 days' * (1 - g::float / %s)
+            FROM generate_series(1, %s) g,
+                 (SELECT min(id) AS lo, count(*) AS n FROM documents) d,
+                 (SELECT min(id) AS lo, count(*) AS n FROM members) m
+        ''', (VOCABULARY, max(messages, 1), messages))
+        cur.execute('RESET session_replication_role')
+        task_stats.rebuild(cur)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('ANALYZE')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name, type=int, default=default)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import db
+
+    create_schema()
+    conn = db.connect()
+    start = time.perf_counter()
+    seed(conn, args.projects, args.members, args.tasks, args.messages)
+    conn.close()
+    print('Seeded in %.1fs' % (time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""Load test of every API route against a seeded, throwaway Postgres.
+
+    python benchmarks/suite.py --tasks 100000 --messages 200000 --output results.json
+    python benchmarks/suite.py --baseline results.json    # exits 1 on a regression
+
+Starts a temporary cluster (see pgfixture.py), seeds it (see seed.py),
+serves app.py with gunicorn and drives each scenario in turn with
+--concurrency closed-loop keep-alive clients for --duration seconds. Reports
+requests/sec and p50/p95/p99 latency per scenario and writes them as JSON.
+
+With --baseline, a scenario regresses when its p95 grows or its throughput
+drops by more than --tolerance percent (and p95 by at least --min-delta-ms).
+Regressions and request errors make the exit status 1. Baselines are only
+comparable on the same machine with the same arguments.
+
+Long-lived SSE streams are left to bench_sse.py.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from pgfixture import TempPostgres
+from seed import DEFAULTS, create_schema, seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class Context:
+    # Ids of the seeded data, shared by every client
+    def __init__(self, cur):
+        cur.execute('SELECT array_agg(id ORDER BY id) FROM projects')
+        self.project_ids = cur.fetchone()[0]
+        cur.execute('SELECT array_agg(id ORDER BY id) FROM documents')
+        self.document_ids = cur.fetchone()[0]
+        cur.execute('SELECT array_agg(id ORDER BY id) FROM members')
+        self.member_ids = cur.fetchone()[0]
+        cur.execute('SELECT min(id), max(id) FROM tasks')
+        self.task_range = cur.fetchone()
+        cur.execute('SELECT min(id), max(id) FROM chat_messages')
+        self.message_range = cur.fetchone()
+        self.unique = itertools.count()
+        self.deletable_members = []
+
+    def task_id(self, rng):
+        return rng.randint(*self.task_range)
+
+    def new_task(self, rng):
+        return {'title': 'Load task', 'description': 'from suite.py', 'status': 'Todo',
+                'priority': rng.choice(['Low', 'Medium', 'High']),
+                'assignee': str(rng.choice(self.member_ids)), 'dueDate': '2030-01-01',
+                'projectId': rng.choice(self.project_ids)}
+
+    def new_member(self):
+        return {'name': 'Load member', 'email': 'load-%d-%d@bench.local' % (os.getpid(), next(self.unique)),
+                'role': 'viewer'}
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, payload, headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def get_json(self, path):
+        status, data = self.request('GET', path)
+        assert status == 200, (path, status, data[:200])
+        return json.loads(data)
+
+
+# Each scenario: (name, make_request) where make_request(ctx, rng, state)
+# returns (method, path, body, on_response or None). `state` is per client.
+def patch_document(ctx, rng, state):
+    project_id = rng.choice(ctx.project_ids)
+    versions = state.setdefault('versions', {})
+    if project_id not in versions:
+        versions[project_id] = state['client'].get_json('/api/documents/%d' % project_id)['version']
+
+    def on_response(status, data):
+        if status == 200:
+            versions[project_id] = json.loads(data)['version']
+    body = {'baseVersion': versions[project_id],
+            'ops': [{'op': 'insert', 'field': 'text', 'offset': 0, 'text': 'x'}]}
+    return 'PATCH', '/api/documents/%d' % project_id, body, on_response
+
+
+def delete_member(ctx, rng, state):
+    member_id = ctx.deletable_members.pop() if ctx.deletable_members else 0
+    return 'DELETE', '/api/members/%d' % member_id, None, None
+
+
+SCENARIOS = [
+    ('GET /api/projects', lambda ctx, rng, state: ('GET', '/api/projects', None, None)),
+    ('GET /api/projects/:id', lambda ctx, rng, state: (
+        'GET', '/api/projects/%d' % rng.choice(ctx.project_ids), None, None)),
+    ('POST /api/projects', lambda ctx, rng, state: (
+        'POST', '/api/projects', {'title': 'Load project', 'description': 'from suite.py'}, None)),
+    ('PUT /api/projects/:id', lambda ctx, rng, state: (
+        'PUT', '/api/projects/%d' % rng.choice(ctx.project_ids), {'title': 'Renamed %d' % rng.randint(0, 9)}, None)),
+    ('GET /api/projects/:id/dashboard', lambda ctx, rng, state: (
+        'GET', '/api/projects/%d/dashboard' % rng.choice(ctx.project_ids), None, None)),
+    ('GET /api/projects/:id/task-stats', lambda ctx, rng, state: (
+        'GET', '/api/projects/%d/task-stats' % rng.choice(ctx.project_ids), None, None)),
+    ('GET /api/members', lambda ctx, rng, state: ('GET', '/api/members', None, None)),
+    ('POST /api/members', lambda ctx, rng, state: ('POST', '/api/members', ctx.new_member(), None)),
+    ('DELETE /api/members/:id', delete_member),
+    ('POST /api/members/bulk', lambda ctx, rng, state: (
+        'POST', '/api/members/bulk', [ctx.new_member() for _ in range(100)], None)),
+    ('GET /api/tasks?limit=100', lambda ctx, rng, state: ('GET', '/api/tasks?limit=100', None, None)),
+    ('GET /api/tasks?project_id&status&sort=dueDate', lambda ctx, rng, state: (
+        'GET', '/api/tasks?project_id=%d&status=%s&sort=dueDate&limit=100' % (
+            rng.choice(ctx.project_ids), rng.choice(['Todo', 'In%20Progress', 'Completed'])), None, None)),
+    ('GET /api/tasks?project_id&all&stream', lambda ctx, rng, state: (
+        'GET', '/api/tasks?project_id=%d&all=true&stream=true' % rng.choice(ctx.project_ids), None, None)),
+    ('POST /api/tasks', lambda ctx, rng, state: ('POST', '/api/tasks', ctx.new_task(rng), None)),
+    ('PUT /api/tasks/:id', lambda ctx, rng, state: (
+        'PUT', '/api/tasks/%d' % ctx.task_id(rng), {'status': rng.choice(['Todo', 'In Progress', 'Completed'])}, None)),
+    ('POST /api/tasks/bulk', lambda ctx, rng, state: (
+        'POST', '/api/tasks/bulk', [ctx.new_task(rng) for _ in range(100)], None)),
+    ('PATCH /api/tasks/bulk', lambda ctx, rng, state: (
+        'PATCH', '/api/tasks/bulk', [{'id': ctx.task_id(rng), 'status': rng.choice(['Todo', 'Completed'])}
+                                     for _ in range(100)], None)),
+    ('GET /api/documents/:id', lambda ctx, rng, state: (
+        'GET', '/api/documents/%d' % rng.choice(ctx.project_ids), None, None)),
+    ('PATCH /api/documents/:id', patch_document),
+    ('PUT /api/documents/:id', lambda ctx, rng, state: (
+        'PUT', '/api/documents/%d' % rng.choice(ctx.project_ids),
+        {'text': 'Replaced text %d' % rng.randint(0, 9), 'code': 'print(1)'}, None)),
+    ('GET /api/documents/:id/messages?limit=100', lambda ctx, rng, state: (
+        'GET', '/api/documents/%d/messages?limit=100' % rng.choice(ctx.document_ids), None, None)),
+    ('GET /api/documents/:id/messages?before_id', lambda ctx, rng, state: (
+        'GET', '/api/documents/%d/messages?before_id=%d&limit=100' % (
+            rng.choice(ctx.document_ids), rng.randint(*ctx.message_range)), None, None)),
+    ('POST /api/documents/:id/messages', lambda ctx, rng, state: (
+        'POST', '/api/documents/%d/messages' % rng.choice(ctx.document_ids),
+        {'member_id': rng.choice(ctx.member_ids), 'message': 'load test message'}, None)),
+    ('GET /api/search?q=common', lambda ctx, rng, state: (
+        'GET', '/api/search?q=%s' % rng.choice(['meeting', 'cache', 'deploy']), None, None)),
+    ('GET /api/search?q=rare&project_id', lambda ctx, rng, state: (
+        'GET', '/api/search?q=topic%d&project_id=%d' % (rng.randint(0, 4999), rng.choice(ctx.project_ids)), None, None)),
+    ('GET /api/cache/stats', lambda ctx, rng, state: ('GET', '/api/cache/stats', None, None)),
+    ('GET /metrics', lambda ctx, rng, state: ('GET', '/metrics', None, None)),
+]
+
+
+def prepare(name, ctx, client, duration):
+    # Rows that a scenario consumes, created up front
+    if name == 'DELETE /api/members/:id':
+        for _ in range(int(duration * 5) + 1):
+            status, data = client.request('POST', '/api/members/bulk', [ctx.new_member() for _ in range(1000)])
+            ctx.deletable_members.extend(row['id'] for row in json.loads(data)['results'] if row['ok'])
+
+
+def run_scenario(name, make_request, ctx, host, port, concurrency, duration, warmup, seed_base):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_at = time.perf_counter() + 0.2
+    measure_from = start_at + warmup
+    stop_at = measure_from + duration
+
+    def client_loop(index):
+        rng = random.Random(seed_base * 1000 + index)
+        client = Client(host, port)
+        state = {'client': client}
+        mine, failed = [], 0
+        while time.perf_counter() < start_at:
+            time.sleep(0.001)
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            method, path, body, on_response = make_request(ctx, rng, state)
+            began = time.perf_counter()
+            try:
+                status, data = client.request(method, path, body)
+            except (http.client.HTTPException, OSError):
+                status, data = None, b''
+            ended = time.perf_counter()
+            if on_response:
+                on_response(status, data)
+            if began >= measure_from and ended <= stop_at:
+                if status is not None and 200 <= status < 300:
+                    mine.append(ended - began)
+                else:
+                    failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': round(len(latencies) / duration, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank, in milliseconds
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[index] * 1000, 3)
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base or not base.get('p95_ms') or not current.get('p95_ms'):
+            continue
+        p95_change = (current['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100
+        rps_change = (current['rps'] - base['rps']) / base['rps'] * 100 if base['rps'] else 0
+        current['vs_baseline'] = {'p95_pct': round(p95_change, 1), 'rps_pct': round(rps_change, 1)}
+        if p95_change > tolerance and current['p95_ms'] - base['p95_ms'] >= min_delta_ms:
+            regressions.append('%s: p95 %.2f ms -> %.2f ms (%+.0f%%)' % (
+                name, base['p95_ms'], current['p95_ms'], p95_change))
+        if rps_change < -tolerance:
+            regressions.append('%s: %.0f -> %.0f req/s (%+.0f%%)' % (name, base['rps'], current['rps'], rps_change))
+    return regressions
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(env, workers, threads):
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '-k', 'gthread', '-w', str(workers), '--threads', str(threads),
+        '--graceful-timeout', '1', '--log-level', 'warning', '-b', '127.0.0.1:%d' % port, 'app:app'
+    ], cwd=ROOT, env=env)
+    client = Client('127.0.0.1', port)
+    for _ in range(300):
+        try:
+            client.request('GET', '/api/cache/stats')
+            return server, port
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited with status %s' % server.returncode)
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name, type=int, default=default, help='rows to seed')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=1, help='unmeasured seconds before each scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='threads per gunicorn worker')
+    parser.add_argument('--scenario', action='append', help='run only scenarios whose name contains this')
+    parser.add_argument('--output', help='write results as JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=25, help='allowed change in percent')
+    parser.add_argument('--min-delta-ms', type=float, default=1, help='ignore smaller p95 increases')
+    args = parser.parse_args()
+
+    scenarios = [(name, make) for name, make in SCENARIOS
+                 if not args.scenario or any(s in name for s in args.scenario)]
+    seed_args = {name: getattr(args, name) for name in DEFAULTS}
+
+    with TempPostgres() as pg:
+        env = dict(os.environ, **pg.env(), DB_POOL_MAX=str(args.threads))
+        create_schema(env)
+        os.environ.update(pg.env())
+        import db
+
+        conn = db.connect()
+        started = time.perf_counter()
+        seed(conn, **seed_args)
+        print('Seeded %s in %.1fs' % (seed_args, time.perf_counter() - started))
+        with conn.cursor() as cur:
+            ctx = Context(cur)
+            cur.execute('SHOW server_version')
+            server_version = cur.fetchone()[0]
+        conn.close()
+
+        server, port = start_server(env, args.workers, args.threads)
+        results = {}
+        try:
+            print('%-48s %9s %9s %9s %9s %7s' % ('scenario', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+            for index, (name, make_request) in enumerate(scenarios):
+                prepare(name, ctx, Client('127.0.0.1', port), args.duration + args.warmup)
+                result = run_scenario(name, make_request, ctx, '127.0.0.1', port, args.concurrency,
+                                      args.duration, args.warmup, index)
+                results[name] = result
+                print('%-48s %9.1f %9s %9s %9s %7d' % (
+                    name, result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['errors']))
+        finally:
+            server.terminate()
+            server.wait()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance, args.min_delta_ms)
+
+    if args.output:
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip() or None
+        except OSError:
+            commit = None
+        meta = dict(seed_args, duration=args.duration, warmup=args.warmup, concurrency=args.concurrency,
+                    workers=args.workers, threads=args.threads, commit=commit, postgres=server_version,
+                    python=platform.python_version(), machine=platform.node(),
+                    timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    failed = [name for name, result in results.items() if result['errors']]
+    for name in failed:
+        print('ERRORS: %s had %d failed requests' % (name, results[name]['errors']))
+    for line in regressions:
+        print('REGRESSION: ' + line)
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
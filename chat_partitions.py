@@ -0,0 +1,328 @@
+"""Monthly partitions of chat_messages, and the archive behind them.
+
+chat_messages is range-partitioned on created_at, one partition per
+calendar month named chat_messages_pYYYY_MM (migration 3). maintain()
+keeps partitions ready a few months ahead. It also archives the months that
+ended more than a retention window ago: each document's messages from such
+a month become chat_messages_archive rows holding JSON arrays, which
+TOAST compresses, and the partition is dropped. Workers run maintain() from
+a background thread (see Maintainer). `flask --app app maintain-chat` runs
+it by hand.
+
+History is paged by message id, but partitions split it by time. Ids are
+drawn while a row is inserted and created_at is the start of its
+transaction, so the two orders can disagree for messages written moments
+apart around a month boundary. Readers don't assume they agree: the
+PartitionMap records the id range each partition holds, and the read_*
+functions use it to decide which partitions can hold the ids they want.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from psycopg2 import sql
+
+import db
+
+PREFIX = 'chat_messages_p'
+# Shared by every process creating or archiving partitions
+LOCK_KEY = 7305417
+# Months of partitions created ahead of the current one
+MONTHS_AHEAD = 3
+# How long after its month a partition may still receive rows, from
+# transactions that started before the month ended
+CLOSE_AFTER = timedelta(hours=1)
+# chat_messages.id is an INTEGER
+MAX_ID = 2 ** 31 - 1
+# Messages per archive row, so an archived page never unpacks a busy
+# document's whole month
+ARCHIVE_BATCH = 1000
+
+log = logging.getLogger(__name__)
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PREFIX}{month:%Y_%m}'
+
+
+def partitions(cur):
+    """Months that have a partition, oldest first."""
+    cur.execute('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_messages'::regclass
+    ''')
+    months = []
+    for (name,) in cur.fetchall():
+        try:
+            months.append(datetime.strptime(name[len(PREFIX):], '%Y_%m'))
+        except ValueError:
+            continue
+    return sorted(months)
+
+
+def create_partitions(cur, first, last):
+    """Create the missing partitions for the months from `first` through
+    `last`; returns their names."""
+    existing = set(partitions(cur))
+    created = []
+    month = month_start(first)
+    while month <= last:
+        if month not in existing:
+            name = partition_name(month)
+            cur.execute(sql.SQL('CREATE TABLE {} PARTITION OF chat_messages FOR VALUES FROM (%s) TO (%s)').format(
+                sql.Identifier(name)), (month, add_months(month, 1)))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def _create_upcoming(cur, ahead):
+    cur.execute('SELECT localtimestamp')
+    now = cur.fetchone()[0]
+    return create_partitions(cur, now, add_months(now, ahead))
+
+
+def create_upcoming(cur, ahead=MONTHS_AHEAD):
+    """Create the partitions for this month and `ahead` more, waiting for a
+    maintain() in progress. Call inside a transaction."""
+    cur.execute('SELECT pg_advisory_xact_lock(%s)', (LOCK_KEY,))
+    return _create_upcoming(cur, ahead)
+
+
+def is_missing_partition(error):
+    # The CheckViolation raised for a row whose month has no partition
+    return (error.diag.message_primary or '').startswith('no partition of relation')
+
+
+def archive_partition(cur, month):
+    """Fold one month's partition into chat_messages_archive and drop it."""
+    name = sql.Identifier(partition_name(month))
+    cur.execute(sql.SQL('''
+        INSERT INTO chat_messages_archive (document_id, month, first_id, last_id, message_count, messages)
+        SELECT document_id, %s, MIN(id), MAX(id), COUNT(*),
+               json_agg(json_build_array(id, member_id, message, created_at) ORDER BY id)
+        FROM (
+            SELECT *, (row_number() OVER (PARTITION BY document_id ORDER BY id) - 1) / %s AS batch FROM {}
+        ) m
+        GROUP BY document_id, batch
+    ''').format(name), (month, ARCHIVE_BATCH))
+    cur.execute(sql.SQL('DROP TABLE {}').format(name))
+
+
+def maintain(conn, ahead=MONTHS_AHEAD, retention=0, log=log.info):
+    """Create partitions through `ahead` months from now and archive those
+    that ended more than `retention` months ago (0 archives nothing).
+
+    Returns the (created, archived) partition names, both empty when
+    another process is already at it. Each archived month is its own
+    transaction. `conn` must be in autocommit mode, and is again afterwards.
+    """
+    created, archived = [], []
+    conn.autocommit = False
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                return created, archived
+            created = _create_upcoming(cur, ahead)
+            cur.execute('SELECT localtimestamp')
+            cutoff = add_months(month_start(cur.fetchone()[0]), -retention)
+            expired = [month for month in partitions(cur) if retention and month < cutoff]
+        for name in created:
+            log(f'Created partition {name}')
+        for month in expired:
+            with conn, conn.cursor() as cur:
+                cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (LOCK_KEY,))
+                if not cur.fetchone()[0] or month not in partitions(cur):
+                    break
+                # Dropping the partition locks chat_messages; rather retry
+                # on the next run than hold up traffic behind a long query
+                cur.execute("SET LOCAL lock_timeout = '5s'")
+                archive_partition(cur, month)
+            archived.append(partition_name(month))
+            log(f'Archived partition {partition_name(month)}')
+    finally:
+        conn.autocommit = True
+    return created, archived
+
+
+class Maintainer:
+    """Runs maintain() every `interval` seconds on a background thread, one
+    per worker process. The advisory lock leaves the work to one of them."""
+
+    def __init__(self, interval, ahead, retention, on_change=None, name='chat-maintenance'):
+        self.interval = interval
+        self.ahead = ahead
+        self.retention = retention
+        self.on_change = on_change
+        self.name = name
+        self.runs = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        # Threads don't survive gunicorn's fork; start one once per process
+        if self.interval > 0 and self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    threading.Thread(target=self._run, name=self.name, daemon=True).start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                conn = db.connect()
+                try:
+                    created, archived = maintain(conn, self.ahead, self.retention)
+                finally:
+                    conn.close()
+                self.runs += 1
+                if (created or archived) and self.on_change is not None:
+                    self.on_change()
+            except Exception:
+                self.failures += 1
+                log.exception('chat partition maintenance failed; retrying in %ss', self.interval)
+            time.sleep(self.interval)
+
+
+# lower/upper: the month's bounds (lower is None for the archive). An open
+# partition may still receive rows: min_id is None if it had none yet, and
+# max_id is always None. The archive's min_id is never looked up.
+Partition = namedtuple('Partition', 'lower upper open min_id max_id archive')
+
+
+def _may_hold_below(partition, before):
+    if partition.min_id is None:
+        return partition.open
+    return partition.min_id < before
+
+
+def _may_hold_above(partition, after):
+    if partition.max_id is None:
+        return partition.open
+    return partition.max_id > after
+
+
+class PartitionMap:
+    """The live partitions, newest first, each with the ids it holds, then
+    the archive if it holds anything. Reloaded every `ttl` seconds."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def get(self, cur):
+        with self._lock:
+            loaded = self._loaded
+        if loaded is None or loaded[0] < time.monotonic():
+            loaded = (time.monotonic() + self.ttl, self._load(cur))
+            with self._lock:
+                self._loaded = loaded
+        return loaded[1]
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = None
+
+    def _load(self, cur):
+        cur.execute('SELECT localtimestamp')
+        now = cur.fetchone()[0]
+        closed_before = now - CLOSE_AFTER
+        loaded = []
+        for month in reversed(partitions(cur)):
+            # Months yet to come are empty; reads never put an upper bound
+            # on the newest month they cover
+            if month > now:
+                continue
+            upper = add_months(month, 1)
+            # By time range rather than by name, so a partition archived
+            # meanwhile reads as empty instead of failing
+            db.execute(cur, 'chat_partition_ids', (month, upper))
+            min_id, max_id = cur.fetchone()
+            is_open = upper > closed_before
+            loaded.append(Partition(month, upper, is_open, min_id, None if is_open else max_id, False))
+        db.execute(cur, 'chat_archive_max_id')
+        archive_max_id = cur.fetchone()[0]
+        if archive_max_id is not None:
+            loaded.append(Partition(None, loaded[-1].lower if loaded else None, False, None, archive_max_id, True))
+        return loaded
+
+
+def _by_id(rows, newest_first, limit=None):
+    rows = sorted(rows, key=lambda row: row[0], reverse=newest_first)
+    return rows if limit is None else rows[:limit]
+
+
+def _outranks(rows, limit, remaining):
+    # Whether `rows` (newest first) are the top `limit` no matter what the
+    # `remaining` partitions hold
+    if len(rows) < limit:
+        return False
+    lowest = rows[-1][0]
+    return all(partition.max_id is not None and partition.max_id < lowest for partition in remaining)
+
+
+def read_before(cur, partition_map, document_id, before_id, limit, archived=False):
+    """Up to `limit` messages of a document with ids below `before_id` (None
+    for the latest), newest first, as (id, member_id, message, created_at).
+
+    Partitions are read newest first: two, then the next four, then eight
+    and so on, until the rows found outrank every id the rest can hold. With
+    `archived` the archive counts as the oldest partition.
+    """
+    before = MAX_ID if before_id is None else before_id
+    mapped = partition_map.get(cur)
+    live = [p for p in mapped if not p.archive and _may_hold_below(p, before)]
+    archive = [p for p in mapped if p.archive and archived]
+    rows, index, size = [], 0, 2
+    upper = datetime.max
+    while index < len(live) and not _outranks(rows, limit, live[index:] + archive):
+        lower = live[min(index + size, len(live)) - 1].lower
+        db.execute(cur, 'chat_messages_before', (document_id, lower, upper, before, limit))
+        rows = _by_id(rows + cur.fetchall(), True, limit)
+        upper = lower
+        index += size
+        size *= 2
+    if archive and not _outranks(rows, limit, archive):
+        db.execute(cur, 'chat_archive_before', (document_id, before, before, limit, before, limit))
+        rows = _by_id(rows + cur.fetchall(), True, limit)
+    return rows
+
+
+def read_since(cur, partition_map, document_id, since_id, limit, archived=False):
+    """Up to `limit` messages of a document with ids above `since_id`,
+    oldest first. Only partitions holding such ids are read."""
+    mapped = partition_map.get(cur)
+    live = [p for p in mapped if not p.archive and _may_hold_above(p, since_id)]
+    rows = []
+    if live:
+        db.execute(cur, 'chat_messages_since', (document_id, live[-1].lower, since_id, limit))
+        rows = cur.fetchall()
+    if any(p.archive and _may_hold_above(p, since_id) for p in mapped) and archived:
+        db.execute(cur, 'chat_archive_since', (document_id, since_id, since_id, limit, since_id, limit))
+        rows = _by_id(rows + cur.fetchall(), False, limit)
+    return rows
+
+
+def read_all(cur, document_id, archived=False):
+    """Every message of a document, oldest first."""
+    db.execute(cur, 'chat_messages_all', (document_id,))
+    rows = cur.fetchall()
+    if archived:
+        db.execute(cur, 'chat_archive_all', (document_id,))
+        rows = _by_id(cur.fetchall() + rows, False)
+    return rows
@@ -0,0 +1,90 @@
+"""gzip and brotli Content-Encoding for response and request bodies.
+
+Responses are compressed as they are written, a chunk at a time, so a
+multi-megabyte document or a streamed list never sits in memory twice.
+brotli is used when the optional `brotli` package is installed and the
+client prefers it; gzip always works.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Input slice size when decompressing, so a bomb is caught after at most one
+# slice's worth of output past the limit
+_SLICE = 1024
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def supported():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    # accept_encodings: werkzeug's parsed Accept-Encoding. Returns the
+    # supported coding the client weighs highest, or None for identity.
+    best, quality = None, 0
+    for coding in supported():
+        q = accept_encodings[coding]
+        if q > quality:
+            best, quality = coding, q
+    return best
+
+
+def compress_stream(chunks, coding, level=None):
+    """Yield `chunks` (bytes) compressed with `coding`."""
+    if coding == 'br':
+        compressor = brotli.Compressor(quality=5 if level is None else level)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+
+
+def decompress(body, coding, limit):
+    """Decode a request body sent with Content-Encoding `coding`.
+
+    Raises BodyTooLarge past `limit` decoded bytes, ValueError for an
+    unsupported coding or corrupt data.
+    """
+    if coding in ('gzip', 'deflate'):
+        decompressor = zlib.decompressobj(31 if coding == 'gzip' else 15)
+        process, finish = decompressor.decompress, decompressor.flush
+        finished = lambda: decompressor.eof
+    elif coding == 'br' and brotli is not None:
+        decompressor = brotli.Decompressor()
+        process, finish = decompressor.process, lambda: b''
+        finished = decompressor.is_finished
+    else:
+        raise ValueError(f'Unsupported Content-Encoding: {coding}')
+
+    parts, size = [], 0
+    try:
+        for start in range(0, len(body), _SLICE):
+            part = process(body[start:start + _SLICE])
+            size += len(part)
+            if size > limit:
+                raise BodyTooLarge(f'Decoded body is larger than {limit} bytes')
+            parts.append(part)
+        part = finish()
+    except (zlib.error, getattr(brotli, 'error', zlib.error)) as e:
+        raise ValueError(f'Body is not valid {coding} data: {e}')
+    if not finished():
+        raise ValueError(f'Body is not valid {coding} data: truncated')
+    if size + len(part) > limit:
+        raise BodyTooLarge(f'Decoded body is larger than {limit} bytes')
+    parts.append(part)
+    return b''.join(parts)
@@ -0,0 +1,430 @@
+import os
+import re
+import threading
+import time
+import itertools
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+
+
+# Connection settings, shared by the pool and by one-off connections
+def connection_params():
+    return dict(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        database=os.environ.get('DB_NAME', 'ProjectSection'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASSWORD', 'kavin'),
+        port=os.environ.get('DB_PORT', '5432')
+    )
+
+
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+# Idle connections older than this are pinged with SELECT 1 before reuse
+POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30))
+# Rows fetched per round trip by server-side (streaming) cursors
+STREAM_ITERSIZE = int(os.environ.get('DB_STREAM_ITERSIZE', 2000))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    # Counts and times statements run on behalf of the current request
+
+    def execute(self, query, vars=None):
+        stats = metrics.current()
+        if stats is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            stats.record_query(query, time.perf_counter() - start)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    # Remembers which statements have been PREPAREd on this session
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+        if metrics.ENABLED:
+            self.cursor_factory = InstrumentedCursor
+
+
+def connect():
+    conn = psycopg2.connect(connection_factory=PooledConnection, **connection_params())
+    conn.autocommit = True
+    return conn
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of autocommit connections.
+
+    getconn() blocks for up to `timeout` seconds when every connection is
+    checked out, and raises PoolTimeout instead of opening more than `maxconn`.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=POOL_TIMEOUT, check_after=POOL_CHECK_AFTER):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError('invalid pool size: min=%s max=%s' % (minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self._idle = []
+        self._size = 0
+        self._lock = threading.Condition()
+        for _ in range(minconn):
+            self._idle.append(connect())
+            self._size += 1
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout('no database connection available after %ss' % self.timeout)
+                self._lock.wait(remaining)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = None
+                self._size += 1
+
+        # Connecting and health checks happen outside the lock
+        try:
+            if conn is not None and not self._healthy(conn):
+                # Reconnect in the same slot; giving it up first would let a
+                # waiter take it and push the pool past maxconn
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = connect()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            # Callers may switch autocommit off (e.g. for named cursors)
+            if not conn.autocommit:
+                conn.autocommit = True
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(conn)
+            self._lock.notify()
+
+    def stats(self):
+        with self._lock:
+            return {'size': self._size, 'idle': len(self._idle), 'max': self.maxconn}
+
+    def closeall(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+
+# One pool per process: gunicorn forks workers after import, and a forked
+# child must never reuse its parent's sockets.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(POOL_MIN, POOL_MAX)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+@contextmanager
+def connection():
+    # DB_POOL_MAX=0 turns pooling off (e.g. behind pgbouncer) and falls back
+    # to a fresh connection per request.
+    start = time.perf_counter()
+    if POOL_MAX == 0:
+        conn = connect()
+        metrics.record_pool_wait(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    pool = get_pool()
+    conn = pool.getconn()
+    metrics.record_pool_wait(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+@contextmanager
+def transaction():
+    # Like connection(), but everything inside runs in one transaction that
+    # commits on success and rolls back on any exception.
+    with connection() as conn:
+        conn.autocommit = False
+        with conn:
+            yield conn
+
+
+# Fixed queries run by the routes. With pooling on they are PREPAREd once per
+# connection and then run with EXECUTE, so Postgres skips parse/plan.
+STATEMENTS = {
+    'list_projects': 'SELECT id, title, description, created_at, updated_at FROM projects',
+    'get_project': 'SELECT id, title, description, created_at, updated_at FROM projects WHERE id = %s',
+    'project_updated_at': 'SELECT updated_at FROM projects WHERE id = %s',
+    'insert_project': 'INSERT INTO projects (title, description) VALUES (%s, %s) RETURNING id, created_at, updated_at',
+    'update_project': 'UPDATE projects SET title = %s, description = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING updated_at',
+    'list_members': 'SELECT id, name, email, role, avatar FROM members',
+    'members_version': "SELECT version FROM table_versions WHERE table_name = 'members'",
+    'insert_member': 'INSERT INTO members (name, email, role, avatar) VALUES (%s, %s, %s, %s) RETURNING id',
+    'delete_member': 'DELETE FROM members WHERE id = %s RETURNING id',
+    'get_member': 'SELECT name, avatar FROM members WHERE id = %s',
+    'get_members_by_id': 'SELECT id, name, avatar FROM members WHERE id = ANY(%s)',
+    'insert_task': '''INSERT INTO tasks (title, description, status, assignee_id,
+                             due_date, priority, project_id)
+           VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id''',
+    'update_task_status': 'UPDATE tasks SET status = %s WHERE id = %s RETURNING id',
+    # One row per counter plus an 'overdue' row (open tasks due before
+    # today); no rows at all when the project doesn't exist
+    'task_stats': '''
+        SELECT c.dimension, c.key, c.count
+        FROM projects p
+        CROSS JOIN LATERAL (
+            SELECT dimension::text, key, count FROM task_counters
+            WHERE project_id = p.id AND dimension <> 'open_due' AND count <> 0
+            UNION ALL
+            SELECT 'overdue', '', COALESCE(SUM(count), 0)::bigint FROM task_counters
+            WHERE project_id = p.id AND dimension = 'open_due' AND key < to_char(CURRENT_DATE, 'YYYY-MM-DD')
+        ) c
+        WHERE p.id = %s
+    ''',
+    'get_document': 'SELECT id, text, code, updated_at, version FROM documents WHERE project_id = %s',
+    'document_version': '''
+        SELECT d.id, GREATEST(d.version, COALESCE((SELECT MAX(version) FROM document_ops WHERE document_id = d.id), 0))
+        FROM documents d
+        WHERE d.project_id = %s
+    ''',
+    'lock_document': 'SELECT id, text, code, updated_at, version FROM documents WHERE project_id = %s FOR UPDATE',
+    # Latest version (snapshot or op log), then the snapshot's version, field
+    # hashes and timestamp, with the row locked for a full replace
+    'lock_document_head': '''
+        SELECT d.id, GREATEST(d.version, COALESCE((SELECT MAX(version) FROM document_ops WHERE document_id = d.id), 0)),
+               d.version, d.text_hash, d.code_hash, d.updated_at
+        FROM documents d
+        WHERE d.project_id = %s
+        FOR UPDATE OF d
+    ''',
+    'document_snapshot_version': 'SELECT version FROM documents WHERE id = %s',
+    'insert_document': 'INSERT INTO documents (project_id, text, code) VALUES (%s, %s, %s)',
+    'write_document_snapshot': 'UPDATE documents SET text = %s, code = %s, version = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING updated_at',
+    # One statement for GET /api/projects/<id>/dashboard. Members and tasks
+    # come back as JSON already in API shape; the document as its snapshot
+    # plus pending ops. The boolean parameters switch sections off.
+    'dashboard': '''
+        SELECT p.id, p.title, p.description, p.created_at, p.updated_at,
+               CASE WHEN %s THEN (
+                   SELECT json_agg(json_build_object(
+                       'id', m.id, 'name', m.name, 'email', m.email, 'role', m.role, 'avatar', m.avatar
+                   ) ORDER BY m.id)
+                   FROM members m
+               ) END,
+               CASE WHEN %s THEN (
+                   SELECT json_agg(json_build_object(
+                       'id', t.id, 'title', t.title, 'description', t.description, 'status', t.status,
+                       'assignee', COALESCE(t.assignee_id::text, ''), 'dueDate', t.due_date,
+                       'priority', t.priority, 'projectId', t.project_id
+                   ) ORDER BY t.id)
+                   FROM (SELECT * FROM tasks WHERE project_id = %s ORDER BY id LIMIT %s) t
+               ) END,
+               d.id, d.text, d.code, d.updated_at, d.version, d.pending
+        FROM projects p
+        LEFT JOIN LATERAL (
+            SELECT d.id, d.text, d.code, d.updated_at, d.version,
+                   (SELECT json_agg(json_build_array(o.version, o.ops, o.created_at) ORDER BY o.version)
+                    FROM document_ops o
+                    WHERE o.document_id = d.id AND o.version > d.version) AS pending
+            FROM documents d
+            WHERE %s AND d.project_id = p.id
+            LIMIT 1
+        ) d ON TRUE
+        WHERE p.id = %s
+    ''',
+    'document_ops_since': 'SELECT version, ops, created_at FROM document_ops WHERE document_id = %s AND version > %s ORDER BY version',
+    'insert_document_op': 'INSERT INTO document_ops (document_id, version, ops, client_id) VALUES (%s, %s, %s, %s) RETURNING created_at',
+    'prune_document_ops': 'DELETE FROM document_ops WHERE document_id = %s AND version <= %s',
+    'document_exists': 'SELECT id FROM documents WHERE id = %s',
+    'list_chat_messages': '''
+        SELECT cm.id, cm.member_id, m.name, m.avatar, cm.message, cm.created_at
+        FROM chat_messages cm
+        JOIN members m ON cm.member_id = m.id
+        WHERE cm.document_id = %s
+        ORDER BY cm.id
+    ''',
+    'chat_messages_all': 'SELECT id, member_id, message, created_at FROM chat_messages WHERE document_id = %s ORDER BY id',
+    # Paged reads name the months they cover so only those partitions are
+    # scanned; see chat_partitions.py
+    'chat_messages_since': '''
+        SELECT id, member_id, message, created_at FROM chat_messages
+        WHERE document_id = %s AND created_at >= %s AND id > %s
+        ORDER BY id LIMIT %s
+    ''',
+    'chat_messages_before': '''
+        SELECT id, member_id, message, created_at FROM chat_messages
+        WHERE document_id = %s AND created_at >= %s AND created_at < %s AND id < %s
+        ORDER BY id DESC LIMIT %s
+    ''',
+    'chat_partition_ids': 'SELECT MIN(id), MAX(id) FROM chat_messages WHERE created_at >= %s AND created_at < %s',
+    # Archived months are unpacked only as far as a page needs: a batch is
+    # read unless `limit` messages in batches entirely past it come first
+    'chat_archive_before': '''
+        SELECT (e->>0)::int, (e->>1)::int, e->>2, (e->>3)::timestamp
+        FROM chat_messages_archive b CROSS JOIN LATERAL json_array_elements(b.messages) e
+        WHERE b.document_id = %s AND b.first_id < %s
+          AND (SELECT COALESCE(SUM(n.message_count), 0) FROM chat_messages_archive n
+               WHERE n.document_id = b.document_id AND n.first_id > b.last_id AND n.last_id < %s) < %s
+          AND (e->>0)::int < %s
+        ORDER BY 1 DESC LIMIT %s
+    ''',
+    'chat_archive_since': '''
+        SELECT (e->>0)::int, (e->>1)::int, e->>2, (e->>3)::timestamp
+        FROM chat_messages_archive b CROSS JOIN LATERAL json_array_elements(b.messages) e
+        WHERE b.document_id = %s AND b.last_id > %s
+          AND (SELECT COALESCE(SUM(n.message_count), 0) FROM chat_messages_archive n
+               WHERE n.document_id = b.document_id AND n.last_id < b.first_id AND n.first_id > %s) < %s
+          AND (e->>0)::int > %s
+        ORDER BY 1 LIMIT %s
+    ''',
+    'chat_archive_all': '''
+        SELECT (e->>0)::int, (e->>1)::int, e->>2, (e->>3)::timestamp
+        FROM chat_messages_archive b CROSS JOIN LATERAL json_array_elements(b.messages) e
+        WHERE b.document_id = %s
+    ''',
+    'chat_archive_max_id': 'SELECT MAX(last_id) FROM chat_messages_archive',
+    'get_chat_message': '''
+        SELECT cm.id, cm.member_id, m.name, m.avatar, cm.message, cm.created_at
+        FROM chat_messages cm
+        JOIN members m ON cm.member_id = m.id
+        WHERE cm.id = %s
+    ''',
+    'chat_messages_after': '''
+        SELECT cm.id, cm.member_id, m.name, m.avatar, cm.message, cm.created_at
+        FROM chat_messages cm
+        JOIN members m ON cm.member_id = m.id
+        WHERE cm.document_id = %s AND cm.id > %s
+        ORDER BY cm.id
+        LIMIT %s
+    ''',
+    'document_stream_position': '''
+        SELECT GREATEST(d.version, COALESCE((SELECT MAX(version) FROM document_ops WHERE document_id = d.id), 0)),
+               COALESCE((SELECT MAX(id) FROM chat_messages WHERE document_id = d.id), 0)
+        FROM documents d
+        WHERE d.id = %s
+    ''',
+}
+
+
+# Statements over partitioned chat_messages. Planning one costs more than
+# running it, yet auto mode keeps re-planning: runtime partition pruning
+# makes the cached generic plan look expensive. These always use it.
+GENERIC_PLAN = {'chat_messages_since', 'chat_messages_before', 'chat_partition_ids'}
+
+
+def _numbered(sql):
+    # Turn psycopg2's %s placeholders into PREPARE's $1, $2, ...
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: '$%d' % next(counter), sql)
+
+
+def execute(cur, name, params=()):
+    sql = STATEMENTS[name]
+    conn = cur.connection
+    if POOL_MAX == 0:
+        cur.execute(sql, params)
+        return
+    if name not in conn.prepared:
+        cur.execute('PREPARE %s AS %s' % (name, _numbered(sql)))
+        conn.prepared.add(name)
+    # SET LOCAL lasts until the end of the (implicit) transaction
+    prefix = 'SET LOCAL plan_cache_mode = force_generic_plan; ' if name in GENERIC_PLAN else ''
+    if params:
+        cur.execute(prefix + 'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(params))), params)
+    else:
+        cur.execute(prefix + 'EXECUTE %s' % name)
+
+
+_cursor_ids = itertools.count()
+
+
+def stream(sql, params=(), itersize=None):
+    """Yield rows of `sql` through a server-side cursor.
+
+    Only `itersize` rows are held in memory at a time. The connection stays
+    checked out until the generator is exhausted or closed.
+    """
+    with connection() as conn:
+        # Named cursors only live inside a transaction
+        conn.autocommit = False
+        try:
+            with conn.cursor(name='stream_%d_%d' % (os.getpid(), next(_cursor_ids))) as cur:
+                cur.itersize = itersize or STREAM_ITERSIZE
+                cur.execute(sql, params)
+                yield from cur
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
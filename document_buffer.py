@@ -0,0 +1,284 @@
+"""Write-behind buffer for full document saves (PUT /api/documents/<id>).
+
+Autosaving editors replace the whole document every few seconds, and each
+replace would rewrite both large columns of the documents row. In
+write-behind mode a PUT only reserves its version in document_ops (a small
+row) and leaves the new text and code here, in the worker that took it.
+Readers in that worker are served from the buffer. A background thread
+writes a document's latest content to its snapshot once no save has come
+in for `delay` seconds, or `max_delay` seconds after its first unwritten
+save at the latest. When more than `max_bytes` of content is held,
+everything is written at once. flush() writes whatever is left and is
+registered to run at exit.
+
+Other workers find a replace newer than the snapshot and can't know its
+content. They either serve the last written content, or call
+request_flush(), which NOTIFYs the `document_flush` channel and waits for
+the snapshot to catch up. Every worker with a buffer listens on that
+channel once listen() has been called.
+
+A reservation names the process that holds its content (OWNER). A worker
+killed before writing (an OOM kill, gunicorn's SIGKILL on timeout) leaves
+its reservations behind with no one to write them. Readers on the same
+machine can see that the owner is gone (owner_alive()). Any reservation,
+whatever its owner's state, also expires after a timeout. app.py then
+treats the save as lost.
+"""
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+
+import psycopg2
+
+import db
+
+CHANNEL = 'document_flush'
+
+log = logging.getLogger(__name__)
+
+
+def _boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _start_time(pid):
+    # Clock ticks from boot to the process's start (field 22 of its stat
+    # line), or None if there is no such process. The name before it is
+    # parenthesized and may itself contain spaces or parentheses.
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    return stat[stat.rindex(')') + 2:].split()[19]
+
+
+# host/boot id/pid/start time. A restarted container keeps its hostname and
+# the host's boot id, and its workers get the same low pids again; only the
+# start time tells the new process from the one that made a reservation.
+# gunicorn forks workers after import, so the pid is read late.
+_MACHINE = f'{socket.gethostname()}/{_boot_id()}'
+
+
+def owner():
+    """This process, as recorded with the reservations it makes."""
+    pid = os.getpid()
+    return f'{_MACHINE}/{pid}/{_start_time(pid)}'
+
+
+def owner_alive(name):
+    """Whether the process `name` (from owner()) is still running: True or
+    False when it ran on this machine, None when that can't be told."""
+    machine, _, process = (name or '').rpartition('/')
+    machine, _, pid = machine.rpartition('/')
+    if machine != _MACHINE or not pid.isdigit() or process == 'None':
+        return None
+    return _start_time(pid) == process
+
+
+class _Entry:
+    __slots__ = ('project_id', 'document_id', 'text', 'code', 'version', 'updated_at',
+                 'size', 'first_at', 'due')
+
+    def __init__(self, project_id, document_id, text, code, version, updated_at):
+        self.project_id = project_id
+        self.document_id = document_id
+        self.text = text
+        self.code = code
+        self.version = version
+        self.updated_at = updated_at
+        self.size = len(text or '') + len(code or '')
+
+
+class DocumentBuffer:
+    def __init__(self, write, delay, max_delay, max_bytes, name='document-buffer'):
+        # write(entries) stores each entry's content as the snapshot of its
+        # document, in one transaction, skipping snapshots already newer
+        self.write = write
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.name = name
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self._entries = {}
+        self._bytes = 0
+        self._cond = threading.Condition()
+        # One write at a time, so an older copy never lands after a newer one
+        self._write_lock = threading.Lock()
+        self._pid = None
+        self._listening = False
+
+    def put(self, project_id, document_id, text, code, version, updated_at):
+        """Hold a saved version until it is written. Older versions than the
+        one already held are ignored."""
+        entry = _Entry(project_id, document_id, text, code, version, updated_at)
+        now = time.monotonic()
+        self._start()
+        with self._cond:
+            held = self._entries.get(project_id)
+            if held is not None and held.version >= version:
+                return
+            entry.first_at = held.first_at if held is not None else now
+            entry.due = min(now + self.delay, entry.first_at + self.max_delay)
+            self._entries[project_id] = entry
+            self._bytes += entry.size - (held.size if held is not None else 0)
+            self._cond.notify()
+
+    def get(self, project_id):
+        """The held version as (document_id, state), or None."""
+        with self._cond:
+            entry = self._entries.get(project_id)
+        if entry is None:
+            return None
+        return entry.document_id, {
+            'text': entry.text,
+            'code': entry.code,
+            'version': entry.version,
+            'updatedAt': entry.updated_at
+        }
+
+    def expedite(self, document_id):
+        # Write this document on the next pass instead of waiting for its delay
+        with self._cond:
+            for entry in self._entries.values():
+                if entry.document_id == document_id:
+                    entry.due = 0
+                    self._cond.notify()
+
+    def flush(self):
+        """Write everything held, on the calling thread."""
+        with self._cond:
+            entries = list(self._entries.values())
+        if entries:
+            self._write(entries)
+
+    def listen(self):
+        # Answer request_flush() from other workers; see _listen
+        self._listening = True
+        self._start()
+
+    def stats(self):
+        with self._cond:
+            documents, size = len(self._entries), self._bytes
+        return {
+            'documents': documents,
+            'bytes': size,
+            'flushes': self.flushes,
+            'written': self.written,
+            'failures': self.failures,
+            'delay': self.delay,
+            'maxDelay': self.max_delay,
+            'maxBytes': self.max_bytes,
+        }
+
+    def _start(self):
+        # Threads don't survive gunicorn's fork; start them once per process
+        if self._pid != os.getpid():
+            with self._cond:
+                if self._pid != os.getpid():
+                    threading.Thread(target=self._run, name=self.name, daemon=True).start()
+                    if self._listening:
+                        threading.Thread(target=self._listen, name=self.name + '-listener', daemon=True).start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._bytes > self.max_bytes:
+                        due = list(self._entries.values())
+                    else:
+                        due = [entry for entry in self._entries.values() if entry.due <= now]
+                    if due:
+                        break
+                    next_due = min((entry.due for entry in self._entries.values()), default=None)
+                    self._cond.wait(None if next_due is None else next_due - now)
+            try:
+                self._write(due)
+            except Exception:
+                log.exception('writing %d buffered document(s) failed; retrying', len(due))
+                with self._cond:
+                    retry_at = time.monotonic() + max(self.delay, 1)
+                    for entry in due:
+                        if self._entries.get(entry.project_id) is entry:
+                            entry.due = retry_at
+
+    def _write(self, entries):
+        with self._write_lock:
+            try:
+                self.write(entries)
+            except Exception:
+                self.failures += 1
+                raise
+            with self._cond:
+                for entry in entries:
+                    # A newer save that came in meanwhile stays held
+                    if self._entries.get(entry.project_id) is entry:
+                        del self._entries[entry.project_id]
+                        self._bytes -= entry.size
+                self.flushes += 1
+                self.written += len(entries)
+
+    def _listen(self):
+        delay = 1
+        while True:
+            try:
+                conn = db.connect()
+            except psycopg2.Error:
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            selector = selectors.DefaultSelector()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('LISTEN ' + CHANNEL)
+                selector.register(conn, selectors.EVENT_READ)
+                delay = 1
+                # Requests sent while we weren't listening are lost; write
+                # everything rather than leave a reader waiting
+                with self._cond:
+                    for entry in self._entries.values():
+                        entry.due = 0
+                    self._cond.notify()
+                while True:
+                    if not selector.select(timeout=30):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        if payload.isdigit():
+                            self.expedite(int(payload))
+            except (psycopg2.Error, OSError):
+                time.sleep(delay)
+            finally:
+                selector.close()
+                conn.close()
+
+
+def request_flush(cur, document_id, version, timeout):
+    """Ask the worker holding `document_id` to write it, and wait up to
+    `timeout` seconds for the snapshot to reach `version`. Returns whether
+    it did. `cur` must be in autocommit mode."""
+    cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, str(document_id)))
+    deadline = time.monotonic() + timeout
+    pause = 0.005
+    while True:
+        db.execute(cur, 'document_snapshot_version', (document_id,))
+        row = cur.fetchone()
+        if row is None or row[0] >= version:
+            return row is not None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(pause, remaining))
+        pause = min(pause * 2, 0.1)
@@ -0,0 +1,133 @@
+"""Coalesce concurrent single-row writes into one transaction.
+
+Request threads call GroupCommitWriter.submit(row) and block. A background
+thread per worker process drains the queue and hands each batch to
+`flush(rows)`, which writes and commits them together and returns one
+result per row, in order. submit() returns only after that commit, so a
+response never goes out ahead of its data being durable.
+
+Batching is adaptive. When the previous batch held a single row, the queue
+is flushed right away so a lone writer doesn't pay the window. Under
+concurrency the writer waits up to `window` seconds, or until `max_rows`
+rows are queued, to fill the batch. With `max_rows` of 1 there is nothing
+to coalesce, and submit() calls flush() directly on the calling thread.
+
+A batch that flush() fails as a whole is retried one row at a time, so a
+single bad row fails only its own submit().
+"""
+import os
+import queue
+import threading
+import time
+
+
+class RowError(Exception):
+    # Returned by flush() in place of a result to fail just that row
+    pass
+
+
+class _Pending:
+    __slots__ = ('row', 'done', 'result', 'error')
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    def __init__(self, flush, window, max_rows, name='group-commit'):
+        self.flush = flush
+        self.window = window
+        self.max_rows = max(1, max_rows)
+        self.name = name
+        self.batches = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def submit(self, row):
+        """Write `row` and return flush()'s result for it.
+
+        Raises the RowError flush() returned for this row, or whatever
+        exception failed writing the row on its own.
+        """
+        pending = _Pending(row)
+        if self.max_rows == 1:
+            self._write([pending])
+        else:
+            self._get_queue().put(pending)
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'rows': self.rows,
+            'window': self.window,
+            'maxRows': self.max_rows,
+        }
+
+    def _get_queue(self):
+        # The writer thread doesn't survive gunicorn's fork; start one per process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.SimpleQueue()
+                    threading.Thread(target=self._run, args=(self._queue,), name=self.name, daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, pending_queue):
+        last_size = 1
+        while True:
+            batch = [pending_queue.get()]
+            if last_size > 1 and self.window > 0:
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(pending_queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            # Take whatever else is already waiting
+            while len(batch) < self.max_rows:
+                try:
+                    batch.append(pending_queue.get_nowait())
+                except queue.Empty:
+                    break
+            last_size = len(batch)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self._settle(batch, self.flush([pending.row for pending in batch]))
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].error = error
+            else:
+                for pending in batch:
+                    try:
+                        self._settle([pending], self.flush([pending.row]))
+                    except Exception as row_error:
+                        pending.error = row_error
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.rows += len(batch)
+            for pending in batch:
+                pending.done.set()
+
+    @staticmethod
+    def _settle(batch, results):
+        for pending, result in zip(batch, results):
+            if isinstance(result, RowError):
+                pending.error = result
+            else:
+                pending.result = result
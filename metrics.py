@@ -0,0 +1,182 @@
+"""In-process request metrics, exposed in Prometheus text format.
+
+Each request gets a RequestStats (held in a context variable, so it follows
+the worker thread handling the request). The cursor wrapper in db.py, the
+pool and the JSON provider add to it; when the request ends it is folded
+into per-endpoint histograms under one lock. Numbers are per worker
+process.
+"""
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Requests slower than this many milliseconds are logged with their SQL; 0 = off
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))
+# Statements kept per request for the slow log
+SLOW_LOG_MAX_QUERIES = 50
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        prefix = labels + ',' if labels else ''
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '%s_bucket{%sle="%s"} %d' % (name, prefix, _format(bound), cumulative)
+        yield '%s_bucket{%sle="+Inf"} %d' % (name, prefix, self.count)
+        yield '%s_sum%s %s' % (name, _braces(labels), _format(self.sum))
+        yield '%s_count%s %d' % (name, _braces(labels), self.count)
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'db_seconds', 'pool_wait_seconds',
+                 'serialize_seconds', 'queries', 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.serialize_seconds = 0.0
+        # (sql, seconds), only collected when the slow log is on
+        self.queries = [] if SLOW_REQUEST_MS else None
+        self.status = 500
+
+    def record_query(self, sql, seconds):
+        self.statements += 1
+        self.db_seconds += seconds
+        if self.queries is not None and len(self.queries) < SLOW_LOG_MAX_QUERIES:
+            if isinstance(sql, bytes):
+                sql = sql.decode('utf-8', 'replace')
+            self.queries.append((str(sql)[:500], seconds))
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.serialize_seconds = 0.0
+        self.responses = defaultdict(int)
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+_lock = threading.Lock()
+_endpoints = defaultdict(EndpointMetrics)
+_pool_wait = Histogram(LATENCY_BUCKETS)
+
+
+def current():
+    return _current.get()
+
+
+def start_request():
+    # Returns a token for finish_request()
+    return _current.set(RequestStats())
+
+
+def record_pool_wait(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+def record_serialize(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.serialize_seconds += seconds
+
+
+def finish_request(token, method, endpoint):
+    """Fold the current request into the endpoint's metrics.
+
+    Returns (stats, duration in seconds).
+    """
+    stats = _current.get()
+    _current.reset(token)
+    duration = time.perf_counter() - stats.started
+    with _lock:
+        metrics = _endpoints[(method, endpoint)]
+        metrics.latency.observe(duration)
+        metrics.db_time.observe(stats.db_seconds)
+        metrics.statements.observe(stats.statements)
+        metrics.serialize_seconds += stats.serialize_seconds
+        metrics.responses[stats.status] += 1
+        _pool_wait.observe(stats.pool_wait_seconds)
+    return stats, duration
+
+
+def render(gauges=()):
+    """Prometheus text exposition of every endpoint plus `gauges`.
+
+    gauges: (name, help, type, value) or (name, help, type, {labels: value})
+    tuples, for numbers owned by other modules (pool, caches).
+    """
+    lines = []
+
+    def header(name, help_text, kind):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+    with _lock:
+        endpoints = sorted(_endpoints.items())
+        header('http_request_duration_seconds', 'Time from routing to the response being returned.', 'histogram')
+        for (method, endpoint), m in endpoints:
+            lines.extend(m.latency.lines('http_request_duration_seconds', _labels(method, endpoint)))
+        header('http_requests_total', 'Requests by endpoint and status code.', 'counter')
+        for (method, endpoint), m in endpoints:
+            for status, count in sorted(m.responses.items()):
+                lines.append('http_requests_total{%s,status="%d"} %d' % (_labels(method, endpoint), status, count))
+        header('db_statements_per_request', 'SQL statements executed per request.', 'histogram')
+        for (method, endpoint), m in endpoints:
+            lines.extend(m.statements.lines('db_statements_per_request', _labels(method, endpoint)))
+        header('db_time_per_request_seconds', 'Time spent executing SQL per request.', 'histogram')
+        for (method, endpoint), m in endpoints:
+            lines.extend(m.db_time.lines('db_time_per_request_seconds', _labels(method, endpoint)))
+        header('response_serialize_seconds_total', 'Time spent encoding JSON responses.', 'counter')
+        for (method, endpoint), m in endpoints:
+            lines.append('response_serialize_seconds_total{%s} %s' % (
+                _labels(method, endpoint), _format(m.serialize_seconds)))
+        header('db_pool_wait_seconds', 'Time per request spent acquiring database connections.', 'histogram')
+        lines.extend(_pool_wait.lines('db_pool_wait_seconds', ''))
+
+    for name, help_text, kind, value in gauges:
+        header(name, help_text, kind)
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                lines.append('%s{%s} %s' % (name, labels, _format(v)))
+        else:
+            lines.append('%s %s' % (name, _format(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(method, endpoint):
+    return 'method="%s",endpoint="%s"' % (method, endpoint)
+
+
+def _braces(labels):
+    return '{%s}' % labels if labels else ''
+
+
+def _format(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
@@ -0,0 +1,311 @@
+"""Versioned schema migrations.
+
+MIGRATIONS run in version order, each in its own transaction, and each
+applied version is recorded in `schema_version`. `flask --app app migrate`
+applies whatever is missing. Concurrent runs take a Postgres advisory lock
+first, so exactly one process migrates and the others find the work done.
+Workers never change the schema themselves; they compare the recorded
+version with LATEST once, on their first request (see app.py).
+
+Migrations are append-only: once released, a migration's SQL is never
+edited. A schema change, including a new version of the trigger SQL in
+realtime.py or task_stats.py, gets a new migration.
+"""
+import chat_partitions
+import realtime
+import task_stats
+
+# Shared by every process migrating this database
+LOCK_KEY = 7305416
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(apply):
+        MIGRATIONS.append((version, description, apply))
+        return apply
+    return register
+
+
+def current_version(cur):
+    cur.execute("SELECT to_regclass('schema_version')")
+    if cur.fetchone()[0] is None:
+        return 0
+    cur.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cur.fetchone()[0]
+
+
+def migrate(conn, log=print, target=None):
+    """Apply the pending migrations up to `target` (default: all); returns
+    the resulting version.
+
+    `conn` must be in autocommit mode, and is again afterwards.
+    """
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+        try:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            applied = current_version(cur)
+            for version, description, apply in MIGRATIONS:
+                if version <= applied or (target is not None and version > target):
+                    continue
+                conn.autocommit = False
+                try:
+                    with conn:
+                        apply(cur)
+                        cur.execute(
+                            'INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                            (version, description)
+                        )
+                finally:
+                    conn.autocommit = True
+                log(f'Applied migration {version}: {description}')
+                applied = version
+            return applied
+        finally:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+
+
+# Databases set up before versioning already have most of this; every
+# statement is idempotent so they end up at version 1 as well.
+@migration(1, 'Initial schema')
+def initial_schema(cur):
+    # Projects table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Members table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS members (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            avatar TEXT
+        )
+    ''')
+    
+    # Tasks table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            description TEXT,
+            status VARCHAR(50) NOT NULL,
+            assignee_id INTEGER REFERENCES members(id),
+            due_date DATE,
+            priority VARCHAR(50) NOT NULL,
+            project_id INTEGER REFERENCES projects(id)
+        )
+    ''')
+    
+    # Documents table for collaborative editor content
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            project_id INTEGER REFERENCES projects(id),
+            text TEXT,
+            code TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Snapshot version; edits after it live in document_ops until compaction
+    cur.execute('ALTER TABLE documents ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0')
+    # Content hashes let a save leave unchanged fields out of the UPDATE
+    cur.execute('ALTER TABLE documents ADD COLUMN IF NOT EXISTS text_hash TEXT GENERATED ALWAYS AS (md5(text)) STORED')
+    cur.execute('ALTER TABLE documents ADD COLUMN IF NOT EXISTS code_hash TEXT GENERATED ALWAYS AS (md5(code)) STORED')
+    
+    # Operation log for delta document updates (PATCH /api/documents/<id>)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS document_ops (
+            document_id INTEGER NOT NULL REFERENCES documents(id),
+            version INTEGER NOT NULL,
+            ops JSONB NOT NULL,
+            client_id VARCHAR(64),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (document_id, version)
+        )
+    ''')
+    
+    # Add chat_messages table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id SERIAL PRIMARY KEY,
+            document_id INTEGER REFERENCES documents(id),
+            member_id INTEGER REFERENCES members(id),
+            message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Indexes backing the filtered, keyset-paginated task listing
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_project_status_due_idx ON tasks (project_id, status, due_date, id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_project_due_idx ON tasks (project_id, due_date, id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_project_priority_idx ON tasks (project_id, priority, id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_project_title_idx ON tasks (project_id, title, id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_project_assignee_idx ON tasks (project_id, assignee_id, id)')
+    
+    # Bumped by a trigger on every members write; backs the members ETag
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name VARCHAR(63) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    ''')
+    cur.execute('''
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cur.execute('DROP TRIGGER IF EXISTS members_version ON members')
+    cur.execute('''
+        CREATE TRIGGER members_version AFTER INSERT OR UPDATE OR DELETE ON members
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()
+    ''')
+    
+    # Chat history is always read per document in id order
+    cur.execute('CREATE INDEX IF NOT EXISTS chat_messages_document_id_idx ON chat_messages (document_id, id)')
+    
+    # Full-text search (/api/search): weighted tsvectors kept by Postgres
+    cur.execute('''
+        ALTER TABLE tasks ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED
+    ''')
+    # A tsvector is capped at 1 MB, so documents index a prefix of each field.
+    # Columns from before that cap are rebuilt.
+    cur.execute('''
+        SELECT pg_get_expr(d.adbin, d.adrelid) FROM pg_attrdef d
+        JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+        WHERE d.adrelid = 'documents'::regclass AND a.attname = 'search'
+    ''')
+    expression = cur.fetchone()
+    if expression and 'left(' not in expression[0]:
+        cur.execute('ALTER TABLE documents DROP COLUMN search')
+    cur.execute('''
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', left(coalesce(text, ''), 150000)), 'A') ||
+            setweight(to_tsvector('english', left(coalesce(code, ''), 50000)), 'B')
+        ) STORED
+    ''')
+    cur.execute('''
+        ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+            to_tsvector('english', message)
+        ) STORED
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_search_idx ON tasks USING GIN (search)')
+    cur.execute('CREATE INDEX IF NOT EXISTS documents_search_idx ON documents USING GIN (search)')
+    cur.execute('CREATE INDEX IF NOT EXISTS chat_messages_search_idx ON chat_messages USING GIN (search)')
+    
+    # NOTIFY triggers feeding the /api/stream SSE endpoint
+    cur.execute(realtime.TRIGGERS_SQL)
+    
+    # Per-project task counts behind /api/projects/<id>/task-stats
+    cur.execute("SELECT to_regclass('task_counters')")
+    counters_exist = cur.fetchone()[0] is not None
+    cur.execute(task_stats.TABLE_SQL)
+    cur.execute(task_stats.TRIGGERS_SQL)
+    if not counters_exist:
+        # Backfill tasks written before the triggers existed
+        task_stats.rebuild(cur)
+
+
+# Lookups that had no index of their own. tasks.project_id and
+# chat_messages.document_id already lead composite indexes above.
+@migration(2, 'Index tasks.assignee_id and documents.project_id')
+def lookup_indexes(cur):
+    # Assignee filters across projects, and the FK check when a member is deleted
+    cur.execute('CREATE INDEX IF NOT EXISTS tasks_assignee_id_idx ON tasks (assignee_id)')
+    # Every document read and write finds the document by its project
+    cur.execute('CREATE INDEX IF NOT EXISTS documents_project_id_idx ON documents (project_id)')
+
+
+# Monthly partitions, so old history can be archived a month at a time (see
+# chat_partitions.py). Existing messages are copied into the new table.
+@migration(3, 'Partition chat_messages by month, add chat_messages_archive')
+def partition_chat_messages(cur):
+    cur.execute('ALTER SEQUENCE chat_messages_id_seq OWNED BY NONE')
+    cur.execute('ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned')
+    # The primary key has to include the partition key. Indexes and foreign
+    # keys are added after the copy, which is much faster than per row.
+    cur.execute('''
+        CREATE TABLE chat_messages (
+            id INTEGER NOT NULL DEFAULT nextval('chat_messages_id_seq'),
+            document_id INTEGER,
+            member_id INTEGER,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            search tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED
+        ) PARTITION BY RANGE (created_at)
+    ''')
+    cur.execute('ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id')
+    cur.execute('SELECT COALESCE(MIN(created_at), localtimestamp), localtimestamp FROM chat_messages_unpartitioned')
+    first, now = cur.fetchone()
+    chat_partitions.create_partitions(cur, first, chat_partitions.add_months(now, chat_partitions.MONTHS_AHEAD))
+    cur.execute('''
+        INSERT INTO chat_messages (id, document_id, member_id, message, created_at)
+        SELECT id, document_id, member_id, message, COALESCE(created_at, localtimestamp)
+        FROM chat_messages_unpartitioned
+    ''')
+    cur.execute('DROP TABLE chat_messages_unpartitioned')
+    cur.execute('ALTER TABLE chat_messages ADD PRIMARY KEY (id, created_at)')
+    cur.execute('ALTER TABLE chat_messages ADD FOREIGN KEY (document_id) REFERENCES documents(id)')
+    cur.execute('ALTER TABLE chat_messages ADD FOREIGN KEY (member_id) REFERENCES members(id)')
+    cur.execute('CREATE INDEX chat_messages_document_id_idx ON chat_messages (document_id, id)')
+    cur.execute('CREATE INDEX chat_messages_search_idx ON chat_messages USING GIN (search)')
+    cur.execute('''
+        CREATE TRIGGER chat_messages_notify AFTER INSERT ON chat_messages
+            FOR EACH ROW EXECUTE FUNCTION notify_chat_message()
+    ''')
+    
+    # Each row holds up to chat_partitions.ARCHIVE_BATCH messages of one
+    # document from one archived month, as a JSON array of [id, member_id,
+    # message, created_at] in id order. The low toast_tuple_target gets even
+    # short batches compressed.
+    cur.execute('''
+        CREATE TABLE chat_messages_archive (
+            document_id INTEGER,
+            month DATE NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            messages JSON NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITH (toast_tuple_target = 128)
+    ''')
+    cur.execute('CREATE INDEX chat_messages_archive_document_idx ON chat_messages_archive (document_id, last_id)')
+    cur.execute('CREATE INDEX chat_messages_archive_last_id_idx ON chat_messages_archive (last_id)')
+
+
+
+# GET /api/tasks?sort=priority orders by a rank expression, which an index on
+# the plain column can't serve. The expression must match app.PRIORITY_RANK.
+@migration(4, 'Index tasks by priority rank')
+def priority_rank_index(cur):
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS tasks_project_priority_rank_idx ON tasks (project_id,
+            (CASE priority WHEN 'High' THEN 1 WHEN 'Medium' THEN 2 WHEN 'Low' THEN 3 ELSE 4 END), id)
+    ''')
+
+
+LATEST = MIGRATIONS[-1][0]
@@ -0,0 +1,236 @@
+"""Fan-out of Postgres NOTIFY events to Server-Sent Events subscribers.
+
+Triggers on chat_messages, documents and document_ops NOTIFY the
+`document_events` channel. Each worker process keeps one dedicated LISTEN
+connection and a background thread that hands every event to the
+in-memory queues of the subscribers watching that document, so idle
+subscribers cost a queue each, not a database connection.
+"""
+import json
+import logging
+import os
+import queue
+import selectors
+import threading
+import time
+from collections import defaultdict
+
+
+import db
+
+CHANNEL = 'document_events'
+# Events buffered per subscriber before it is told to resync from the database
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+
+# Sentinel queued when a subscriber may have missed events (queue overflow
+# or a dropped LISTEN connection); the stream then catches up from the database.
+RESYNC = object()
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, broker, document_id):
+        self.broker = broker
+        self.document_id = document_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait(RESYNC)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    def __init__(self, load_message):
+        # load_message(id) -> message dict or None, for oversized payloads
+        self.load_message = load_message
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, document_id):
+        subscription = Subscription(self, document_id)
+        with self._lock:
+            self._subscribers[document_id].add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='pg-listener', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.document_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.document_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, document_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(document_id, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def _publish_all(self, event):
+        with self._lock:
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def _listen(self):
+        delay = 1
+        connected_before = False
+        while True:
+            try:
+                conn = db.connect()
+            except Exception:
+                log.warning('LISTEN connection failed; retrying in %ss', delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            # select.select() can't watch fds above 1024, which a worker
+            # holding thousands of SSE sockets easily reaches
+            selector = selectors.DefaultSelector()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('LISTEN ' + CHANNEL)
+                selector.register(conn, selectors.EVENT_READ)
+                delay = 1
+                if connected_before:
+                    # Anything sent while we were disconnected is lost
+                    self._publish_all(RESYNC)
+                connected_before = True
+                while True:
+                    if not selector.select(timeout=30):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        try:
+                            self._dispatch(payload)
+                        except Exception:
+                            log.exception('dispatching %.200s failed', payload)
+                            self._publish_all(RESYNC)
+            except Exception:
+                # Whatever went wrong, this thread must live on: nothing
+                # restarts it, and every stream in the worker depends on it
+                log.warning('LISTEN connection lost; reconnecting', exc_info=True)
+                time.sleep(delay)
+            finally:
+                selector.close()
+                conn.close()
+
+    def _dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+            document_id = event.pop('document_id')
+        except (ValueError, KeyError):
+            return
+        if event.get('type') == 'message' and event.pop('truncated', False):
+            # Too big for a NOTIFY payload: load it once for every subscriber
+            try:
+                event['data'] = self.load_message(event['data']['id'])
+            except Exception:
+                # Pool timeout, database error...: the stream catches up
+                # from the database instead of missing the message
+                log.exception('loading truncated message %s failed', event['data'].get('id'))
+                self.publish(document_id, RESYNC)
+                return
+            if event['data'] is None:
+                return
+        self.publish(document_id, event)
+
+
+_broker = None
+_broker_pid = None
+_broker_lock = threading.Lock()
+
+
+def get_broker(load_message):
+    global _broker, _broker_pid
+    if _broker is None or _broker_pid != os.getpid():
+        with _broker_lock:
+            if _broker is None or _broker_pid != os.getpid():
+                _broker = Broker(load_message)
+                _broker_pid = os.getpid()
+    return _broker
+
+
+# Installed by migrations.py. Payloads stay under NOTIFY's 8000 byte limit;
+# long chat messages are sent as {"truncated": true} and loaded by the listener.
+TRIGGERS_SQL = '''
+CREATE OR REPLACE FUNCTION notify_chat_message() RETURNS trigger AS $$
+DECLARE
+    sender members%ROWTYPE;
+    payload TEXT;
+BEGIN
+    SELECT * INTO sender FROM members WHERE id = NEW.member_id;
+    payload := json_build_object(
+        'document_id', NEW.document_id,
+        'type', 'message',
+        'data', json_build_object(
+            'id', NEW.id,
+            'member_id', NEW.member_id,
+            'sender_name', sender.name,
+            'sender_avatar', sender.avatar,
+            'message', NEW.message,
+            'created_at', to_char(NEW.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+        )
+    )::text;
+    IF octet_length(payload) > 7500 THEN
+        payload := json_build_object(
+            'document_id', NEW.document_id, 'type', 'message', 'truncated', true,
+            'data', json_build_object('id', NEW.id)
+        )::text;
+    END IF;
+    PERFORM pg_notify('document_events', payload);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_document_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'documents' THEN
+        PERFORM pg_notify('document_events', json_build_object(
+            'document_id', NEW.id, 'type', 'document',
+            'data', json_build_object('id', NEW.id, 'version', NEW.version)
+        )::text);
+    ELSE
+        PERFORM pg_notify('document_events', json_build_object(
+            'document_id', NEW.document_id, 'type', 'document',
+            'data', json_build_object('id', NEW.document_id, 'version', NEW.version)
+        )::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chat_messages_notify ON chat_messages;
+CREATE TRIGGER chat_messages_notify AFTER INSERT ON chat_messages
+    FOR EACH ROW EXECUTE FUNCTION notify_chat_message();
+
+DROP TRIGGER IF EXISTS documents_notify ON documents;
+CREATE TRIGGER documents_notify AFTER UPDATE ON documents
+    FOR EACH ROW EXECUTE FUNCTION notify_document_version();
+
+DROP TRIGGER IF EXISTS document_ops_notify ON document_ops;
+CREATE TRIGGER document_ops_notify AFTER INSERT ON document_ops
+    FOR EACH ROW EXECUTE FUNCTION notify_document_version();
+'''
@@ -17,6 +17,14 @@ export const fetchProject = async (projectId = 1) => {
   return response.data;
 };
 
+// Project, members, first page of tasks and document in one request.
+// include: optional array of sections to return, e.g. ['tasks', 'document']
+export const fetchDashboard = async (projectId = 1, include) => {
+  const params = include ? { include: include.join(',') } : {};
+  const response = await api.get(`/projects/${projectId}/dashboard`, { params });
+  return response.data;
+};
+
 export const updateProject = async (projectId, projectData) => {
   const response = await api.put(`/projects/${projectId}`, projectData);
   return response.data;
@@ -39,11 +47,36 @@ export const removeMember = async (memberId) => {
 };
 
 // Tasks API
-export const fetchTasks = async () => {
-  const response = await api.get('/tasks');
+// params: project_id, status, priority, assignee, sort, after, limit, all
+export const fetchTasks = async (params = {}) => {
+  const response = await api.get('/tasks', { params });
+  return response.data;
+};
+
+// Counts by status, priority and assignee, plus overdue, without loading tasks
+export const fetchTaskStats = async (projectId = 1) => {
+  const response = await api.get(`/projects/${projectId}/task-stats`);
   return response.data;
 };
 
+// Same as fetchTasks, plus the cursor for the next page (null on the last page)
+export const fetchTasksPage = async (params = {}) => {
+  const response = await api.get('/tasks', { params });
+  return {
+    tasks: response.data,
+    nextCursor: response.headers['x-next-cursor'] || null,
+  };
+};
+
+// Full-text search; params: q, types, project_id, limit, after
+export const searchAll = async (params = {}) => {
+  const response = await api.get('/search', { params });
+  return {
+    hits: response.data,
+    nextCursor: response.headers['x-next-cursor'] || null,
+  };
+};
+
 export const addTask = async (taskData) => {
   const response = await api.post('/tasks', taskData);
   return response.data;
@@ -65,4 +98,79 @@ export const updateDocument = async (projectId, documentData) => {
   return response.data;
 };
 
+// Ops turning `before` into `after` for one field: a single delete/insert
+// around the changed region (offsets are JS string indices)
+export const diffDocumentField = (field, before = '', after = '') => {
+  let start = 0;
+  while (start < before.length && start < after.length && before[start] === after[start]) {
+    start++;
+  }
+  let end = 0;
+  while (
+    end < before.length - start &&
+    end < after.length - start &&
+    before[before.length - 1 - end] === after[after.length - 1 - end]
+  ) {
+    end++;
+  }
+  const ops = [];
+  if (before.length - start - end > 0) {
+    ops.push({ op: 'delete', field, offset: start, length: before.length - start - end });
+  }
+  if (after.length - start - end > 0) {
+    ops.push({ op: 'insert', field, offset: start, text: after.slice(start, after.length - end) });
+  }
+  return ops;
+};
+
+// Three-way merge of one field: the local edit and the server's changes,
+// both made to `base`, each taken as its single changed region. Returns
+// the server text with the local edit applied, or null when the two
+// regions overlap.
+export const mergeDocumentField = (base = '', local = '', server = '') => {
+  const region = (after) => {
+    const ops = diffDocumentField('', base, after);
+    if (!ops.length) return null;
+    const start = ops[0].offset;
+    const removed = ops.find((op) => op.op === 'delete')?.length || 0;
+    const inserted = ops.find((op) => op.op === 'insert')?.text || '';
+    return { start, end: start + removed, inserted };
+  };
+  const mine = region(local);
+  const theirs = region(server);
+  if (!mine) return server;
+  if (!theirs) return local;
+  let shift;
+  if (mine.end <= theirs.start) {
+    shift = 0;
+  } else if (mine.start >= theirs.end) {
+    shift = theirs.inserted.length - (theirs.end - theirs.start);
+  } else {
+    return null;
+  }
+  return server.slice(0, mine.start + shift) + mine.inserted + server.slice(mine.end + shift);
+};
+
+// Sends only the edits made since `baseVersion`; the server rebases them
+// over concurrent edits and answers 409 if it cannot.
+export const patchDocument = async (projectId, baseVersion, ops) => {
+  const response = await api.patch(`/documents/${projectId}`, { baseVersion, ops });
+  return response.data;
+};
+
+// Realtime API
+// Calls onMessage(chatMessage) / onDocument({ id, version }) as changes are
+// committed. EventSource reconnects on its own and resumes via Last-Event-ID.
+// Returns a function that closes the stream.
+export const subscribeToDocument = (documentId, { onMessage, onDocument } = {}) => {
+  const source = new EventSource(`${API_URL}/stream/${documentId}`);
+  if (onMessage) {
+    source.addEventListener('message', (e) => onMessage(JSON.parse(e.data)));
+  }
+  if (onDocument) {
+    source.addEventListener('document', (e) => onDocument(JSON.parse(e.data)));
+  }
+  return () => source.close();
+};
+
 export default api;
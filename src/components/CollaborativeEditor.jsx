@@ -1,20 +1,91 @@
 
-import React, { useState } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { Button } from "@/components/ui/button";
 import { Textarea } from "@/components/ui/textarea";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Save } from "lucide-react";
+import { toast } from "sonner";
+import { diffDocumentField, mergeDocumentField } from "../api";
 
-const CollaborativeEditor = ({ initialContent, onSave }) => {
+const FIELDS = ["text", "code"];
+
+// onSave({ baseVersion, ops, content }) resolves to the saved document, or to
+// the PATCH result (plus the merged text/code when others edited meanwhile).
+// onReload() resolves to the current document, used after a 409.
+const CollaborativeEditor = ({ initialContent, onSave, onReload }) => {
   const [textContent, setTextContent] = useState(initialContent?.text || "");
   const [codeContent, setCodeContent] = useState(initialContent?.code || "");
   const [activeTab, setActiveTab] = useState("text");
+  const [saving, setSaving] = useState(false);
+  // Set synchronously, so a second click can't start a save before re-render
+  const inFlight = useRef(false);
+  // What the server has at `version`; every save is the diff against this
+  const synced = useRef({
+    text: initialContent?.text || "",
+    code: initialContent?.code || "",
+    version: initialContent?.version,
+  });
+  // Read after awaiting a save, when the render-time values are stale
+  const current = useRef({ text: textContent, code: codeContent });
+  current.current = { text: textContent, code: codeContent };
+
+  const isDirty = () => FIELDS.some((name) => current.current[name] !== synced.current[name]);
+
+  // Take a refetched document only when it can't overwrite local edits
+  useEffect(() => {
+    if (!initialContent || saving || isDirty()) return;
+    if (initialContent.version === synced.current.version) return;
+    synced.current = {
+      text: initialContent.text || "",
+      code: initialContent.code || "",
+      version: initialContent.version,
+    };
+    setTextContent(synced.current.text);
+    setCodeContent(synced.current.code);
+  }, [initialContent, saving]);
+
+  // The server moved from `base` to `server`; keep whatever was typed since
+  const rebase = (base, server) => {
+    const merged = {};
+    let conflict = false;
+    for (const name of FIELDS) {
+      const value = mergeDocumentField(base[name], current.current[name], server[name] || "");
+      conflict = conflict || value === null;
+      merged[name] = value === null ? current.current[name] : value;
+    }
+    synced.current = { text: server.text || "", code: server.code || "", version: server.version };
+    setTextContent(merged.text);
+    setCodeContent(merged.code);
+    if (conflict) {
+      toast.warning("Someone else edited the same lines; saving again will replace their changes");
+    }
+  };
 
-  const handleSave = () => {
-    onSave({
-      text: textContent,
-      code: codeContent,
-    });
+  const handleSave = async () => {
+    if (inFlight.current) return;
+    const content = current.current;
+    const base = synced.current;
+    const ops = FIELDS.flatMap((name) => diffDocumentField(name, base[name], content[name]));
+    if (base.version !== undefined && !ops.length) return;
+    inFlight.current = true;
+    setSaving(true);
+    try {
+      const result = await onSave({ baseVersion: base.version, ops, content });
+      if (result.text !== undefined) {
+        rebase(content, result);
+      } else {
+        synced.current = { ...content, version: result.version };
+      }
+    } catch (error) {
+      if (error.response?.status === 409 && onReload) {
+        // Rebasing failed on the server; merge against the latest copy here
+        const latest = await onReload().catch(() => null);
+        if (latest) rebase(base, latest);
+      }
+    } finally {
+      inFlight.current = false;
+      setSaving(false);
+    }
   };
 
   const getCurrentTimestamp = () => {
@@ -29,9 +100,9 @@ const CollaborativeEditor = ({ initialContent, onSave }) => {
           <span className="text-sm text-gray-500">
             Last edited: {getCurrentTimestamp()}
           </span>
-          <Button onClick={handleSave}>
+          <Button onClick={handleSave} disabled={saving}>
             <Save className="h-4 w-4 mr-1" />
-            Save
+            {saving ? "Saving..." : "Save"}
           </Button>
         </div>
       </div>
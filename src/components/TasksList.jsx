@@ -1,4 +1,4 @@
-import React, { useState, useMemo, useRef } from "react";
+import React, { useState, useRef } from "react";
 import { Button } from "@/components/ui/button";
 import {
   Card,
@@ -56,7 +56,15 @@ const getStatusColor = (status) => {
 
 const TasksList = ({ 
   tasks, 
+  stats,
   members, 
+  filterBy = "all",
+  sortBy = "dueDate",
+  onFilterChange,
+  onSortChange,
+  hasMore = false,
+  loadingMore = false,
+  onLoadMore,
   onAddTask, 
   onUpdateTaskStatus, 
   currentUser = {}, 
@@ -74,8 +82,6 @@ const TasksList = ({
     htmlFile: null, // Add this line
     htmlFileName: ""  // Add this line
   });
-  const [filterBy, setFilterBy] = useState("all");
-  const [sortBy, setSortBy] = useState("dueDate");
 
   const fileInputRef = useRef(null);
 
@@ -242,50 +248,18 @@ const TasksList = ({
     );
   };
 
-  const filteredTasks = useMemo(() => {
-    let result = [...tasks];
-    
-    // Apply filters
-    if (filterBy !== "all") {
-      if (filterBy === "completed") {
-        result = result.filter(task => task.status === "Completed");
-      } else if (filterBy === "inprogress") {
-        result = result.filter(task => task.status === "In Progress");
-      } else if (filterBy === "todo") {
-        result = result.filter(task => task.status === "Todo");
-      } else if (filterBy === "high") {
-        result = result.filter(task => task.priority === "High");
-      }
-    }
-    
-    // Apply sorting
-    result.sort((a, b) => {
-      if (sortBy === "dueDate") {
-        // Sort by due date (ascending)
-        if (!a.dueDate) return 1;
-        if (!b.dueDate) return -1;
-        return new Date(a.dueDate) - new Date(b.dueDate);
-      } else if (sortBy === "priority") {
-        // Sort by priority (high to low)
-        const priorityValues = { High: 3, Medium: 2, Low: 1 };
-        return priorityValues[b.priority] - priorityValues[a.priority];
-      } else if (sortBy === "title") {
-        // Sort by title (A-Z)
-        return a.title.localeCompare(b.title);
-      }
-      return 0;
-    });
-    
-    return result;
-  }, [tasks, filterBy, sortBy]);
-
   const getFilterCount = (filter) => {
-    if (filter === "all") return tasks.length;
-    if (filter === "completed") return tasks.filter(t => t.status === "Completed").length;
-    if (filter === "inprogress") return tasks.filter(t => t.status === "In Progress").length;
-    if (filter === "todo") return tasks.filter(t => t.status === "Todo").length;
-    if (filter === "high") return tasks.filter(t => t.priority === "High").length;
-    return 0;
+    // Server-side counters, so badges don't need every task loaded
+    if (stats) {
+      if (filter === "all") return stats.total;
+      if (filter === "completed") return stats.byStatus["Completed"] || 0;
+      if (filter === "inprogress") return stats.byStatus["In Progress"] || 0;
+      if (filter === "todo") return stats.byStatus["Todo"] || 0;
+      if (filter === "high") return stats.byPriority["High"] || 0;
+      return 0;
+    }
+    // Only the loaded pages are here, so don't pretend they are the total
+    return "…";
   };
   
   // Add this check for the Add Task button visibility
@@ -317,7 +291,7 @@ const TasksList = ({
           <div className="flex flex-wrap gap-2 justify-between items-center">
             <Tabs 
               value={filterBy}
-              onValueChange={setFilterBy}
+              onValueChange={onFilterChange}
               className="w-auto"
             >
               <TabsList>
@@ -341,7 +315,7 @@ const TasksList = ({
             
             <div className="flex items-center gap-2">
               <SortDesc className="h-4 w-4 text-gray-500" />
-              <Select value={sortBy} onValueChange={setSortBy}>
+              <Select value={sortBy} onValueChange={onSortChange}>
                 <SelectTrigger className="w-[160px] h-8 text-xs">
                   <SelectValue placeholder="Sort by" />
                 </SelectTrigger>
@@ -356,7 +330,7 @@ const TasksList = ({
         </div>
 
         <div className="p-4 space-y-3 max-h-[500px] overflow-y-auto">
-          {filteredTasks.length === 0 ? (
+          {tasks.length === 0 ? (
             <div className="text-center py-10 text-gray-500 bg-gray-50 rounded-lg border border-dashed">
               <div className="flex flex-col items-center justify-center">
                 <Filter className="h-10 w-10 text-gray-400 mb-2" />
@@ -365,8 +339,8 @@ const TasksList = ({
                   variant="link" 
                   className="mt-1" 
                   onClick={() => {
-                    setFilterBy("all");
-                    setSortBy("dueDate");
+                    onFilterChange("all");
+                    onSortChange("dueDate");
                   }}
                 >
                   Reset filters
@@ -374,7 +348,7 @@ const TasksList = ({
               </div>
             </div>
           ) : (
-            filteredTasks.map((task) => (
+            tasks.map((task) => (
               <div
                 key={task.id}
                 className={`border-l-4 ${getStatusColor(task.status)} bg-white shadow-sm hover:shadow-md transition-shadow p-4 rounded-md border border-l-[6px]`}
@@ -443,6 +417,18 @@ const TasksList = ({
               </div>
             ))
           )}
+          {hasMore && (
+            <div className="flex justify-center pt-1">
+              <Button
+                variant="outline"
+                size="sm"
+                onClick={onLoadMore}
+                disabled={loadingMore}
+              >
+                {loadingMore ? "Loading..." : "Load more tasks"}
+              </Button>
+            </div>
+          )}
         </div>
       </CardContent>
       {isDialogOpen && (
@@ -1,68 +1,86 @@
 
 import React, { useState, useEffect } from "react";
-import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
+import { useQuery, useInfiniteQuery, useMutation, useQueryClient, keepPreviousData } from "@tanstack/react-query";
 import ProjectHeader from "../components/ProjectHeader";
 import MembersList from "../components/MembersList";
 import TasksList from "../components/TasksList";
 import CollaborativeEditor from "../components/CollaborativeEditor";
 import { toast } from "sonner";
 import { 
-  fetchProject, 
-  fetchMembers, 
-  fetchTasks, 
-  fetchDocument,
+  fetchDashboard, 
+  fetchTasksPage, 
+  fetchTaskStats,
   updateProject,
   addMember,
   removeMember,
   addTask,
   updateTaskStatus,
-  updateDocument 
+  updateDocument,
+  patchDocument
 } from "../api";
 
+const DASHBOARD_SECTIONS = ['project', 'members', 'document'];
+
+// Query parameters for each filter tab of the task list
+const TASK_FILTERS = {
+  all: {},
+  todo: { status: "Todo" },
+  inprogress: { status: "In Progress" },
+  completed: { status: "Completed" },
+  high: { priority: "High" },
+};
+
 const Index = () => {
   const queryClient = useQueryClient();
   
-  // Fetch project data
-  const { 
-    data: project, 
-    isLoading: projectLoading 
-  } = useQuery({ 
-    queryKey: ['project'], 
-    queryFn: () => fetchProject(1) 
-  });
-  
-  // Fetch members data
+  // Project, members and document in one request. Tasks are paged
+  // separately below, with the list's own filter and sort.
   const { 
-    data: members = [], 
-    isLoading: membersLoading 
+    data: dashboard, 
+    isLoading: dashboardLoading 
   } = useQuery({ 
-    queryKey: ['members'], 
-    queryFn: fetchMembers 
+    queryKey: ['dashboard'], 
+    queryFn: () => fetchDashboard(1, DASHBOARD_SECTIONS) 
   });
+  const project = dashboard?.project;
+  const members = dashboard?.members ?? [];
+  const editorContent = dashboard?.document;
   
-  // Fetch tasks data
+  // Fetch tasks a page at a time, filtered and sorted by the server
+  const [taskFilter, setTaskFilter] = useState("all");
+  const [taskSort, setTaskSort] = useState("dueDate");
   const { 
-    data: tasks = [], 
-    isLoading: tasksLoading 
-  } = useQuery({ 
-    queryKey: ['tasks'], 
-    queryFn: fetchTasks 
+    data: taskPages, 
+    isLoading: tasksLoading,
+    hasNextPage: hasMoreTasks,
+    fetchNextPage: fetchMoreTasks,
+    isFetchingNextPage: loadingMoreTasks
+  } = useInfiniteQuery({ 
+    queryKey: ['tasks', taskFilter, taskSort], 
+    queryFn: ({ pageParam }) => fetchTasksPage({
+      project_id: 1,
+      ...TASK_FILTERS[taskFilter],
+      sort: taskSort,
+      after: pageParam || undefined
+    }),
+    initialPageParam: null,
+    getNextPageParam: (lastPage) => lastPage.nextCursor,
+    // Keep showing the old list while another filter or sort loads
+    placeholderData: keepPreviousData
   });
+  const tasks = taskPages?.pages.flatMap((page) => page.tasks) ?? [];
   
-  // Fetch document data
-  const { 
-    data: editorContent, 
-    isLoading: documentLoading 
-  } = useQuery({ 
-    queryKey: ['document'], 
-    queryFn: () => fetchDocument(1) 
+  // Task counts for the filter badges
+  const { data: taskStats } = useQuery({ 
+    queryKey: ['taskStats'], 
+    queryFn: () => fetchTaskStats(1) 
   });
   
   // Project update mutation
   const projectMutation = useMutation({
     mutationFn: (updatedProject) => updateProject(updatedProject.id, updatedProject),
     onSuccess: () => {
-      queryClient.invalidateQueries({ queryKey: ['project'] });
+      queryClient.invalidateQueries({ queryKey: ['dashboard'] });
       toast.success("Project details updated successfully");
     },
     onError: (error) => {
@@ -74,7 +92,7 @@ const Index = () => {
   const addMemberMutation = useMutation({
     mutationFn: (newMember) => addMember(newMember),
     onSuccess: (data) => {
-      queryClient.invalidateQueries({ queryKey: ['members'] });
+      queryClient.invalidateQueries({ queryKey: ['dashboard'] });
       toast.success(`${data.name} added to the team`);
     },
     onError: (error) => {
@@ -85,7 +103,7 @@ const Index = () => {
   const removeMemberMutation = useMutation({
     mutationFn: (memberId) => removeMember(memberId),
     onSuccess: () => {
-      queryClient.invalidateQueries({ queryKey: ['members'] });
+      queryClient.invalidateQueries({ queryKey: ['dashboard'] });
       toast.success("Team member removed");
     },
     onError: (error) => {
@@ -98,6 +116,7 @@ const Index = () => {
     mutationFn: (newTask) => addTask(newTask),
     onSuccess: () => {
       queryClient.invalidateQueries({ queryKey: ['tasks'] });
+      queryClient.invalidateQueries({ queryKey: ['taskStats'] });
       toast.success("New task created");
     },
     onError: (error) => {
@@ -109,6 +128,7 @@ const Index = () => {
     mutationFn: ({ taskId, newStatus }) => updateTaskStatus(taskId, newStatus),
     onSuccess: () => {
       queryClient.invalidateQueries({ queryKey: ['tasks'] });
+      queryClient.invalidateQueries({ queryKey: ['taskStats'] });
       toast.success("Task status updated");
     },
     onError: (error) => {
@@ -118,13 +138,19 @@ const Index = () => {
   
   // Document mutation
   const updateDocumentMutation = useMutation({
-    mutationFn: (content) => updateDocument(1, content),
+    // The editor diffs against the version it last synced and sends one save
+    // at a time; without a version to rebase on it saves the whole document
+    mutationFn: ({ baseVersion, ops, content }) => (
+      baseVersion === undefined
+        ? updateDocument(1, content)
+        : patchDocument(1, baseVersion, ops)
+    ),
     onSuccess: () => {
-      queryClient.invalidateQueries({ queryKey: ['document'] });
+      queryClient.invalidateQueries({ queryKey: ['dashboard'] });
       toast.success("Document saved successfully");
     },
     onError: (error) => {
-      toast.error(`Failed to save document: ${error.message}`);
+      toast.error(`Failed to save document: ${error.response?.data?.error || error.message}`);
     }
   });
 
@@ -152,11 +178,15 @@ const Index = () => {
     updateTaskStatusMutation.mutate({ taskId, newStatus });
   };
 
-  const handleSaveEditorContent = (content) => {
-    updateDocumentMutation.mutate(content);
-  };
+  const handleSaveEditorContent = (save) => updateDocumentMutation.mutateAsync(save);
+
+  const handleReloadEditorContent = () => queryClient.fetchQuery({
+    queryKey: ['dashboard'],
+    queryFn: () => fetchDashboard(1, DASHBOARD_SECTIONS),
+    staleTime: 0
+  }).then((data) => data.document);
 
-  if (projectLoading || membersLoading || tasksLoading || documentLoading) {
+  if (dashboardLoading || tasksLoading) {
     return (
       <div className="min-h-screen flex items-center justify-center bg-gray-100">
         <div className="text-center">
@@ -183,6 +213,14 @@ const Index = () => {
           <div className="md:col-span-2">
             <TasksList 
               tasks={tasks} 
+              stats={taskStats}
+              filterBy={taskFilter}
+              sortBy={taskSort}
+              onFilterChange={setTaskFilter}
+              onSortChange={setTaskSort}
+              hasMore={hasMoreTasks}
+              loadingMore={loadingMoreTasks}
+              onLoadMore={() => fetchMoreTasks()}
               members={members}
               onAddTask={handleAddTask} 
               onUpdateTaskStatus={handleUpdateTaskStatus} 
@@ -191,6 +229,7 @@ const Index = () => {
               <CollaborativeEditor 
                 initialContent={editorContent}
                 onSave={handleSaveEditorContent} 
+                onReload={handleReloadEditorContent}
               />
             )}
           </div>
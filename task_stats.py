@@ -0,0 +1,155 @@
+"""Per-project task counts kept in the `task_counters` table.
+
+Statement-level triggers on tasks fold every insert, update and delete into
+(project_id, dimension, key) -> count rows, so bulk writes cost one upsert
+per distinct counter rather than one per task. Dimensions:
+
+    total      key ''
+    status     key = status
+    priority   key = priority
+    assignee   key = assignee id, '' when unassigned
+    open_due   key = due date (YYYY-MM-DD) of tasks not yet Completed
+
+"Overdue" depends on the current date, so it isn't stored: it is the sum of
+the open_due rows keyed before today, one index range per project.
+"""
+
+TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS task_counters (
+    project_id INTEGER NOT NULL,
+    dimension VARCHAR(16) NOT NULL,
+    key TEXT NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (project_id, dimension, key)
+)
+'''
+
+# Installed by migrations.py. Counter rows are upserted in key order so
+# concurrent statements touching the same project lock them in the same order.
+TRIGGERS_SQL = '''
+CREATE OR REPLACE FUNCTION task_counter_keys(t tasks) RETURNS TABLE (dimension TEXT, key TEXT) AS $$
+    SELECT k.dimension, k.key
+    FROM (VALUES
+        ('total', ''),
+        ('status', t.status::text),
+        ('priority', t.priority::text),
+        ('assignee', COALESCE(t.assignee_id::text, '')),
+        ('open_due', CASE WHEN t.status <> 'Completed' THEN to_char(t.due_date, 'YYYY-MM-DD') END)
+    ) k (dimension, key)
+    WHERE k.key IS NOT NULL
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION maintain_task_counters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM task_counters;
+    ELSIF TG_OP = 'INSERT' THEN
+        INSERT INTO task_counters (project_id, dimension, key, count)
+        SELECT r.project_id, k.dimension, k.key, COUNT(*)
+        FROM new_rows r, task_counter_keys(r) k
+        WHERE r.project_id IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (project_id, dimension, key) DO UPDATE SET count = task_counters.count + EXCLUDED.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO task_counters (project_id, dimension, key, count)
+        SELECT r.project_id, k.dimension, k.key, -COUNT(*)
+        FROM old_rows r, task_counter_keys(r) k
+        WHERE r.project_id IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (project_id, dimension, key) DO UPDATE SET count = task_counters.count + EXCLUDED.count;
+    ELSE
+        INSERT INTO task_counters (project_id, dimension, key, count)
+        SELECT project_id, dimension, key, SUM(delta)
+        FROM (
+            SELECT r.project_id, k.dimension, k.key, 1 AS delta
+            FROM new_rows r, task_counter_keys(r) k
+            UNION ALL
+            SELECT r.project_id, k.dimension, k.key, -1
+            FROM old_rows r, task_counter_keys(r) k
+        ) d
+        WHERE project_id IS NOT NULL
+        GROUP BY 1, 2, 3
+        HAVING SUM(delta) <> 0
+        ORDER BY 1, 2, 3
+        ON CONFLICT (project_id, dimension, key) DO UPDATE SET count = task_counters.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_counters_insert ON tasks;
+CREATE TRIGGER tasks_counters_insert AFTER INSERT ON tasks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_task_counters();
+
+DROP TRIGGER IF EXISTS tasks_counters_update ON tasks;
+CREATE TRIGGER tasks_counters_update AFTER UPDATE ON tasks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_task_counters();
+
+DROP TRIGGER IF EXISTS tasks_counters_delete ON tasks;
+CREATE TRIGGER tasks_counters_delete AFTER DELETE ON tasks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_task_counters();
+
+DROP TRIGGER IF EXISTS tasks_counters_truncate ON tasks;
+CREATE TRIGGER tasks_counters_truncate AFTER TRUNCATE ON tasks
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_task_counters();
+'''
+
+RECOMPUTE_SQL = '''
+    SELECT t.project_id, k.dimension, k.key, COUNT(*)
+    FROM tasks t, task_counter_keys(t) k
+    WHERE t.project_id IS NOT NULL
+    GROUP BY 1, 2, 3
+'''
+
+
+def rebuild(cur):
+    """Recompute every counter from the tasks table.
+
+    Holds a SHARE lock on tasks until the caller's transaction ends, so task
+    writes wait rather than slip between the delete and the recount.
+    """
+    cur.execute('LOCK TABLE tasks IN SHARE MODE')
+    cur.execute('DELETE FROM task_counters')
+    cur.execute('INSERT INTO task_counters (project_id, dimension, key, count) ' + RECOMPUTE_SQL)
+    return cur.rowcount
+
+
+def mismatches(cur):
+    """Counters whose stored value differs from a recount, as
+    (project_id, dimension, key, stored, recomputed) rows.
+
+    A single statement reads tasks and task_counters from one snapshot, so
+    concurrent writes can't show up as false mismatches.
+    """
+    cur.execute(f'''
+        WITH recomputed AS ({RECOMPUTE_SQL}),
+             stored AS (SELECT project_id, dimension, key, count FROM task_counters WHERE count <> 0)
+        SELECT project_id, dimension, key, COALESCE(s.count, 0), COALESCE(r.count, 0)
+        FROM stored s FULL JOIN recomputed r USING (project_id, dimension, key)
+        WHERE s.count IS DISTINCT FROM r.count
+        ORDER BY 1, 2, 3
+    ''')
+    return cur.fetchall()
+
+
+def to_json(project_id, rows):
+    # rows: (dimension, key, count) from the task_stats statement
+    stats = {'projectId': project_id, 'total': 0, 'byStatus': {}, 'byPriority': {},
+             'byAssignee': {}, 'overdue': 0}
+    for dimension, key, count in rows:
+        if dimension == 'total':
+            stats['total'] = count
+        elif dimension == 'overdue':
+            stats['overdue'] = count
+        elif dimension == 'status':
+            stats['byStatus'][key] = count
+        elif dimension == 'priority':
+            stats['byPriority'][key] = count
+        elif dimension == 'assignee':
+            stats['byAssignee'][key or 'unassigned'] = count
+    return stats
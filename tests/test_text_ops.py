@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+import text_ops
+
+
+def insert(offset, text, field='text'):
+    return {'op': 'insert', 'field': field, 'offset': offset, 'text': text}
+
+
+def delete(offset, length, field='text'):
+    return {'op': 'delete', 'field': field, 'offset': offset, 'length': length}
+
+
+DOC = {'text': 'hello world', 'code': 'x = 1'}
+
+
+def apply_all(doc, *op_lists):
+    for ops in op_lists:
+        doc = text_ops.apply(doc, ops)
+    return doc
+
+
+def rebase_both(a, b):
+    # (a after b, b after a) with one tie-break for both; transform()
+    # itself always lets the ops it rebases over win ties
+    b_after_a = []
+    for other in b:
+        a, pieces = text_ops._rebase(a, other)
+        b_after_a.extend(pieces)
+    return a, b_after_a
+
+
+@pytest.mark.parametrize('a, b', [
+    ([insert(0, 'A')], [insert(5, 'B')]),
+    ([insert(5, 'A')], [insert(0, 'B')]),
+    ([insert(3, 'A')], [delete(1, 5)]),
+    ([insert(1, 'A')], [delete(1, 5)]),
+    ([insert(6, 'A')], [delete(1, 5)]),
+    ([delete(1, 5)], [insert(3, 'A')]),
+    ([delete(0, 4)], [delete(2, 6)]),
+    ([delete(2, 6)], [delete(0, 4)]),
+    ([delete(2, 3)], [delete(0, 11)]),
+    ([delete(3, 2)], [delete(3, 2)]),
+    ([insert(0, 'A', 'code')], [delete(0, 5)]),
+    ([delete(6, 5), insert(6, 'there')], [insert(0, '>> '), delete(3, 2)]),
+])
+def test_transform_converges(a, b):
+    # Whichever edit the server commits first, the result is the same
+    assert apply_all(DOC, b, text_ops.transform(a, b)) == apply_all(DOC, a, text_ops.transform(b, a))
+
+
+def test_committed_insert_wins_tie():
+    ops = text_ops.transform([insert(5, 'B')], [insert(5, 'A')])
+    assert apply_all(DOC, [insert(5, 'A')], ops)['text'] == 'helloAB world'
+
+
+def test_insert_inside_deleted_range_survives():
+    ops = text_ops.transform([insert(3, 'A')], [delete(1, 5)])
+    assert apply_all(DOC, [delete(1, 5)], ops)['text'] == 'hAworld'
+
+
+def test_offsets_count_utf16_units():
+    doc = {'text': 'a\U0001F600b', 'code': ''}
+    ops = text_ops.transform([insert(3, '!')], [insert(0, '\U0001F600')])
+    assert ops == [insert(5, '!')]
+    assert apply_all(doc, [insert(0, '\U0001F600')], ops)['text'] == '\U0001F600a\U0001F600!b'
+
+
+def test_rebases_over_several_versions():
+    # A client two versions behind rebases over both, in commit order
+    committed = [[insert(0, 'Say: ')], [delete(5, 5)]]
+    ops = text_ops.transform([insert(11, '!')], [op for ops in committed for op in ops])
+    assert apply_all(DOC, *committed, ops)['text'] == 'Say:  world!'
+
+
+def boundaries(text):
+    # UTF-16 offsets that don't fall inside a surrogate pair
+    offsets = [0]
+    for char in text:
+        offsets.append(offsets[-1] + text_ops.len16(char))
+    return offsets
+
+
+def random_ops(rng, doc):
+    ops = []
+    for _ in range(rng.randint(1, 3)):
+        field = rng.choice(text_ops.FIELDS)
+        offsets = boundaries(doc[field])
+        if len(offsets) > 1 and rng.random() < 0.5:
+            start, end = sorted(rng.sample(offsets, 2))
+            op = delete(start, end - start, field)
+        else:
+            op = insert(rng.choice(offsets), rng.choice(['a', 'bc', '\U0001F600']), field)
+        ops.append(op)
+        doc = text_ops.apply(doc, [op])
+    return ops
+
+
+def test_random_edits_converge():
+    rng = random.Random(4)
+    for _ in range(5000):
+        a, b = random_ops(rng, DOC), random_ops(rng, DOC)
+        a_after_b, b_after_a = rebase_both(a, b)
+        assert a_after_b == text_ops.transform(a, b)
+        assert apply_all(DOC, b, a_after_b) == apply_all(DOC, a, b_after_a), (a, b)
@@ -0,0 +1,152 @@
+"""Insert/delete operations on the document fields, and their rebasing.
+
+An op is a dict:
+
+    {'op': 'insert', 'field': 'text', 'offset': 3, 'text': 'abc'}
+    {'op': 'delete', 'field': 'code', 'offset': 0, 'length': 2}
+
+Ops in a list apply one after another. Offsets count UTF-16 code units so
+they line up with JavaScript string indices in the editor.
+"""
+
+FIELDS = ('text', 'code')
+
+
+class InvalidOps(ValueError):
+    pass
+
+
+def validate(ops):
+    if not isinstance(ops, list) or not ops:
+        raise InvalidOps('ops must be a non-empty list')
+    clean = []
+    for op in ops:
+        if not isinstance(op, dict) or op.get('field') not in FIELDS:
+            raise InvalidOps("each op needs a field of 'text' or 'code'")
+        offset = op.get('offset')
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise InvalidOps('offset must be a non-negative integer')
+        if op.get('op') == 'insert':
+            if not isinstance(op.get('text'), str):
+                raise InvalidOps('insert needs a text string')
+            if op['text']:
+                clean.append({'op': 'insert', 'field': op['field'], 'offset': offset, 'text': op['text']})
+        elif op.get('op') == 'delete':
+            length = op.get('length')
+            if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+                raise InvalidOps('delete needs a non-negative integer length')
+            if length:
+                clean.append({'op': 'delete', 'field': op['field'], 'offset': offset, 'length': length})
+        else:
+            raise InvalidOps("op must be 'insert' or 'delete'")
+    return clean
+
+
+def apply(fields, ops):
+    # fields: {'text': str, 'code': str}; returns a new dict
+    buffers = {}
+    for op in ops:
+        field = op['field']
+        if field not in buffers:
+            buffers[field] = bytearray((fields.get(field) or '').encode('utf-16-le'))
+        buf = buffers[field]
+        start = op['offset'] * 2
+        if op['op'] == 'insert':
+            if start > len(buf):
+                raise InvalidOps(f'insert offset {op["offset"]} is past the end of {field}')
+            buf[start:start] = op['text'].encode('utf-16-le')
+        else:
+            end = start + op['length'] * 2
+            if end > len(buf):
+                raise InvalidOps(f'delete range ends past the end of {field}')
+            del buf[start:end]
+
+    result = dict(fields)
+    for field, buf in buffers.items():
+        try:
+            result[field] = buf.decode('utf-16-le')
+        except UnicodeDecodeError:
+            raise InvalidOps(f'ops split a surrogate pair in {field}')
+    return result
+
+
+def transform(ops, against):
+    """Rebase `ops` so they apply after `against`.
+
+    Both lists must start from the same document state. `against` holds
+    already-committed ops, so they win ties on equal insert offsets.
+    """
+    for other in against:
+        ops, _ = _rebase(ops, other)
+    return ops
+
+
+def _rebase(ops, other):
+    # Returns (ops after `other`, `other` after ops)
+    if len(ops) == 1:
+        return _transform_pair(ops[0], other)
+    others = [other]
+    result = []
+    for op in ops:
+        pieces = [op]
+        rebased_others = []
+        for o in others:
+            pieces, o_pieces = _rebase(pieces, o)
+            rebased_others.extend(o_pieces)
+        result.extend(pieces)
+        others = rebased_others
+    return result, others
+
+
+def _insert(op, offset):
+    return dict(op, offset=offset)
+
+
+def _delete(op, offset, length):
+    return [dict(op, offset=offset, length=length)] if length > 0 else []
+
+
+def _transform_pair(a, b):
+    if a['field'] != b['field']:
+        return [a], [b]
+
+    if a['op'] == 'insert' and b['op'] == 'insert':
+        if a['offset'] < b['offset']:
+            return [a], [_insert(b, b['offset'] + len16(a['text']))]
+        return [_insert(a, a['offset'] + len16(b['text']))], [b]
+
+    if a['op'] == 'insert':
+        b_end = b['offset'] + b['length']
+        if a['offset'] <= b['offset']:
+            return [a], [_insert(b, b['offset'] + len16(a['text']))]
+        if a['offset'] >= b_end:
+            return [_insert(a, a['offset'] - b['length'])], [b]
+        # Insert lands inside the deleted range: keep it, delete around it
+        head = a['offset'] - b['offset']
+        return [_insert(a, b['offset'])], (
+            _delete(b, b['offset'], head)
+            + _delete(b, b['offset'] + len16(a['text']), b['length'] - head)
+        )
+
+    if b['op'] == 'insert':
+        # Same geometry as the case above with the roles swapped; ties
+        # don't matter since an insert and a delete never compete for a slot
+        b_after_a, a_after_b = _transform_pair(b, a)
+        return a_after_b, b_after_a
+
+    # Two deletes: each one loses whatever the other already removed
+    def shifted(x, other):
+        start, end = other['offset'], other['offset'] + other['length']
+        if x <= start:
+            return x
+        if x < end:
+            return start
+        return x - other['length']
+
+    a_start, a_end = shifted(a['offset'], b), shifted(a['offset'] + a['length'], b)
+    b_start, b_end = shifted(b['offset'], a), shifted(b['offset'] + b['length'], a)
+    return _delete(a, a_start, a_end - a_start), _delete(b, b_start, b_end - b_start)
+
+
+def len16(text):
+    return len(text.encode('utf-16-le')) // 2